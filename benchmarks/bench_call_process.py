@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark capturing the output of a verbose command with ``call_process``.
+
+Runs a command that prints a large amount of line-oriented output, like a
+verbose salt highstate, through
+:meth:`watchmaker.managers.base.ManagerBase.call_process`, and reports the
+time taken and the peak memory allocated by Python. The output is captured
+as bytes, and as lazy :class:`watchmaker.managers.base.CommandOutput`
+handles that spill to disk. The previous implementation, which concatenated
+bytes for every line, is timed on a smaller output since it is quadratic.
+
+It also reports the average time of many calls to a command that exits at
+once, like the short ``salt-call`` commands of an install, with the pipes
+drained by a selector in the calling thread and by a pool of two threads.
+
+Usage::
+
+    python benchmarks/bench_call_process.py [--size MIB] [--baseline-size MIB]
+        [--calls N]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+import watchmaker.managers.base  # noqa: E402
+from watchmaker.managers.base import ManagerBase  # noqa: E402
+
+# Writes SIZE MiB of 100-byte lines to stdout
+COMMAND = (
+    'import sys\n'
+    'line = b"x" * 99 + b"\\n"\n'
+    'out = getattr(sys.stdout, "buffer", sys.stdout)\n'
+    'for _ in range({0} * 1024 * 1024 // len(line)):\n'
+    '    out.write(line)\n'
+)
+
+
+def _concat_handler(pipe, logger=None, prefix_msg='', output=None):
+    """Capture the output like the previous implementation did."""
+    ret = b''
+    try:
+        for line in iter(pipe.readline, b''):
+            if logger:
+                logger('%s%s', prefix_msg, line.rstrip())
+            ret += line
+    finally:
+        pipe.close()
+
+    class _Output(object):
+        def getvalue(self):
+            return ret
+
+    return _Output()
+
+
+def _run(size, **kwargs):
+    manager = ManagerBase({})
+    cmd = [sys.executable, '-c', COMMAND.format(size)]
+    tracemalloc.start()
+    started = time.time()
+    ret = manager.call_process(cmd, **kwargs)
+    if kwargs.get('lazy_output'):
+        captured = sum(len(chunk) for chunk in ret['stdout'].stream())
+        ret['stdout'].close()
+        ret['stderr'].close()
+    else:
+        captured = len(ret['stdout'])
+    elapsed = time.time() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert captured >= (size * 1024 * 1024) // 100 * 100, 'lost output'
+    return elapsed, peak
+
+
+def _overhead(calls):
+    manager = ManagerBase({})
+    cmd = ['true'] if os.name != 'nt' else ['cmd', '/c', 'exit']
+    started = time.time()
+    for _ in range(calls):
+        manager.call_process(cmd)
+    return (time.time() - started) / calls
+
+
+def _report(name, size, elapsed, peak):
+    print('{0:>22}: {1:4d} MiB in {2:6.2f} s, peak {3:6.1f} MiB'.format(
+        name, size, elapsed, peak / 1024 / 1024))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=50,
+                        help='command output in MiB (default: 50)')
+    parser.add_argument('--calls', type=int, default=500,
+                        help='calls of a command that exits at once '
+                             '(default: 500)')
+    parser.add_argument('--baseline-size', type=int, default=4,
+                        help='command output in MiB for the previous '
+                             'implementation (default: 4)')
+    args = parser.parse_args()
+
+    # The previous implementation drained the pipes with threads
+    original = ManagerBase.__dict__['_pipe_handler']
+    selectors = watchmaker.managers.base.selectors
+    ManagerBase._pipe_handler = staticmethod(_concat_handler)
+    watchmaker.managers.base.selectors = None
+    try:
+        _report('bytes concatenation', args.baseline_size,
+                *_run(args.baseline_size))
+    finally:
+        ManagerBase._pipe_handler = original
+        watchmaker.managers.base.selectors = selectors
+
+    _report('bytes', args.baseline_size, *_run(args.baseline_size))
+    _report('bytes', args.size, *_run(args.size))
+    _report('lazy, spilled to disk', args.size,
+            *_run(args.size, lazy_output=True))
+
+    for name in ('threads', 'selector'):
+        watchmaker.managers.base.selectors = (
+            selectors if name == 'selector' else None
+        )
+        print('{0:>22}: {1:6.2f} ms per call'.format(
+            name, _overhead(args.calls) * 1000))
+    watchmaker.managers.base.selectors = selectors
+
+
+if __name__ == '__main__':
+    main()
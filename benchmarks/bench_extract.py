@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark archive extraction by codec and by number of zip workers.
+
+Generates a tree shaped like a bundle of salt formulas (many directories of
+small ``.sls``, ``.jinja`` and ``.yaml`` files), archives it with each codec
+supported by :meth:`watchmaker.managers.base.ManagerBase.extract_contents`,
+and times extracting each archive. The zip archive is extracted with several
+worker counts.
+
+Usage::
+
+    python benchmarks/bench_extract.py [--formulas N] [--files N] [--runs N]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+from watchmaker.managers.base import ManagerBase  # noqa: E402
+
+WORDS = (
+    'pkg', 'installed', 'file', 'managed', 'service', 'running', 'enable',
+    'require', 'watch', 'source', 'salt', 'pillar', 'grains', 'name', 'user',
+    'group', 'mode', 'template', 'jinja', 'contents', 'cmd', 'run', 'unless',
+)
+
+
+def _tree(root, formulas, files):
+    rnd = random.Random(0)
+    for formula in range(formulas):
+        for index in range(files):
+            path = os.path.join(
+                root, 'formula-{0}'.format(formula), 'states',
+                'dir-{0}'.format(index % 8),
+                'file-{0}.{1}'.format(
+                    index, ('sls', 'jinja', 'yaml')[index % 3])
+            )
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            lines = [
+                '{0}:\n  {1}: {2}-{3}'.format(
+                    rnd.choice(WORDS), rnd.choice(WORDS), rnd.choice(WORDS),
+                    rnd.randint(0, 1000))
+                for _ in range(rnd.randint(20, 200))
+            ]
+            with io.open(path, 'w') as fh_:
+                fh_.write('\n'.join(lines))
+
+
+def _archives(root, directory):
+    archives = {}
+    path = os.path.join(directory, 'bundle.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                zip_.write(full, os.path.relpath(full, root))
+    archives['zip'] = path
+
+    for suffix, mode in (
+        ('tar.gz', 'w:gz'), ('tar.bz2', 'w:bz2'), ('tar.xz', 'w:xz')
+    ):
+        path = os.path.join(directory, 'bundle.' + suffix)
+        with tarfile.open(path, mode) as tar:
+            tar.add(root, arcname='.')
+        archives[suffix] = path
+
+    try:
+        import zstandard
+    except ImportError:
+        print('zstandard is not installed, skipping tar.zst')
+    else:
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tar:
+            tar.add(root, arcname='.')
+        path = os.path.join(directory, 'bundle.tar.zst')
+        with open(path, 'wb') as fh_:
+            fh_.write(zstandard.ZstdCompressor().compress(buf.getvalue()))
+        archives['tar.zst'] = path
+    return archives
+
+
+def _time(path, directory, runs, **kwargs):
+    manager = ManagerBase({})
+    timings = []
+    for _ in range(runs):
+        target = tempfile.mkdtemp(dir=directory)
+        started = time.time()
+        manager.extract_contents(path, target, **kwargs)
+        timings.append(time.time() - started)
+        shutil.rmtree(target)
+    return min(timings)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--formulas', type=int, default=40)
+    parser.add_argument('--files', type=int, default=75,
+                        help='files per formula (default: 75)')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        root = os.path.join(directory, 'tree')
+        _tree(root, args.formulas, args.files)
+        archives = _archives(root, directory)
+
+        print('{0} files, {1} CPUs, best of {2}'.format(
+            args.formulas * args.files, multiprocessing.cpu_count(),
+            args.runs))
+        for name in ('tar.gz', 'tar.bz2', 'tar.xz', 'tar.zst'):
+            if name in archives:
+                print('{0:>12}: {1:6.3f} s  ({2:.1f} MiB)'.format(
+                    name, _time(archives[name], directory, args.runs),
+                    os.path.getsize(archives[name]) / 1024 / 1024))
+        for workers in (1, 2, 4, 8):
+            print('{0:>12}: {1:6.3f} s  ({2:.1f} MiB)'.format(
+                'zip x{0}'.format(workers),
+                _time(archives['zip'], directory, args.runs,
+                      max_workers=workers),
+                os.path.getsize(archives['zip']) / 1024 / 1024))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
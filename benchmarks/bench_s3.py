@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark single-stream and parallel ranged downloads of a large S3 object.
+
+Runs a local S3-compatible stand-in that serves one object with ``Range``
+and ``If-Match`` support, and limits the throughput of each connection to
+mimic the per-connection bandwidth of S3. The object is then read through
+:class:`watchmaker.utils.urllib.request_handlers.S3Handler` with ranged GETs
+disabled and enabled.
+
+Usage::
+
+    python benchmarks/bench_s3.py [--size MIB] [--rate MIBPS] [--runs N]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import argparse
+import hashlib
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from email.utils import formatdate
+
+import boto3
+import botocore.config
+from six.moves import BaseHTTPServer, socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+from watchmaker.utils import urllib  # noqa: E402
+from watchmaker.utils.urllib.request_handlers import S3Handler  # noqa: E402
+
+BUCKET = 'watchmaker-bench'
+KEY = 'salt-content.zip'
+CHUNK = 64 * 1024
+
+
+class _S3Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve one object with the headers boto3 expects from S3."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):  # noqa: D102
+        pass
+
+    def _headers(self):
+        server = self.server
+        if self.path.split('?')[0] != '/{0}/{1}'.format(BUCKET, KEY):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        if self.headers.get('If-Match', server.etag) != server.etag:
+            self.send_response(412)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        start, end = 0, len(server.data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end, len(server.data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):  # noqa: D102,N802
+        self.server.calls.append('HEAD')
+        self._headers()
+
+    def do_GET(self):  # noqa: D102,N802
+        self.server.calls.append('GET')
+        span = self._headers()
+        if span is None:
+            return
+        view = memoryview(self.server.data)[span[0]:span[1] + 1]
+        # Throttle each connection to the configured rate
+        started = time.time()
+        for offset in range(0, len(view), CHUNK):
+            try:
+                self.wfile.write(view[offset:offset + CHUNK])
+            except socket.error:
+                # The client stopped reading, e.g. after the first part
+                self.close_connection = True
+                return
+            delay = (offset + CHUNK) / self.server.rate - (
+                time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _serve(data, rate):
+    server = _Server(('127.0.0.1', 0), _S3Handler)
+    server.data = data
+    server.etag = '"{0}"'.format(hashlib.md5(data).hexdigest())
+    server.last_modified = formatdate(usegmt=True)
+    server.rate = rate
+    server.calls = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _download(endpoint, threshold):
+    handler = S3Handler(multipart_threshold=threshold)
+    handler.client = boto3.client(
+        's3',
+        endpoint_url=endpoint,
+        region_name='us-east-1',
+        aws_access_key_id='bench',
+        aws_secret_access_key='bench',
+        config=botocore.config.Config(
+            s3={'addressing_style': 'path'},
+            max_pool_connections=S3Handler.MAX_CONCURRENCY + 2,
+        ),
+    )
+    opener = urllib.request.build_opener(handler)
+    digest = hashlib.sha256()
+    started = time.time()
+    response = opener.open('s3://{0}/{1}'.format(BUCKET, KEY))
+    while True:
+        buf = response.read(1024 * 1024)
+        if not buf:
+            break
+        digest.update(buf)
+    return time.time() - started, digest.hexdigest()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=128,
+                        help='object size in MiB (default: 128)')
+    parser.add_argument('--rate', type=int, default=32,
+                        help='throughput per connection in MiB/s '
+                             '(default: 32)')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    expected = hashlib.sha256(data).hexdigest()
+    server = _serve(data, args.rate * 1024 * 1024)
+    endpoint = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+
+    print('{0} MiB object, {1} MiB/s per connection, best of {2}'.format(
+        args.size, args.rate, args.runs))
+    results = {}
+    for name, threshold in (
+        ('single-stream', None),
+        ('ranged', S3Handler.MULTIPART_THRESHOLD),
+    ):
+        timings = []
+        for _ in range(args.runs):
+            del server.calls[:]
+            elapsed, digest = _download(endpoint, threshold)
+            assert digest == expected, 'corrupted download'
+            timings.append(elapsed)
+        results[name] = min(timings)
+        print('{0:>14}: {1:6.2f} s  {2:7.1f} MiB/s  {3} HEAD, {4} GET'.format(
+            name, results[name], args.size / results[name],
+            server.calls.count('HEAD'), server.calls.count('GET')))
+    print('speedup: {0:.1f}x'.format(
+        results['single-stream'] / results['ranged']))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
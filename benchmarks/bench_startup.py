@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark watchmaker startup with and without eagerly importing boto3.
+
+Each scenario runs in a fresh interpreter that imports watchmaker and reads
+the default config through :func:`watchmaker.utils.urlopen_retry`. The
+``eager-boto3`` scenario additionally imports boto3 and installs the S3
+handler, which is what every run paid before the S3 opener became lazy.
+
+Usage::
+
+    python benchmarks/bench_startup.py [--runs N]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src')
+
+PROBE = '''
+import json, os, resource, sys, time
+start = time.time()
+import watchmaker
+import watchmaker.utils
+from watchmaker import static
+if {eager!r}:
+    import boto3
+    from watchmaker.utils.urllib import request
+    from watchmaker.utils.urllib.request_handlers import S3Handler
+    request.install_opener(request.build_opener(S3Handler))
+uri = watchmaker.utils.uri_from_filepath(
+    os.path.join(static.__path__[0], 'config.yaml'))
+watchmaker.utils.urlopen_retry(uri).read()
+print(json.dumps({{
+    'elapsed': time.time() - start,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'boto3': 'boto3' in sys.modules,
+}}))
+'''
+
+
+def _run(eager):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        x for x in (SRC_DIR, env.get('PYTHONPATH')) if x)
+    out = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(eager=eager)], env=env)
+    return json.loads(out.decode('utf-8'))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print('{0:<12} {1:>12} {2:>14} {3:>7}'.format(
+        'scenario', 'median (ms)', 'max rss (MiB)', 'boto3'))
+    for name, eager in (('lazy', False), ('eager-boto3', True)):
+        results = [_run(eager) for _ in range(args.runs)]
+        elapsed = sorted(r['elapsed'] for r in results)[len(results) // 2]
+        rss = max(r['maxrss_kb'] for r in results) / 1024.0
+        print('{0:<12} {1:>12.1f} {2:>14.1f} {3:>7}'.format(
+            name, elapsed * 1000, rss, str(results[0]['boto3'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark parsing the return of a large salt state run.
+
+Generates a synthetic highstate return with many states, a few of which
+failed. It compares the previous approach against
+:meth:`watchmaker.workers.salt.SaltBase._get_failed_states`. The previous
+approach decoded the python repr printed by the ``local`` returner with
+:func:`ast.literal_eval` and then walked it. The new method streams the
+JSON output from a :class:`watchmaker.managers.base.CommandOutput`. Time and
+the peak memory allocated by Python are reported.
+
+Usage::
+
+    python benchmarks/bench_state_returns.py [--states N] [--runs N]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import argparse
+import ast
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+from watchmaker.managers.base import CommandOutput  # noqa: E402
+from watchmaker.workers.salt import SaltBase  # noqa: E402
+
+
+def _states(count):
+    states = {}
+    for index in range(count):
+        name = 'file-{0}'.format(index)
+        result = index % 997 != 0
+        states['file_|-{0}_|-/etc/{0}.conf_|-managed'.format(name)] = {
+            '__id__': name,
+            '__run_num__': index,
+            '__sls__': 'formula-{0}.config'.format(index % 40),
+            'changes': {'diff': 'New file'} if index % 3 == 0 else {},
+            'comment': 'File /etc/{0}.conf updated'.format(name),
+            'duration': 12.345,
+            'name': '/etc/{0}.conf'.format(name),
+            'result': result,
+            'start_time': '12:34:56.789012',
+        }
+    return states
+
+
+def _literal_eval(stdout):
+    """Parse the return like the previous implementation did."""
+    state_ret = ast.literal_eval(stdout.decode('utf-8'))
+    failed_states = {}
+    for state, data in state_ret['return'].items():
+        if data['result'] is False:
+            failed_states[state.split('_|-')[1]] = data
+    return failed_states
+
+
+def _stream(stdout):
+    output = CommandOutput()
+    output.write(stdout)
+    with output:
+        return SaltBase({})._get_failed_states(output.stream())[0]
+
+
+def _measure(func, stdout, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.time()
+        failed = func(stdout)
+        timings.append(time.time() - started)
+    # Tracing slows allocations down, measure memory in a separate run
+    tracemalloc.start()
+    func(stdout)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak, failed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--states', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    states = _states(args.states)
+    outputs = (
+        ('literal_eval', _literal_eval, repr({
+            'fun': 'state.highstate', 'id': 'local', 'jid': '1',
+            'retcode': 2, 'return': states,
+        }).encode('utf-8')),
+        ('json stream', _stream, json.dumps(
+            {'local': states}, indent=4
+        ).encode('utf-8')),
+    )
+
+    print('{0} states, best of {1}'.format(args.states, args.runs))
+    results = []
+    for name, func, stdout in outputs:
+        elapsed, peak, failed = _measure(func, stdout, args.runs)
+        results.append(failed)
+        print('{0:>14}: {1:6.2f} s, peak {2:6.1f} MiB for {3:.1f} MiB of '
+              'output, {4} failed'.format(
+                  name, elapsed, peak / 1024 / 1024,
+                  len(stdout) / 1024 / 1024, len(failed)))
+    assert results[0] == results[1], 'different failed states'
+
+
+if __name__ == '__main__':
+    main()
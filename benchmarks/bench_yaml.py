@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the pure-python and libyaml YAML loaders/dumpers.
+
+Generates a large watchmaker config (long ``repo_map`` list, many
+``user_formulas``) and a large failed-state report, then times parsing and
+dumping them with ``SafeLoader``/``SafeDumper`` and with the loader/dumper
+used by :mod:`watchmaker.utils`.
+
+Usage::
+
+    python benchmarks/bench_yaml.py [--repos N] [--formulas N] [--runs N]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import argparse
+import os
+import sys
+import timeit
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+import watchmaker.utils  # noqa: E402
+
+
+def _config(repos, formulas):
+    repo_map = [
+        {
+            'dist': ['redhat', 'centos'],
+            'el_version': 6 + (i % 2),
+            'url': 'https://example.com/yum.defs/repo-{0}.repo'.format(i),
+        }
+        for i in range(repos)
+    ]
+    user_formulas = dict(
+        ('formula-{0}'.format(i),
+         'https://example.com/formulas/formula-{0}.zip'.format(i))
+        for i in range(formulas)
+    )
+    return {
+        'all': [{'salt': {'user_formulas': user_formulas}}],
+        'linux': [{'yum': {'repo_map': repo_map}}],
+    }
+
+
+def _failed_states(count):
+    return {'Salt state execution failed': dict(
+        ('state-{0}'.format(i), {
+            '__run_num__': i,
+            'changes': {},
+            'comment': 'Command "false" run',
+            'duration': 1.5,
+            'name': 'false',
+            'result': False,
+            'start_time': '00:00:00.000000',
+        })
+        for i in range(count)
+    )}
+
+
+def _time(func, runs):
+    return min(timeit.repeat(func, number=1, repeat=runs))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repos', type=int, default=5000)
+    parser.add_argument('--formulas', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    config = yaml.safe_dump(
+        _config(args.repos, args.formulas), default_flow_style=False)
+    report = _failed_states(args.repos)
+
+    print('config: {0:.1f} KiB, libyaml: {1}'.format(
+        len(config) / 1024.0, yaml.__with_libyaml__))
+    print('{0:<8} {1:>12} {2:>12} {3:>8}'.format(
+        'op', 'python (ms)', 'helper (ms)', 'speedup'))
+    cases = (
+        ('load',
+         lambda: yaml.safe_load(config),
+         lambda: watchmaker.utils.yaml_safe_load(config)),
+        ('dump',
+         lambda: yaml.safe_dump(report, default_flow_style=False, indent=4),
+         lambda: watchmaker.utils.yaml_safe_dump(
+             report, default_flow_style=False, indent=4)),
+    )
+    for name, python_impl, helper_impl in cases:
+        python_time = _time(python_impl, args.runs)
+        helper_time = _time(helper_impl, args.runs)
+        print('{0:<8} {1:>12.1f} {2:>12.1f} {3:>7.1f}x'.format(
+            name, python_time * 1000, helper_time * 1000,
+            python_time / helper_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,37 +3,62 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
-import collections
 import datetime
+import hashlib
 import logging
 import os
 import platform
+import shutil
 import subprocess
+import sys
 
-import pkg_resources
-import setuptools
-import yaml
+from six.moves import configparser
 
+import watchmaker.config
 import watchmaker.utils
 from watchmaker import static
-from watchmaker.exceptions import WatchmakerException
+from watchmaker.exceptions import ChecksumMismatch, WatchmakerException
 from watchmaker.logger import log_system_details
+from watchmaker.managers.base import ManagerBase
 from watchmaker.managers.workers import (LinuxWorkersManager,
                                          WindowsWorkersManager)
 from watchmaker.utils import urllib
+from watchmaker.utils.cache import DownloadCache
+
+
+def _metadata_version(package_name):
+    """Return the installed version of a distribution from its metadata."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        import importlib_metadata as metadata
+    return metadata.version(package_name)
+
+
+def _setup_cfg_version():
+    """Return the version from ``setup.cfg`` when running from source."""
+    parser = configparser.ConfigParser()
+    parser.read(os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+        'setup.cfg'
+    ))
+    return parser.get('metadata', 'version')
 
 
 def _extract_version(package_name):
     try:
+        return _metadata_version(package_name)
+    except Exception:
+        # Either the metadata backport is not available or the distribution
+        # is not installed (e.g. running from a source checkout)
+        pass
+    try:
+        return _setup_cfg_version()
+    except (configparser.Error, IOError, OSError):
+        # Last resort, e.g. frozen executables on pythons without
+        # importlib.metadata
+        import pkg_resources
         return pkg_resources.get_distribution(package_name).version
-    except pkg_resources.DistributionNotFound:
-        _conf = setuptools.config.read_configuration(
-            os.path.join(
-                os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-                'setup.cfg'
-            )
-        )
-        return _conf['metadata']['version']
 
 
 def _version_info(app_name, version):
@@ -45,12 +70,37 @@ def _version_info(app_name, version):
         platform.release())
 
 
-__version__ = _extract_version('watchmaker')
-VERSION_INFO = _version_info('Watchmaker', __version__)
+_LAZY_ATTRS = {
+    '__version__': lambda: _extract_version('watchmaker'),
+    'VERSION_INFO': lambda: _version_info('Watchmaker', _lazy_attr(
+        '__version__')),
+}
+
+
+def _lazy_attr(name):
+    """Resolve a lazy module attribute once and cache it on the module."""
+    module_globals = globals()
+    if name not in module_globals:
+        module_globals[name] = _LAZY_ATTRS[name]()
+    return module_globals[name]
+
+
+def __getattr__(name):
+    """Resolve ``__version__`` and ``VERSION_INFO`` on first access."""
+    if name in _LAZY_ATTRS:
+        return _lazy_attr(name)
+    raise AttributeError(
+        'module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # Module-level __getattr__ (PEP 562) is not supported, resolve eagerly
+    __version__ = _lazy_attr('__version__')
+    VERSION_INFO = _lazy_attr('VERSION_INFO')
 
 
 class Arguments(dict):
-    """
+    r"""
     Create an arguments object for the :class:`watchmaker.Client`.
 
     Args:
@@ -87,6 +137,43 @@ class Arguments(dict):
             - ``info``
             - ``debug``
 
+        cache_dir: (:obj:`str`)
+            Path to a directory where Watchmaker keeps files that persist
+            across runs, such as the cached copy of a remote config file. If
+            ``None``, the system default is used (``/var/cache/watchmaker`` on
+            Linux, ``C:\Watchmaker\Cache`` on Windows).
+            (*Default*: ``None``)
+
+        config_max_stale: (:obj:`int`)
+            Maximum age, in seconds, of a cached copy of a remote config that
+            may be used when the config cannot be retrieved. The age is
+            counted from the last time the cached copy was validated against
+            the origin. A value of ``0`` disables the fallback. If ``None``,
+            the cached copy may be up to a day old.
+            (*Default*: ``None``)
+
+        max_downloads: (:obj:`int`)
+            Maximum number of concurrent downloads when prefetching the files
+            needed by the workers, before the workers run. A value of ``0``
+            disables the prefetch, so each worker retrieves its own files. If
+            ``None``, up to 8 files are downloaded at once.
+            (*Default*: ``None``)
+
+        download_cache: (:obj:`bool`)
+            Keep the files retrieved by the workers in a persistent cache,
+            under ``downloads`` in the ``cache_dir``. Cached files are
+            revalidated against their origin before use, unless the URL pins
+            a checksum with a ``#sha256=<hex>`` suffix and a file with that
+            checksum is already cached. Remote configs always use this
+            cache.
+            (*Default*: ``False``)
+
+        download_cache_size: (:obj:`int`)
+            Size cap of the download cache, in MiB. The least recently used
+            files are evicted when the cache grows past the cap. If ``None``,
+            the cap is 1024 MiB.
+            (*Default*: ``None``)
+
     .. important::
 
         For all **Keyword Arguments**, below, the default value of ``None``
@@ -171,6 +258,11 @@ class Arguments(dict):
         log_dir=None,
         no_reboot=False,
         log_level=None,
+        cache_dir=None,
+        config_max_stale=None,
+        max_downloads=None,
+        download_cache=False,
+        download_cache_size=None,
         *args,
         **kwargs
     ):
@@ -179,6 +271,11 @@ class Arguments(dict):
         self.log_dir = log_dir
         self.no_reboot = no_reboot
         self.log_level = log_level
+        self.cache_dir = cache_dir
+        self.config_max_stale = config_max_stale
+        self.max_downloads = max_downloads
+        self.download_cache = download_cache
+        self.download_cache_size = download_cache_size
         self.admin_groups = kwargs.pop('admin_groups', None)
         self.admin_users = kwargs.pop('admin_users', None)
         self.computer_name = kwargs.pop('computer_name', None)
@@ -205,6 +302,9 @@ class Client(object):
             A dictionary of arguments. See :class:`watchmaker.Arguments`.
     """
 
+    DEFAULT_MAX_DOWNLOADS = 8
+    DEFAULT_DOWNLOAD_CACHE_SIZE = 1024
+
     def __init__(self, arguments):
         self.log = logging.getLogger(
             '{0}.{1}'.format(__name__, self.__class__.__name__)
@@ -215,7 +315,9 @@ class Client(object):
         header = ' WATCHMAKER RUN '
         header = header.rjust((40 + len(header) // 2), '#').ljust(80, '#')
         self.log.info(header)
-        self.log.debug('Watchmaker Version: %s', __version__)
+        self.log.debug(
+            'Watchmaker Version: %s', _lazy_attr('__version__')
+        )
         self.log.debug('Parameters: %s', arguments)
         self.log.debug('Extra Parameters: %s', extra_arguments)
 
@@ -225,6 +327,12 @@ class Client(object):
         self.config_path = arguments.pop('config_path')
         self.log_dir = arguments.pop('log_dir')
         self.log_level = arguments.pop('log_level')
+        self.cache_dir = arguments.pop('cache_dir', None)
+        self.config_max_stale = arguments.pop('config_max_stale', None)
+        self.max_downloads = arguments.pop('max_downloads', None)
+        self.download_cache = arguments.pop('download_cache', False)
+        self.download_cache_size = arguments.pop('download_cache_size', None)
+        self.config_sha256 = None
 
         log_system_details(self.log)
 
@@ -251,6 +359,48 @@ class Client(object):
 
         self.config = self._get_config()
 
+    def _read_config(self):
+        """Return the raw config data, using the download cache if remote."""
+        scheme = watchmaker.utils.scheme_from_uri(
+            urllib.parse.urlparse(self.config_path)
+        )
+        if scheme == 'file' or not self.system_params.get('cachedir'):
+            return self._download_config()
+
+        max_stale = DownloadCache.DEFAULT_MAX_STALE
+        if self.config_max_stale is not None:
+            max_stale = int(self.config_max_stale)
+        try:
+            cache = DownloadCache(
+                os.path.join(self.system_params['cachedir'], 'downloads'),
+                max_size=self.system_params.get('downloadcachesize')
+            )
+            return cache.fetch(
+                self.config_path, sha256=self.config_sha256,
+                max_stale=max_stale
+            )
+        except urllib.error.URLError:
+            raise
+        except (IOError, OSError) as exc:
+            # The cache is optional, e.g. the cachedir may be read-only
+            self.log.warning(
+                'Download cache unavailable, reading the config directly: '
+                '%s', exc
+            )
+            return self._download_config()
+
+    def _download_config(self):
+        """Return the raw config data, read without the download cache."""
+        data = watchmaker.utils.urlopen_retry(self.config_path).read()
+        digest = hashlib.sha256(data).hexdigest()
+        if self.config_sha256 and digest != self.config_sha256:
+            raise ChecksumMismatch(
+                'Checksum mismatch for {0}: expected sha256={1}, '
+                'got sha256={2}'.format(
+                    self.config_path, self.config_sha256, digest)
+            )
+        return data
+
     def _get_config(self):
         """
         Read and validate configuration data for installation.
@@ -258,7 +408,9 @@ class Client(object):
         Returns:
             :obj:`collections.OrderedDict`: Returns the data from the the YAML
             configuration file, scoped to the value of ``self.system`` and
-            merged with the value of the ``"All"`` key.
+            merged with the value of the ``"All"`` key. The config may also be
+            a snapshot compiled with ``watchmaker config compile``, which is
+            loaded as-is.
 
         """
         if not self.config_path:
@@ -269,14 +421,17 @@ class Client(object):
         else:
             self.log.info('User supplied config being used.')
 
-        # Convert a local config path to a URI
-        self.config_path = watchmaker.utils.uri_from_filepath(self.config_path)
+        # Convert a local config path to a URI, keeping any checksum pin
+        config_path, self.config_sha256 = watchmaker.utils.split_sha256(
+            self.config_path
+        )
+        self.config_path = watchmaker.utils.uri_from_filepath(config_path)
 
         # Get the raw config data
         data = ''
         try:
-            data = watchmaker.utils.urlopen_retry(self.config_path).read()
-        except (ValueError, urllib.error.URLError):
+            data = self._read_config()
+        except (ValueError, urllib.error.URLError, ChecksumMismatch):
             msg = (
                 'Could not read the config from {0}! Please make sure your '
                 'config is available.'.format(self.config_path)
@@ -284,56 +439,10 @@ class Client(object):
             self.log.critical(msg)
             raise
 
-        config_full = yaml.safe_load(data)
-        try:
-            config_all = config_full.get('all', [])
-            config_system = config_full.get(self.system, [])
-        except AttributeError:
-            msg = 'Malformed config file. Must be a dictionary.'
-            self.log.critical(msg)
-            raise
-
-        # If both config and config_system are empty, raise
-        if not config_system and not config_all:
-            msg = 'Malformed config file. No workers for this system.'
-            self.log.critical(msg)
-            raise WatchmakerException(msg)
+        config = watchmaker.config.load(data, self.system)
 
-        # Merge the config data, preserving the listed order of workers
-        config = collections.OrderedDict()
-        for worker in config_system + config_all:
-            try:
-                # worker is a single-key dict, where the key is the name of the
-                # worker and the value is the worker parameters. we need to
-                # test if the worker is already in the config, but a dict is
-                # is not hashable so cannot be tested directly with
-                # `if worker not in config`. this bit of ugliness extracts the
-                # key and its value so we can use them directly.
-                worker_name, worker_config = list(worker.items())[0]
-                if worker_name not in config:
-                    # Add worker to config
-                    config[worker_name] = {'config': worker_config}
-                    self.log.debug('%s config: %s', worker_name, worker_config)
-                else:
-                    # Worker present in both config_system and config_all
-                    config[worker_name]['config'].update(worker_config)
-                    self.log.debug(
-                        '%s extra config: %s',
-                        worker_name, worker_config
-                    )
-                    # Need to (re)merge cli worker args so they override
-                    config[worker_name]['__merged'] = False
-                if not config[worker_name].get('__merged'):
-                    # Merge worker_args into config params
-                    config[worker_name]['config'].update(self.worker_args)
-                    config[worker_name]['__merged'] = True
-            except Exception:
-                msg = (
-                    'Failed to merge worker config; worker={0}'
-                    .format(worker)
-                )
-                self.log.critical(msg)
-                raise
+        # Merge cli worker args so they override the config file
+        watchmaker.config.merge_worker_args(config, self.worker_args)
 
         self.log.debug(
             'Command-line arguments merged into worker configs: %s',
@@ -351,6 +460,8 @@ class Client(object):
             '{0}'.format(self.system_drive), 'var', 'run', 'system-is-ready')
         params['logdir'] = os.path.join(
             '{0}'.format(self.system_drive), 'var', 'log')
+        params['cachedir'] = os.path.join(
+            '{0}'.format(self.system_drive), 'var', 'cache', 'watchmaker')
         params['workingdir'] = os.path.join(
             '{0}'.format(params['prepdir']), 'workingfiles')
         params['restart'] = 'shutdown -r +1 &'
@@ -366,6 +477,8 @@ class Client(object):
             '{0}'.format(params['prepdir']), 'system-is-ready')
         params['logdir'] = os.path.join(
             '{0}'.format(params['prepdir']), 'Logs')
+        params['cachedir'] = os.path.join(
+            '{0}'.format(params['prepdir']), 'Cache')
         params['workingdir'] = os.path.join(
             '{0}'.format(params['prepdir']), 'WorkingFiles')
         params['shutdown_path'] = os.path.join(
@@ -391,6 +504,15 @@ class Client(object):
             raise WatchmakerException(msg)
         if self.log_dir:
             self.system_params['logdir'] = self.log_dir
+        if self.cache_dir:
+            self.system_params['cachedir'] = self.cache_dir
+        if self.download_cache:
+            self.system_params['downloadcache'] = os.path.join(
+                self.system_params['cachedir'], 'downloads')
+            size = self.DEFAULT_DOWNLOAD_CACHE_SIZE
+            if self.download_cache_size is not None:
+                size = int(self.download_cache_size)
+            self.system_params['downloadcachesize'] = size * 1024 * 1024
 
     def install(self):
         """
@@ -419,12 +541,25 @@ class Client(object):
             workers=self.config
         )
 
+        max_downloads = self.DEFAULT_MAX_DOWNLOADS
+        if self.max_downloads is not None:
+            max_downloads = int(self.max_downloads)
+
+        prefetch_dir = None
+        if max_downloads > 0:
+            prefetch_dir = workers_manager.prefetch(max_workers=max_downloads)
+
         try:
             workers_manager.worker_cadence()
         except Exception:
             msg = 'Execution of the workers cadence has failed.'
             self.log.critical(msg)
             raise
+        finally:
+            if prefetch_dir:
+                self.system_params.pop('prefetched', None)
+                shutil.rmtree(prefetch_dir, ignore_errors=True)
+            ManagerBase.shutdown_process_executor()
 
         if self.no_reboot:
             self.log.info(
@@ -3,6 +3,7 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
+import io
 import os
 import platform
 import sys
@@ -10,6 +11,9 @@ import sys
 import click
 
 import watchmaker
+import watchmaker.config
+import watchmaker.utils
+from watchmaker import static
 from watchmaker.logger import LOG_LEVELS, exception_hook, prepare_logging
 
 click.disable_unicode_literals_warning = True
@@ -21,6 +25,29 @@ LOG_LOCATIONS = {
 }
 
 
+class _MainCommand(click.Command):
+    """
+    Run a subcommand when its name is the first argument.
+
+    The main command accepts arbitrary extra arguments, so it cannot be a
+    :class:`click.Group`. Instead, known subcommands are dispatched here and
+    everything else runs the main command.
+    """
+
+    subcommands = {}
+
+    def main(self, args=None, prog_name=None, *main_args, **main_kwargs):
+        """Dispatch to a subcommand, or run the main command."""
+        args = list(sys.argv[1:] if args is None else args)
+        if args and args[0] in self.subcommands:
+            prog_name = '{0} {1}'.format(
+                prog_name or os.path.basename(sys.argv[0]), args[0])
+            return self.subcommands[args[0]].main(
+                args[1:], prog_name, *main_args, **main_kwargs)
+        return super(_MainCommand, self).main(
+            args, prog_name, *main_args, **main_kwargs)
+
+
 def _print_version(ctx, _param, value):
     if not value or ctx.resilient_parsing:
         return
@@ -28,7 +55,7 @@ def _print_version(ctx, _param, value):
     ctx.exit()
 
 
-@click.command(context_settings=dict(
+@click.command(cls=_MainCommand, context_settings=dict(
     ignore_unknown_options=True,
 ))
 @click.option(
@@ -50,6 +77,35 @@ def _print_version(ctx, _param, value):
     help=(
         'Path to the directory where Watchmaker log files will be '
         'saved.'))
+@click.option(
+    '--cache-dir', default=None,
+    type=click.Path(exists=False, file_okay=False),
+    help=(
+        'Path to the directory where Watchmaker keeps files across runs, '
+        'such as a cached copy of a remote config. If not set, a '
+        'system-specific default is used.'))
+@click.option(
+    '--config-max-stale', default=None, type=int,
+    help=(
+        'Maximum age in seconds of a cached remote config that may be used '
+        'if the config cannot be retrieved. 0 disables the fallback. '
+        '[default: 86400]'))
+@click.option(
+    '--max-downloads', default=None, type=int,
+    help=(
+        'Maximum number of concurrent downloads when prefetching the files '
+        'needed by the workers. 0 disables the prefetch.  [default: 8]'))
+@click.option(
+    '--download-cache', 'download_cache', flag_value=True, default=False,
+    help=(
+        'Keep the files retrieved by the workers in a persistent cache, '
+        'shared across runs. Files pinned with a "#sha256=<hex>" URL suffix '
+        'are not downloaded again.'))
+@click.option(
+    '--download-cache-size', default=None, type=int,
+    help=(
+        'Size cap of the download cache in MiB. The least recently used '
+        'files are evicted first.  [default: 1024]'))
 @click.option(
     '-n', '--no-reboot', 'no_reboot', flag_value=True, default=False,
     show_default=True,
@@ -108,3 +164,46 @@ def main(extra_arguments=None, **kwargs):
     ))
     watchmaker_client = watchmaker.Client(watchmaker_arguments)
     sys.exit(watchmaker_client.install())
+
+
+@click.group('config')
+def config_group():
+    """Manage Watchmaker config files."""
+
+
+@config_group.command('compile')
+@click.option(
+    '-c', '--config', 'config_path', default=None,
+    help=(
+        'Path or URL to the config.yaml file. If not set, watchmaker will use '
+        'its default config.'))
+@click.option(
+    '--system', default=platform.system().lower(), show_default=True,
+    type=click.Choice(['linux', 'windows']),
+    help='System to compile the config for.')
+@click.option(
+    '-o', '--output', required=True,
+    type=click.Path(dir_okay=False, writable=True),
+    help='Path where the compiled config snapshot will be written.')
+def compile_config(config_path, system, output):
+    """
+    Compile a config into a snapshot for one system.
+
+    The snapshot holds the worker configs already merged for the system, and
+    can be passed to `--config` to skip parsing and merging the config file on
+    every run. Command-line worker arguments are still merged at run time.
+    """
+    config_path = watchmaker.utils.uri_from_filepath(
+        config_path or os.path.join(static.__path__[0], 'config.yaml'))
+    data = watchmaker.utils.urlopen_retry(config_path).read()
+
+    snapshot = watchmaker.config.compile_config(
+        watchmaker.config.parse(data), system, source=config_path)
+
+    with io.open(output, 'wb') as fh_:
+        fh_.write(watchmaker.config.dump_compiled(snapshot))
+    click.echo('Compiled config for {0}: {1} (sha256={2})'.format(
+        system, output, snapshot['sha256']))
+
+
+_MainCommand.subcommands['config'] = config_group
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Watchmaker config module.
+
+Resolves the raw config file into the ordered worker configs for a system,
+and compiles those into snapshots that can be loaded without parsing YAML or
+merging the ``all`` and system nodes again.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import collections
+import hashlib
+import json
+import logging
+
+import watchmaker.utils
+from watchmaker.exceptions import WatchmakerException
+
+log = logging.getLogger(__name__)
+
+#: Key identifying a compiled config snapshot, its value is the format version.
+COMPILED_MARKER = 'watchmaker_compiled_config'
+COMPILED_FORMAT = 1
+
+
+def _digest(workers):
+    """Return the content hash of the ``workers`` list of a snapshot."""
+    # YAML dates and timestamps are hashed as the strings they are dumped as
+    canonical = json.dumps(
+        workers, sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def parse(data):
+    """
+    Parse raw config data.
+
+    JSON documents are parsed with :mod:`json`, which is much faster than the
+    YAML parser; anything else is parsed as YAML.
+
+    Args:
+        data: (:obj:`bytes`)
+            Contents of a config file or of a compiled snapshot.
+
+    Returns:
+        :obj:`dict`: The parsed document.
+
+    """
+    if data.lstrip()[:1] in (b'{', '{'):
+        try:
+            return json.loads(
+                data.decode('utf-8') if isinstance(data, bytes) else data,
+                object_pairs_hook=collections.OrderedDict
+            )
+        except ValueError:
+            # Flow-style YAML, not JSON
+            pass
+    return watchmaker.utils.yaml_safe_load(data)
+
+
+def is_compiled(config_full):
+    """Return ``True`` if a parsed document is a compiled snapshot."""
+    return isinstance(config_full, dict) and COMPILED_MARKER in config_full
+
+
+def merge_system(config_full, system):
+    """
+    Merge the ``all`` node of a parsed config into the ``system`` node.
+
+    Args:
+        config_full: (:obj:`dict`)
+            Parsed config file.
+
+        system: (:obj:`str`)
+            Name of the system node, e.g. ``linux`` or ``windows``.
+
+    Returns:
+        :obj:`collections.OrderedDict`: Map of worker names to a dict with a
+        single ``config`` key holding the worker parameters, in the listed
+        order of the workers.
+
+    """
+    try:
+        config_all = config_full.get('all', [])
+        config_system = config_full.get(system, [])
+    except AttributeError:
+        msg = 'Malformed config file. Must be a dictionary.'
+        log.critical(msg)
+        raise
+
+    # If both config and config_system are empty, raise
+    if not config_system and not config_all:
+        msg = 'Malformed config file. No workers for this system.'
+        log.critical(msg)
+        raise WatchmakerException(msg)
+
+    # Merge the config data, preserving the listed order of workers
+    config = collections.OrderedDict()
+    for worker in config_system + config_all:
+        try:
+            # worker is a single-key dict, where the key is the name of the
+            # worker and the value is the worker parameters. we need to
+            # test if the worker is already in the config, but a dict is
+            # is not hashable so cannot be tested directly with
+            # `if worker not in config`. this bit of ugliness extracts the
+            # key and its value so we can use them directly.
+            worker_name, worker_config = list(worker.items())[0]
+            if worker_name not in config:
+                # Add worker to config
+                config[worker_name] = {'config': worker_config}
+                log.debug('%s config: %s', worker_name, worker_config)
+            else:
+                # Worker present in both config_system and config_all
+                config[worker_name]['config'].update(worker_config)
+                log.debug('%s extra config: %s', worker_name, worker_config)
+        except Exception:
+            msg = 'Failed to merge worker config; worker={0}'.format(worker)
+            log.critical(msg)
+            raise
+
+    return config
+
+
+def merge_worker_args(config, worker_args):
+    """
+    Merge ``worker_args`` into each worker config, overriding file values.
+
+    Args:
+        config: (:obj:`collections.OrderedDict`)
+            Worker configs, as returned by :func:`merge_system`.
+
+        worker_args: (:obj:`dict`)
+            Parameters to merge into every worker config.
+    """
+    for worker_name, worker in config.items():
+        try:
+            worker['config'].update(worker_args)
+            worker['__merged'] = True
+        except Exception:
+            msg = 'Failed to merge worker config; worker={0}'.format(
+                {worker_name: worker['config']}
+            )
+            log.critical(msg)
+            raise
+
+
+def compile_config(config_full, system, source=None):
+    """
+    Compile a parsed config into a snapshot for ``system``.
+
+    Args:
+        config_full: (:obj:`dict`)
+            Parsed config file.
+
+        system: (:obj:`str`)
+            Name of the system node to resolve, e.g. ``linux``.
+
+        source: (:obj:`str`)
+            Path or URL of the config, recorded in the snapshot.
+            (*Default*: ``None``)
+
+    Returns:
+        :obj:`collections.OrderedDict`: The snapshot, serialized with
+        :func:`dump_compiled`.
+
+    """
+    if is_compiled(config_full):
+        msg = 'Config is already compiled.'
+        log.critical(msg)
+        raise WatchmakerException(msg)
+
+    workers = [
+        [name, worker['config']]
+        for name, worker in merge_system(config_full, system).items()
+    ]
+    return collections.OrderedDict((
+        (COMPILED_MARKER, COMPILED_FORMAT),
+        ('system', system),
+        ('source', source),
+        ('sha256', _digest(workers)),
+        ('workers', workers),
+    ))
+
+
+def dump_compiled(snapshot):
+    """
+    Serialize a compiled snapshot to JSON.
+
+    YAML dates and timestamps, which JSON cannot represent, are written as
+    strings, e.g. ``2020-01-02``.
+
+    Args:
+        snapshot: (:obj:`dict`)
+            Snapshot, as produced by :func:`compile_config`.
+
+    Returns:
+        :obj:`bytes`: The UTF-8 encoded JSON document.
+
+    """
+    return json.dumps(
+        snapshot, separators=(',', ':'), default=str
+    ).encode('utf-8')
+
+
+def load_compiled(snapshot, system):
+    """
+    Load the worker configs from a compiled snapshot.
+
+    Args:
+        snapshot: (:obj:`dict`)
+            Parsed snapshot, as produced by :func:`compile_config`.
+
+        system: (:obj:`str`)
+            Name of the system the snapshot must have been compiled for.
+
+    Returns:
+        :obj:`collections.OrderedDict`: Worker configs, as returned by
+        :func:`merge_system`.
+
+    """
+    if snapshot[COMPILED_MARKER] != COMPILED_FORMAT:
+        msg = 'Unsupported compiled config format: {0}'.format(
+            snapshot[COMPILED_MARKER])
+        log.critical(msg)
+        raise WatchmakerException(msg)
+
+    if snapshot.get('system') != system:
+        msg = (
+            'Compiled config is for system `{0}`, but this system is `{1}`.'
+            .format(snapshot.get('system'), system)
+        )
+        log.critical(msg)
+        raise WatchmakerException(msg)
+
+    workers = snapshot.get('workers')
+    if not workers or _digest(workers) != snapshot.get('sha256'):
+        msg = 'Compiled config is empty or does not match its content hash.'
+        log.critical(msg)
+        raise WatchmakerException(msg)
+
+    return collections.OrderedDict(
+        (name, {'config': worker_config}) for name, worker_config in workers
+    )
+
+
+def load(data, system):
+    """
+    Resolve raw config data into the worker configs for ``system``.
+
+    Accepts both config files and compiled snapshots.
+
+    Args:
+        data: (:obj:`bytes`)
+            Contents of a config file or of a compiled snapshot.
+
+        system: (:obj:`str`)
+            Name of the system node to resolve, e.g. ``linux``.
+
+    Returns:
+        :obj:`collections.OrderedDict`: Worker configs, as returned by
+        :func:`merge_system`.
+
+    """
+    config_full = parse(data)
+    if is_compiled(config_full):
+        log.info('Loading compiled config snapshot.')
+        return load_compiled(config_full, system)
+    return merge_system(config_full, system)
@@ -10,3 +10,11 @@ class WatchmakerException(Exception):
 
 class InvalidValue(WatchmakerException):
     """Passed an invalid value."""
+
+
+class ChecksumMismatch(WatchmakerException):
+    """Downloaded content did not match its expected checksum."""
+
+
+class SaltCallerUnavailable(WatchmakerException):
+    """The salt caller could not take a command, nothing was run."""
@@ -5,19 +5,127 @@ from __future__ import (absolute_import, division, print_function,
 
 import abc
 import concurrent.futures
+import copy
+import hashlib
+import io
 import logging
+import multiprocessing
 import os
 import shutil
 import subprocess
 import tarfile
 import tempfile
+import threading
 import zipfile
 
-from six import add_metaclass
+from six import PY2, add_metaclass, string_types
+
+try:
+    import selectors
+except ImportError:  # pragma: no cover
+    # Python 2, command output is drained by threads
+    selectors = None
 
 import watchmaker.utils
-from watchmaker.exceptions import WatchmakerException
-from watchmaker.utils import urllib
+from watchmaker.exceptions import ChecksumMismatch, WatchmakerException
+from watchmaker.utils import HashingReader, urllib
+from watchmaker.utils.cache import DownloadCache
+
+# Supported archives: file suffixes, a label, the mode to open them with, and
+# the mode to extract them with as they download, if they can be
+ARCHIVE_FORMATS = (
+    (('.zip',), 'zip', 'zip', None),
+    (('.tar.gz', '.tgz'), 'GZip Tar', 'r:gz', 'r|gz'),
+    (('.tar.bz2', '.tbz'), 'Bzip Tar', 'r:bz2', 'r|bz2'),
+    (('.tar.xz', '.txz'), 'XZ Tar', 'r:xz', 'r|xz'),
+    (('.tar.zst', '.tzst'), 'Zstandard Tar', 'r|zst', 'r|zst'),
+)
+
+# Zip archives with fewer members are extracted by a single thread
+ZIP_PARALLEL_MIN_MEMBERS = 64
+
+# Command output larger than this is spilled to a temporary file
+OUTPUT_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Bytes read from a command's pipes at a time
+PIPE_CHUNK_SIZE = 64 * 1024
+
+# Maximum number of commands run at once in the background
+MAX_CONCURRENT_PROCESSES = 4
+
+
+def _zstd_reader(fileobj):
+    """Return a stream of the data decompressed from a zstd stream."""
+    try:
+        import zstandard
+    except ImportError:
+        raise WatchmakerException(
+            'Extracting .tar.zst archives requires the zstandard package, '
+            'install it with "pip install watchmaker[zstd]"'
+        )
+    return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+
+class CommandOutput(object):
+    """
+    Captured output of a command, as returned by ``call_process``.
+
+    The output is kept in memory up to ``max_size`` bytes, and spilled to a
+    temporary file beyond that. It can be read at once with :meth:`read`, or
+    streamed in chunks with :meth:`stream` or by line by iterating over it.
+
+    Args:
+        max_size: (:obj:`int`)
+            Number of bytes kept in memory before spilling to disk.
+            (*Default*: ``8 MiB``)
+    """
+
+    def __init__(self, max_size=OUTPUT_SPOOL_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+
+    @property
+    def spilled(self):
+        """Return ``True`` if the output was spilled to a temporary file."""
+        return self.size > self.max_size
+
+    def write(self, data):
+        """Append ``data`` to the output."""
+        self._file.write(data)
+        self.size += len(data)
+
+    def read(self):
+        """Return the whole output as :obj:`bytes`."""
+        self._file.seek(0)
+        return self._file.read()
+
+    def stream(self, chunk_size=watchmaker.utils.COPY_BUFSIZE):
+        """Yield the output in chunks of up to ``chunk_size`` bytes."""
+        self._file.seek(0)
+        for chunk in iter(lambda: self._file.read(chunk_size), b''):
+            yield chunk
+
+    def __iter__(self):
+        """Yield the output line by line."""
+        self._file.seek(0)
+        return iter(self._file.readline, b'')
+
+    def __len__(self):
+        """Return the size of the output in bytes."""
+        return self.size
+
+    def close(self):
+        """Discard the output, removing any temporary file."""
+        self._file.close()
+
+    def __enter__(self):
+        """Support use as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the output on leaving the context."""
+        self.close()
 
 
 class ManagerBase(object):
@@ -39,6 +147,13 @@ class ManagerBase(object):
                 completion.
             logdir:
                 Directory to store log files.
+            cachedir:
+                Directory to store files that persist across runs.
+            downloadcache:
+                (Optional) Directory of the persistent download cache. When
+                unset, files are always retrieved from their origin.
+            downloadcachesize:
+                (Optional) Size cap of the download cache, in bytes.
             workingdir:
                 Directory to store temporary files. Deleted upon successful
                 completion.
@@ -53,6 +168,10 @@ class ManagerBase(object):
     boto3 = None
     boto_client = None
 
+    # Pool of call_process_async, shared by all managers
+    _process_executor = None
+    _process_executor_lock = threading.Lock()
+
     def __init__(self, system_params, *args, **kwargs):
         self.log = logging.getLogger(
             '{0}.{1}'.format(__name__, self.__class__.__name__)
@@ -62,32 +181,107 @@ class ManagerBase(object):
         args = args
         kwargs = kwargs
 
+    @classmethod
+    def artifact_urls(cls, config):
+        """
+        Return the URLs of the files a worker will retrieve.
+
+        Used to prefetch the files before the workers run. Workers override
+        this to list the URLs found in their parameters.
+
+        Args:
+            config: (:obj:`dict`)
+                Worker parameters, as passed to the worker.
+
+        Returns:
+            :obj:`list`: URLs of the files to retrieve.
+
+        """
+        config = config
+        return []
+
+    @staticmethod
+    def _is_artifact_url(value):
+        """Return ``True`` if ``value`` is a remote URL worth prefetching."""
+        if not isinstance(value, string_types) or value in ('', 'None'):
+            return False
+        # Local files are read in place, copying them first gains nothing
+        url = watchmaker.utils.split_sha256(value)[0]
+        return watchmaker.utils.scheme_from_uri(
+            urllib.parse.urlparse(url)
+        ) != 'file'
+
+    def _download_cache(self):
+        cache_dir = self.system_params.get('downloadcache')
+        if not cache_dir:
+            return None
+        return DownloadCache(
+            cache_dir, max_size=self.system_params.get('downloadcachesize')
+        )
+
+    def _download(self, url, filename, sha256=None):
+        cache = self._download_cache()
+        if cache and watchmaker.utils.scheme_from_uri(
+            urllib.parse.urlparse(url)
+        ) != 'file':
+            cache.retrieve(url, filename, sha256=sha256)
+            return
+
+        self.log.debug('Opening the file handle, %s', filename)
+        with open(filename, 'wb') as outfile:
+            self.log.debug('Saving file to local filesystem...')
+            _, digest = watchmaker.utils.download(url, outfile)
+        if sha256 and digest != sha256:
+            os.remove(filename)
+            raise ChecksumMismatch(
+                'Checksum mismatch for {0}: expected sha256={1}, '
+                'got sha256={2}'.format(url, sha256, digest)
+            )
+
+    def _use_prefetched(self, url, filename):
+        prefetched = self.system_params.get('prefetched', {}).get(url)
+        if not prefetched or not os.path.isfile(prefetched):
+            return False
+        # Copy rather than link, so writes to either file stay separate
+        shutil.copyfile(prefetched, filename)
+        self.log.info(
+            'Using the prefetched file. url=%s. filename=%s',
+            url, filename
+        )
+        return True
+
     def retrieve_file(self, url, filename):
         """
         Retrieve a file from a provided URL.
 
         Supports all :obj:`urllib.request` handlers, as well as S3 buckets.
+        If the file was already prefetched by :meth:`retrieve_files`, the
+        local copy is used instead. Files are retrieved through the download
+        cache when it is enabled. An interrupted transfer resumes from the
+        last byte received.
 
         Args:
             url: (:obj:`str`)
-                URL to a file.
+                URL to a file. A ``#sha256=<hex>`` suffix pins the expected
+                checksum of the file, and a mismatch raises
+                :obj:`watchmaker.exceptions.ChecksumMismatch`.
 
             filename: (:obj:`str`)
                 Path where the file will be saved.
         """
         # Convert a local path to a URI
+        url, sha256 = watchmaker.utils.split_sha256(url)
         url = watchmaker.utils.uri_from_filepath(url)
         self.log.debug('Downloading: %s', url)
         self.log.debug('Destination: %s', filename)
 
+        if self._use_prefetched(url, filename):
+            return
+
         try:
             self.log.debug('Establishing connection to the host, %s', url)
-            response = watchmaker.utils.urlopen_retry(url)
-            self.log.debug('Opening the file handle, %s', filename)
-            with open(filename, 'wb') as outfile:
-                self.log.debug('Saving file to local filesystem...')
-                shutil.copyfileobj(response, outfile)
-        except (ValueError, urllib.error.URLError):
+            self._download(url, filename, sha256=sha256)
+        except (ValueError, urllib.error.URLError, ChecksumMismatch):
             self.log.critical(
                 'Failed to retrieve the file. url = %s. filename = %s',
                 url, filename
@@ -98,6 +292,63 @@ class ManagerBase(object):
             url, filename
         )
 
+    def retrieve_files(self, urls, directory, max_workers=8):
+        """
+        Retrieve several files concurrently.
+
+        Failures are logged and skipped, so a worker that needs a file that
+        could not be retrieved here will attempt it again itself.
+
+        Args:
+            urls: (:obj:`list`)
+                URLs of the files to retrieve.
+
+            directory: (:obj:`str`)
+                Directory where the files will be saved.
+
+            max_workers: (:obj:`int`)
+                Maximum number of concurrent downloads.
+                (*Default*: ``8``)
+
+        Returns:
+            :obj:`dict`: Map of the retrieved URLs, without their checksum
+            pins, to their local paths.
+
+        """
+        def _retrieve(url, sha256):
+            # Name files by a hash of the url, basenames are not unique
+            filename = os.path.join(directory, '{0}-{1}'.format(
+                hashlib.sha256(url.encode('utf-8')).hexdigest()[:16],
+                watchmaker.utils.basename_from_uri(url)
+            ))
+            self._download(url, filename, sha256=sha256)
+            return filename
+
+        pinned = {}
+        for url in urls:
+            url, sha256 = watchmaker.utils.split_sha256(url)
+            pinned[watchmaker.utils.uri_from_filepath(url)] = sha256
+        retrieved = {}
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            futures = dict(
+                (executor.submit(_retrieve, url, sha256), url)
+                for url, sha256 in pinned.items()
+            )
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                try:
+                    retrieved[url] = future.result()
+                    self.log.debug('Prefetched: %s', url)
+                except Exception as exc:  # pylint: disable=broad-except
+                    self.log.warning(
+                        'Failed to prefetch %s, it will be retrieved when '
+                        'needed: %s',
+                        url, exc
+                    )
+        return retrieved
+
     def create_working_dir(self, basedir, prefix):
         """
         Create a directory in ``basedir`` with a prefix of ``prefix``.
@@ -114,31 +365,74 @@ class ManagerBase(object):
 
         """
         self.log.info('Creating a working directory.')
-        original_umask = os.umask(0)
         try:
             working_dir = tempfile.mkdtemp(prefix=prefix, dir=basedir)
+            # Set the mode explicitly rather than through the process-wide
+            # umask, so concurrent callers do not affect each other
+            os.chmod(working_dir, 0o700)
         except Exception:
             msg = 'Could not create a working dir in {0}'.format(basedir)
             self.log.critical(msg)
             raise
         self.log.debug('Created working directory: %s', working_dir)
-        os.umask(original_umask)
         return working_dir
 
     @staticmethod
-    def _pipe_handler(pipe, logger=None, prefix_msg=''):
-        ret = b''
+    def _pipe_handler(pipe, logger=None, prefix_msg='', output=None):
+        # Collect the lines in a file-like object, concatenating bytes would
+        # copy the output so far for every line
+        output = io.BytesIO() if output is None else output
         try:
             for line in iter(pipe.readline, b''):
                 if logger:
                     logger('%s%s', prefix_msg, line.rstrip())
-                ret += line
+                output.write(line)
         finally:
             pipe.close()
 
-        return ret
+        return output
 
-    def call_process(self, cmd, log_pipe='all', raise_error=True):
+    @staticmethod
+    def _select_handler(streams):
+        """
+        Drain several pipes from the calling thread.
+
+        ``streams`` is a list of ``(pipe, logger, prefix_msg, output)``, and
+        each pipe is handled like :meth:`_pipe_handler` does. Only pipes that
+        can be selected on are supported, i.e. not on Windows.
+        """
+        selector = selectors.DefaultSelector()
+        partial = {}
+        try:
+            for pipe, logger, prefix_msg, output in streams:
+                selector.register(
+                    pipe, selectors.EVENT_READ, (logger, prefix_msg, output)
+                )
+                partial[pipe] = b''
+            while selector.get_map():
+                for key, _ in selector.select():
+                    logger, prefix_msg, output = key.data
+                    data = os.read(key.fd, PIPE_CHUNK_SIZE)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                    output.write(data)
+                    if not logger:
+                        continue
+                    # Log complete lines, and the last line at the end
+                    lines = (partial[key.fileobj] + data).split(b'\n')
+                    partial[key.fileobj] = lines.pop() if data else b''
+                    for line in lines:
+                        if line or data:
+                            logger('%s%s', prefix_msg, line.rstrip())
+        finally:
+            selector.close()
+            for stream in streams:
+                stream[0].close()
+
+        return [stream[3] for stream in streams]
+
+    def call_process(self, cmd, log_pipe='all', raise_error=True,
+                     lazy_output=False, spool_size=OUTPUT_SPOOL_SIZE):
         """
         Execute a shell command.
 
@@ -156,10 +450,23 @@ class ManagerBase(object):
                 is non-zero.
                 (*Default*: ``True``)
 
+            lazy_output: (:obj:`bool`)
+                Return the output as :obj:`CommandOutput` handles instead of
+                :obj:`bytes`, so large output does not have to be held in
+                memory. The caller should close the handles.
+                (*Default*: ``False``)
+
+            spool_size: (:obj:`int`)
+                With ``lazy_output``, number of bytes of each output kept in
+                memory before it is spilled to a temporary file.
+                (*Default*: ``8 MiB``)
+
         Returns:
             :obj:`dict`:
                 Dictionary containing three keys: ``retcode`` (:obj:`int`),
                 ``stdout`` (:obj:`bytes`), and ``stderr`` (:obj:`bytes`).
+                With ``lazy_output``, ``stdout`` and ``stderr`` are
+                :obj:`CommandOutput` handles.
 
         """
         ret = {
@@ -207,28 +514,47 @@ class ManagerBase(object):
             **kwargs
         )
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            stdout_future = executor.submit(
-                self._pipe_handler,
+        streams = [
+            (
                 process.stdout,
                 self.log.debug if log_pipe in ['stdout', 'all'] else None,
-                'Command stdout: '
-            )
-
-            stderr_future = executor.submit(
-                self._pipe_handler,
+                'Command stdout: ',
+                CommandOutput(spool_size) if lazy_output else io.BytesIO()
+            ),
+            (
                 process.stderr,
                 self.log.error if log_pipe in ['stderr', 'all'] else None,
-                'Command stderr: ')
-
-            ret['stdout'] = stdout_future.result()
-            ret['stderr'] = stderr_future.result()
+                'Command stderr: ',
+                CommandOutput(spool_size) if lazy_output else io.BytesIO()
+            ),
+        ]
+        if selectors is not None and os.name != 'nt':
+            stdout, stderr = self._select_handler(streams)
+        else:
+            # Pipes cannot be selected on, drain each one in its own thread
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=2
+            ) as executor:
+                stdout, stderr = [
+                    future.result() for future in [
+                        executor.submit(self._pipe_handler, *stream)
+                        for stream in streams
+                    ]
+                ]
+
+        if lazy_output:
+            ret['stdout'], ret['stderr'] = stdout, stderr
+        else:
+            ret['stdout'], ret['stderr'] = stdout.getvalue(), stderr.getvalue()
 
         ret['retcode'] = process.wait()
 
         self.log.debug('Command retcode: %s', ret['retcode'])
 
         if raise_error and ret['retcode'] != 0:
+            if lazy_output:
+                stdout.close()
+                stderr.close()
             msg = 'Command failed! Exit code={0}, cmd={1}'.format(
                 ret['retcode'], ' '.join(cmd))
             self.log.critical(msg)
@@ -236,6 +562,102 @@ class ManagerBase(object):
 
         return ret
 
+    def call_process_async(self, cmd, **kwargs):
+        """
+        Start executing a shell command in the background.
+
+        Commands run on a pool shared by all managers, at most
+        ``MAX_CONCURRENT_PROCESSES`` at once, and are logged like
+        :meth:`call_process` logs them.
+
+        Args:
+            cmd: (:obj:`list`)
+                Command to execute.
+
+            kwargs:
+                Arguments of :meth:`call_process`.
+
+        Returns:
+            :obj:`concurrent.futures.Future`:
+                Future of the dictionary returned by :meth:`call_process`.
+                Its ``result()`` raises if :meth:`call_process` raised.
+
+        """
+        return self._get_process_executor().submit(
+            self.call_process, cmd, **kwargs
+        )
+
+    @staticmethod
+    def _get_process_executor():
+        """Return the pool of background commands, shared by all managers."""
+        with ManagerBase._process_executor_lock:
+            if ManagerBase._process_executor is None:
+                ManagerBase._process_executor = (
+                    concurrent.futures.ThreadPoolExecutor(
+                        max_workers=MAX_CONCURRENT_PROCESSES
+                    )
+                )
+        return ManagerBase._process_executor
+
+    @staticmethod
+    def shutdown_process_executor():
+        """
+        Wait for the background commands and release their pool.
+
+        A later background command starts a new pool.
+        """
+        with ManagerBase._process_executor_lock:
+            executor, ManagerBase._process_executor = (
+                ManagerBase._process_executor, None
+            )
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def gather_processes(self, cmds, max_concurrency=MAX_CONCURRENT_PROCESSES,
+                         **kwargs):
+        """
+        Execute several shell commands concurrently.
+
+        Commands run on the pool of :meth:`call_process_async`. Waits for all
+        commands to finish. If any of them raised, the exception
+        of the first one, in the order of ``cmds``, is raised.
+
+        Args:
+            cmds: (:obj:`list`)
+                Commands to execute.
+
+            max_concurrency: (:obj:`int`)
+                Maximum number of these commands running at once, within the
+                ``MAX_CONCURRENT_PROCESSES`` of the pool.
+                (*Default*: ``4``)
+
+            kwargs:
+                Arguments of :meth:`call_process`, applied to every command.
+
+        Returns:
+            :obj:`list`:
+                Dictionaries returned by :meth:`call_process`, in the order
+                of ``cmds``.
+
+        """
+        if not cmds:
+            return []
+        # Waiting here rather than in the pool leaves its threads free for
+        # other background commands
+        semaphore = threading.Semaphore(max(1, max_concurrency))
+        futures = []
+        for cmd in cmds:
+            semaphore.acquire()
+            try:
+                future = self.call_process_async(cmd, **kwargs)
+            except Exception:
+                semaphore.release()
+                raise
+            future.add_done_callback(lambda _: semaphore.release())
+            futures.append(future)
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
     def cleanup(self):
         """Delete working directory."""
         self.log.info('Cleanup Time...')
@@ -250,10 +672,211 @@ class ManagerBase(object):
 
         self.log.info('Exiting cleanup routine...')
 
-    def extract_contents(self, filepath, to_directory, create_dir=False):
+    def _archive_format(self, filepath):
+        """Return the label, mode and stream mode of a supported archive."""
+        for suffixes, label, mode, stream_mode in ARCHIVE_FORMATS:
+            if filepath.endswith(suffixes):
+                self.log.debug('File Type: %s', label)
+                return label, mode, stream_mode
+        msg = (
+            'Could not extract "{0}" as no appropriate extractor is found.'
+            .format(filepath)
+        )
+        self.log.critical(msg)
+        raise WatchmakerException(msg)
+
+    def stream_mode(self, url):
+        """
+        Return the mode :meth:`retrieve_and_extract` streams ``url`` with.
+
+        Args:
+            url: (:obj:`str`)
+                URL to an archive, see :meth:`retrieve_file`.
+
+        Returns:
+            :obj:`str`: The :obj:`tarfile` mode to extract the archive with as
+            it downloads, or ``None`` if it is retrieved first.
+
+        """
+        url = watchmaker.utils.uri_from_filepath(
+            watchmaker.utils.split_sha256(url)[0]
+        )
+        if self._download_cache() or watchmaker.utils.scheme_from_uri(
+            urllib.parse.urlparse(url)
+        ) == 'file':
+            return None
+        filename = watchmaker.utils.basename_from_uri(url)
+        for suffixes, _, _, stream_mode in ARCHIVE_FORMATS:
+            if filename.endswith(suffixes):
+                return stream_mode
+        return None
+
+    def _extract_dir(self, filepath, to_directory, create_dir):
+        if create_dir:
+            to_directory = os.sep.join((
+                to_directory,
+                '.'.join(filepath.split(os.sep)[-1].split('.')[:-1])
+            ))
+
+        try:
+            os.makedirs(to_directory)
+        except OSError:
+            if not os.path.isdir(to_directory):
+                msg = 'Unable create directory - {0}'.format(to_directory)
+                self.log.critical(msg)
+                raise
+        return to_directory
+
+    @staticmethod
+    def _check_member_path(root, name, linkname=None, resolve=False):
+        """
+        Raise if an archive member would land outside ``root``.
+
+        ``root`` must be a real path. Member paths are only resolved through
+        symlinks on the filesystem when ``resolve`` is set, i.e. once the
+        archive has extracted a symlink that could redirect them.
+        """
+        paths = [os.path.join(root, name)]
+        if linkname is not None:
+            paths.append(os.path.join(
+                os.path.dirname(paths[0]), linkname
+            ))
+        for path in paths:
+            path = os.path.realpath(path) if resolve else os.path.normpath(
+                path
+            )
+            if path != root and not path.startswith(root + os.sep):
+                raise WatchmakerException(
+                    'Refusing to extract "{0}" outside of {1}'.format(
+                        name, root)
+                )
+
+    def _safe_tar_members(self, tar, to_directory):
+        """Yield the members of a tar archive, checking each path."""
+        root = os.path.realpath(to_directory)
+        resolve = False
+        for member in tar:
+            linkname = None
+            if member.issym():
+                linkname = member.linkname
+            elif member.islnk():
+                # Hard links are relative to the root of the archive
+                linkname = os.path.relpath(
+                    member.linkname, os.path.dirname(member.name) or '.'
+                )
+            self._check_member_path(root, member.name, linkname, resolve)
+            resolve = resolve or member.issym()
+            yield member
+
+    @staticmethod
+    def _open_tar(fileobj, mode):
+        """Open a tar archive from a file object."""
+        if (
+            mode.endswith('zst') and
+            'zst' not in getattr(tarfile.TarFile, 'OPEN_METH', {})
+        ):
+            # tarfile supports zstd only from python 3.14
+            return tarfile.open(fileobj=_zstd_reader(fileobj), mode='r|')
+        return tarfile.open(fileobj=fileobj, mode=mode)
+
+    def _extract_zip(self, filepath, to_directory, max_workers):
+        """Extract a zip archive, splitting the members across threads."""
+        with zipfile.ZipFile(filepath, 'r') as openfile:
+            members = openfile.infolist()
+            root = os.path.realpath(to_directory)
+            for member in members:
+                self._check_member_path(root, member.filename)
+            if max_workers < 2 or len(members) < ZIP_PARALLEL_MIN_MEMBERS:
+                openfile.extractall(path=to_directory)
+                return
+
+        # Create the directories first, so the threads do not race on them.
+        # Of members with the same name, only the last one is extracted
+        files = []
+        for member in dict((m.filename, m) for m in members).values():
+            name = member.filename.replace('/', os.sep)
+            if member.filename.endswith('/'):
+                directory = os.path.join(to_directory, name)
+            else:
+                directory = os.path.dirname(os.path.join(to_directory, name))
+                files.append(member)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        # Balance the groups by size, largest members first
+        groups = [[] for _ in range(max_workers)]
+        sizes = [0] * max_workers
+        for member in sorted(files, key=lambda m: m.file_size, reverse=True):
+            index = sizes.index(min(sizes))
+            groups[index].append(member.filename)
+            sizes[index] += member.file_size
+
+        def _extract(names):
+            # A ZipFile object must not be shared across threads
+            with zipfile.ZipFile(filepath, 'r') as openfile:
+                for name in names:
+                    openfile.extract(name, path=to_directory)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            for future in [executor.submit(_extract, g) for g in groups]:
+                future.result()
+
+    def _extract_tar_stream(self, tar, to_directory):
+        """
+        Extract the members of a tar archive, in order.
+
+        Directories are left writable, like :meth:`tarfile.TarFile.extractall`
+        does, and are returned so their attributes can be set with
+        :meth:`_set_tar_dir_attrs` once nothing else is written to them.
+        """
+        kwargs = {}
+        if hasattr(tarfile, 'fully_trusted_filter'):
+            # The members are checked by _safe_tar_members, which also keeps
+            # the extraction semantics of python versions without filters
+            kwargs['filter'] = 'fully_trusted'
+        directories = []
+        for member in self._safe_tar_members(tar, to_directory):
+            if member.isdir():
+                # Like extractall, keep directories writable until their
+                # contents are extracted
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0o700
+            tar.extract(member, path=to_directory, **kwargs)
+        return directories
+
+    @staticmethod
+    def _set_tar_dir_attrs(tar, directories, to_directory):
+        """Set the owner, mtime and mode of extracted tar directories."""
+        # Deepest directories first, so setting a mode or mtime is final
+        directories = sorted(
+            directories, key=lambda member: member.name, reverse=True
+        )
+        for member in directories:
+            dirpath = os.path.join(to_directory, member.name)
+            try:
+                if PY2:
+                    tar.chown(member, dirpath)
+                else:
+                    tar.chown(member, dirpath, False)
+                tar.utime(member, dirpath)
+                tar.chmod(member, dirpath)
+            except tarfile.ExtractError:
+                if tar.errorlevel > 1:
+                    raise
+
+    def extract_contents(self, filepath, to_directory, create_dir=False,
+                         max_workers=None):
         """
         Extract a compressed archive to the specified directory.
 
+        Archive members that would be written outside of the target
+        directory, by their path or as links, are refused. The archive is
+        extracted without changing any process-wide state, so several
+        archives may be extracted from concurrent threads.
+
         Args:
             filepath: (:obj:`str`)
                 Path to the compressed file. Supported file extensions:
@@ -263,6 +886,11 @@ class ManagerBase(object):
                 - `.tgz`
                 - `.tar.bz2`
                 - `.tbz`
+                - `.tar.xz`
+                - `.txz`
+                - `.tar.zst` (requires the ``zstandard`` package before
+                  python 3.14)
+                - `.tzst`
 
             to_directory: (:obj:`str`)
                 Path to the target directory
@@ -271,54 +899,167 @@ class ManagerBase(object):
                 Switch to control the creation of a subdirectory within
                 ``to_directory`` named for the filename of the compressed file.
                 (*Default*: ``False``)
+
+            max_workers: (:obj:`int`)
+                Maximum number of threads extracting the members of a zip
+                archive. When ``None``, up to 8 threads are used, depending
+                on the number of CPUs. Tar archives are always extracted by a
+                single thread, as they can only be read in order.
+                (*Default*: ``None``)
         """
-        if filepath.endswith('.zip'):
-            self.log.debug('File Type: zip')
-            opener, mode = zipfile.ZipFile, 'r'
-        elif filepath.endswith('.tar.gz') or filepath.endswith('.tgz'):
-            self.log.debug('File Type: GZip Tar')
-            opener, mode = tarfile.open, 'r:gz'
-        elif filepath.endswith('.tar.bz2') or filepath.endswith('.tbz'):
-            self.log.debug('File Type: Bzip Tar')
-            opener, mode = tarfile.open, 'r:bz2'
+        _, mode, _ = self._archive_format(filepath)
+        to_directory = self._extract_dir(filepath, to_directory, create_dir)
+
+        # Extract relative to the target, the working directory of the process
+        # is shared by all threads
+        if mode == 'zip':
+            if max_workers is None:
+                max_workers = min(8, multiprocessing.cpu_count())
+            self._extract_zip(filepath, to_directory, max_workers)
         else:
-            msg = (
-                'Could not extract "{0}" as no appropriate extractor is found.'
-                .format(filepath)
-            )
-            self.log.critical(msg)
-            raise WatchmakerException(msg)
-
-        if create_dir:
-            to_directory = os.sep.join((
-                to_directory,
-                '.'.join(filepath.split(os.sep)[-1].split('.')[:-1])
-            ))
-
-        try:
-            os.makedirs(to_directory)
-        except OSError:
-            if not os.path.isdir(to_directory):
-                msg = 'Unable create directory - {0}'.format(to_directory)
-                self.log.critical(msg)
-                raise
+            with open(filepath, 'rb') as fileobj:
+                openfile = self._open_tar(fileobj, mode)
+                try:
+                    self._set_tar_dir_attrs(
+                        openfile,
+                        self._extract_tar_stream(openfile, to_directory),
+                        to_directory
+                    )
+                finally:
+                    openfile.close()
 
-        cwd = os.getcwd()
-        os.chdir(to_directory)
+        self.log.info(
+            'Extracted file. source=%s, dest=%s',
+            filepath, to_directory
+        )
 
+    @staticmethod
+    def _merge_tree(src, dst):
+        """Move the contents of ``src`` into ``dst``, replacing files."""
+        for name in os.listdir(src):
+            src_path = os.path.join(src, name)
+            dst_path = os.path.join(dst, name)
+            if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                if os.path.isdir(src_path) and not os.path.islink(src_path):
+                    ManagerBase._merge_tree(src_path, dst_path)
+                    continue
+                shutil.rmtree(dst_path)
+            elif os.path.lexists(dst_path):
+                os.remove(dst_path)
+            os.rename(src_path, dst_path)
+        os.rmdir(src)
+
+    def _stream_extract(self, url, sha256, to_directory, stream_mode):
+        """Extract a tar archive from ``url`` as it downloads."""
+        staging_dir = tempfile.mkdtemp(
+            prefix='.watchmaker-extract-', dir=to_directory
+        )
         try:
-            openfile = opener(filepath, mode)
+            response = HashingReader(watchmaker.utils.urlopen_retry(url))
             try:
-                openfile.extractall()
+                tar = self._open_tar(response, stream_mode)
+                try:
+                    directories = self._extract_tar_stream(tar, staging_dir)
+                finally:
+                    tar.close()
+                # Hash any padding after the end of the archive
+                while response.read(watchmaker.utils.COPY_BUFSIZE):
+                    pass
             finally:
-                openfile.close()
+                response.close()
+            digest = response.hexdigest()
+            if sha256 and digest != sha256:
+                raise ChecksumMismatch(
+                    'Checksum mismatch for {0}: expected sha256={1}, '
+                    'got sha256={2}'.format(url, sha256, digest)
+                )
+            self._merge_tree(staging_dir, to_directory)
+            # Read-only directories could not be moved out of the staging
+            # directory, set their attributes once in place
+            self._set_tar_dir_attrs(tar, directories, to_directory)
         finally:
-            os.chdir(cwd)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return digest
 
-        self.log.info(
-            'Extracted file. source=%s, dest=%s',
-            filepath, to_directory
-        )
+    def retrieve_and_extract(self, url, to_directory, create_dir=False):
+        """
+        Retrieve an archive and extract it to the specified directory.
+
+        Tar archives are extracted as they download, without staging the
+        archive on disk, and hashed on the way through. Members are
+        extracted to a temporary directory within ``to_directory`` first, and
+        moved into place once the archive is complete and, if the URL pins a
+        checksum, verified. An HTTP error response is raised as is. If
+        streaming fails otherwise, or the archive is a zip file, was
+        prefetched, or goes through the download cache, the archive is
+        retrieved with :meth:`retrieve_file` and extracted with
+        :meth:`extract_contents` instead.
+
+        Args:
+            url: (:obj:`str`)
+                URL to the archive, see :meth:`retrieve_file`.
+
+            to_directory: (:obj:`str`)
+                Path to the target directory.
+
+            create_dir: (:obj:`bool`)
+                Extract to a subdirectory of ``to_directory`` named for the
+                filename of the archive, see :meth:`extract_contents`.
+                (*Default*: ``False``)
+        """
+        filename = watchmaker.utils.basename_from_uri(url)
+        self._archive_format(filename)
+        stream_mode = self.stream_mode(url)
+        stripped, sha256 = watchmaker.utils.split_sha256(url)
+        stripped = watchmaker.utils.uri_from_filepath(stripped)
+
+        if (
+            stream_mode and
+            stripped not in self.system_params.get('prefetched', {})
+        ):
+            target = self._extract_dir(filename, to_directory, create_dir)
+            try:
+                digest = self._stream_extract(
+                    stripped, sha256, target, stream_mode
+                )
+            except ChecksumMismatch:
+                self.log.critical(
+                    'Checksum mismatch for the archive. url=%s', stripped
+                )
+                raise
+            except urllib.error.HTTPError:
+                # The server answered, retrieving it again gets the same
+                self.log.critical(
+                    'Failed to retrieve the archive. url=%s', stripped
+                )
+                raise
+            except WatchmakerException:
+                raise
+            except Exception as exc:  # pylint: disable=broad-except
+                # Transfer and decompression errors differ by codec, and a
+                # persistent error is raised again by the fallback
+                self.log.warning(
+                    'Could not extract %s as it downloaded, retrieving it '
+                    'first: %s', stripped, exc
+                )
+            else:
+                self.log.info(
+                    'Extracted file as it downloaded. url=%s, sha256=%s, '
+                    'dest=%s', stripped, digest, target
+                )
+                return
+
+        archive_dir = tempfile.mkdtemp(dir=self.working_dir)
+        try:
+            archive = os.path.join(archive_dir, filename)
+            self.retrieve_file(url, archive)
+            self.extract_contents(
+                filepath=archive,
+                to_directory=to_directory,
+                create_dir=create_dir
+            )
+        finally:
+            shutil.rmtree(archive_dir, ignore_errors=True)
 
 
 class LinuxManager(ManagerBase):
@@ -351,6 +1092,12 @@ class WorkersManagerBase(object):
     """
     Base class for worker managers.
 
+    Workers are looked up by name in a registry. Built-in workers are listed
+    in :attr:`WORKERS`, and additional workers may be registered by other
+    distributions under the :attr:`WORKER_ENTRY_POINT_GROUP` entry point
+    group. A worker module is only imported when a worker of that name is
+    present in ``workers``.
+
     Args:
         system_params: (:obj:`dict`)
             Attributes, mostly file-paths, specific to the system-type (Linux
@@ -361,12 +1108,131 @@ class WorkersManagerBase(object):
 
     """
 
+    #: Map of built-in worker names to ``'module:class'`` import paths.
+    WORKERS = {}
+
+    #: Entry point group used to discover additional workers.
+    WORKER_ENTRY_POINT_GROUP = None
+
     def __init__(self, system_params, workers, *args, **kwargs):
+        self.log = logging.getLogger(
+            '{0}.{1}'.format(__name__, self.__class__.__name__)
+        )
         self.system_params = system_params
         self.workers = workers
+        self._worker_classes = {}
+        self._entry_points = None
         args = args
         kwargs = kwargs
 
+    def _get_entry_points(self):
+        if self._entry_points is None:
+            self._entry_points = {}
+            if self.WORKER_ENTRY_POINT_GROUP:
+                self._entry_points = watchmaker.utils.entry_points(
+                    self.WORKER_ENTRY_POINT_GROUP
+                )
+        return self._entry_points
+
+    def get_worker(self, name):
+        """
+        Return the worker class registered as ``name``.
+
+        Built-in workers take precedence over entry points, so the entry
+        points are only scanned for names that are not built in.
+
+        Args:
+            name: (:obj:`str`)
+                Name of the worker, as used in the config file.
+
+        Returns:
+            :obj:`type`: The worker class, or ``None`` if no worker is
+            registered under ``name``.
+
+        """
+        try:
+            return self._worker_classes[name]
+        except KeyError:
+            pass
+
+        if name in self.WORKERS:
+            worker_class = watchmaker.utils.load_object(self.WORKERS[name])
+        elif name in self._get_entry_points():
+            worker_class = self._get_entry_points()[name].load()
+        else:
+            worker_class = None
+
+        self._worker_classes[name] = worker_class
+        return worker_class
+
+    def _run_worker(self, name):
+        worker_class = self.get_worker(name)
+        if worker_class is None:
+            self.log.warning(
+                'Skipping worker `%s`, no such worker is available on this '
+                'system.',
+                name
+            )
+            return
+        worker = worker_class(
+            system_params=self.system_params,
+            **self.workers[name]['config']
+        )
+        worker.install()
+
+    def artifact_urls(self):
+        """Return the unique URLs of the files the workers will retrieve."""
+        urls = []
+        for name, worker in self.workers.items():
+            worker_class = self.get_worker(name)
+            if worker_class is None:
+                continue
+            for url in worker_class.artifact_urls(worker['config'] or {}):
+                if url not in urls:
+                    urls.append(url)
+        return urls
+
+    def prefetch(self, max_workers=8):
+        """
+        Retrieve the files of all workers concurrently, before they run.
+
+        The retrieved files are recorded in ``system_params['prefetched']``,
+        and :meth:`ManagerBase.retrieve_file` uses those local copies instead
+        of retrieving the files again. Tar archives that
+        :meth:`ManagerBase.retrieve_and_extract` extracts as they download
+        are left to the workers.
+
+        Args:
+            max_workers: (:obj:`int`)
+                Maximum number of concurrent downloads.
+                (*Default*: ``8``)
+
+        Returns:
+            :obj:`str`: Directory holding the prefetched files, or ``None`` if
+            there was nothing to prefetch.
+
+        """
+        downloader = ManagerBase(self.system_params)
+        urls = [
+            url for url in self.artifact_urls()
+            if not downloader.stream_mode(url)
+        ]
+        if not urls:
+            return None
+
+        self.log.info('Prefetching %s files...', len(urls))
+        prefetch_dir = downloader.create_working_dir(
+            self.system_params['workingdir'], 'prefetch-'
+        )
+        self.system_params['prefetched'] = downloader.retrieve_files(
+            urls, prefetch_dir, max_workers=max_workers
+        )
+        self.log.info(
+            'Prefetched %s of %s files.',
+            len(self.system_params['prefetched']), len(urls)
+        )
+        return prefetch_dir
+
     @abc.abstractmethod
     def _worker_execution(self):
         pass
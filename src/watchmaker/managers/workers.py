@@ -4,13 +4,17 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
 from watchmaker.managers.base import WorkersManagerBase
-from watchmaker.workers.salt import SaltLinux, SaltWindows
-from watchmaker.workers.yum import Yum
 
 
 class LinuxWorkersManager(WorkersManagerBase):
     """Manage the worker cadence for Linux systems."""
 
+    WORKERS = {
+        'salt': 'watchmaker.workers.salt:SaltLinux',
+        'yum': 'watchmaker.workers.yum:Yum',
+    }
+    WORKER_ENTRY_POINT_GROUP = 'watchmaker.workers.linux'
+
     def _worker_execution(self):
         pass
 
@@ -20,19 +24,7 @@ class LinuxWorkersManager(WorkersManagerBase):
     def worker_cadence(self):
         """Manage worker cadence."""
         for worker in self.workers:
-            configuration = self.workers[worker]['config']
-            if 'yum' in worker:
-                yum = Yum(
-                    system_params=self.system_params,
-                    **configuration
-                )
-                yum.install()
-            elif 'salt' in worker:
-                salt = SaltLinux(
-                    system_params=self.system_params,
-                    **configuration
-                )
-                salt.install()
+            self._run_worker(worker)
 
     def cleanup(self):
         """Execute cleanup function."""
@@ -42,6 +34,11 @@ class LinuxWorkersManager(WorkersManagerBase):
 class WindowsWorkersManager(WorkersManagerBase):
     """Manage the worker cadence for Windows systems."""
 
+    WORKERS = {
+        'salt': 'watchmaker.workers.salt:SaltWindows',
+    }
+    WORKER_ENTRY_POINT_GROUP = 'watchmaker.workers.windows'
+
     def _worker_execution(self):
         pass
 
@@ -51,13 +48,7 @@ class WindowsWorkersManager(WorkersManagerBase):
     def worker_cadence(self):
         """Manage worker cadence."""
         for worker in self.workers:
-            configuration = self.workers[worker]['config']
-            if 'salt' in worker:
-                salt = SaltWindows(
-                    system_params=self.system_params,
-                    **configuration
-                )
-                salt.install()
+            self._run_worker(worker)
 
     def cleanup(self):
         """Execute cleanup function."""
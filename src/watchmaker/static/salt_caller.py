@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Run salt-call commands in one long-lived process.
+
+Watchmaker starts this script with the python interpreter of salt, so salt
+and its dependencies are imported once instead of once per command. It
+must not import watchmaker, which is not installed in that interpreter.
+
+The protocol is one JSON object per line. Once salt is imported, the script
+writes ``{"ready": true}``, or ``{"ready": false, "error": "..."}`` and
+exits. Then, for each request ``{"args": [...], "stdout": "<path>",
+"stderr": "<path>"}`` read on stdin, it runs ``salt-call`` with those
+arguments and writes the response ``{"retcode": 0}``. The script exits at
+the end of stdin.
+
+The output of each command is written to the files named in its request.
+File descriptors 1 and 2 are redirected, and ``sys.stdout`` and
+``sys.stderr`` are left alone. Salt sets up its console logging once per
+process, on the ``sys.stderr`` of the first command, and that handler
+still writes to the files of later commands. So does any subprocess.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import json
+import os
+import sys
+import traceback
+
+
+def salt_call(args):
+    """Run ``salt-call`` with ``args`` in this process, return its retcode."""
+    import salt.scripts
+
+    sys.argv = ['salt-call'] + list(args)
+    try:
+        salt.scripts.salt_call()
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        return exc.code if isinstance(exc.code, int) else 1
+    return 0
+
+
+def _prepare():
+    import salt.scripts  # noqa: F401
+
+
+def _flush():
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+def _redirect(fd_, path):
+    """Point the file descriptor ``fd_`` at the file ``path``."""
+    target = os.open(
+        path,
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0),
+        0o600
+    )
+    try:
+        os.dup2(target, fd_)
+    finally:
+        os.close(target)
+
+
+def _write(stream, message):
+    stream.write(json.dumps(message).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+def main(run=salt_call, prepare=_prepare):
+    """
+    Serve requests on stdin until it is closed.
+
+    Args:
+        run: (:obj:`callable`)
+            Runs a command from its arguments, writing its output to
+            ``sys.stdout`` and ``sys.stderr`` or to file descriptors 1 and
+            2, and returns its retcode.
+
+        prepare: (:obj:`callable`)
+            Imports what ``run`` needs, before the helper reports that it is
+            ready.
+    """
+    # Keep the protocol streams to ourselves. Commands and their children
+    # write to stderr instead, and read from the null device.
+    requests = os.fdopen(os.dup(0), 'rb')
+    responses = os.fdopen(os.dup(1), 'wb')
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.close(null)
+    os.dup2(2, 1)
+
+    try:
+        prepare()
+    except Exception:  # pylint: disable=broad-except
+        _write(responses, {'ready': False, 'error': traceback.format_exc()})
+        return 1
+    _write(responses, {'ready': True})
+
+    # Output between commands goes to the stderr of the helper
+    idle = os.dup(2)
+    for line in iter(requests.readline, b''):
+        request = json.loads(line.decode('utf-8'))
+        _flush()
+        _redirect(1, request['stdout'])
+        _redirect(2, request['stderr'])
+        try:
+            retcode = run(request['args'])
+        except Exception:  # pylint: disable=broad-except
+            sys.stderr.write(traceback.format_exc())
+            retcode = 1
+        finally:
+            _flush()
+            os.dup2(idle, 1)
+            os.dup2(idle, 2)
+        _write(responses, {'retcode': retcode})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,13 +3,32 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
+import errno
+import hashlib
+import importlib
 import os
-import ssl
+import re
+import socket
 
 import backoff
+import yaml
+from six.moves import http_client  # pylint: disable=import-error
 
 from watchmaker.utils import urllib
 
+# Prefer the libyaml-backed loader/dumper, they are much faster than the
+# pure-python implementations and produce the same results
+YAML_SAFE_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_SAFE_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+COPY_BUFSIZE = 1024 * 1024
+
+DOWNLOAD_MAX_TRIES = 5
+
+_CONTENT_RANGE = re.compile(r'^bytes (?P<start>\d+)-\d+/(?P<total>\d+|\*)$')
+
+_SHA256_PIN = re.compile(r'^(?P<url>.*)#sha256=(?P<sha256>[0-9a-fA-F]{64})$')
+
 
 def scheme_from_uri(uri):
     """Return a scheme from a parsed uri."""
@@ -43,18 +62,270 @@ def basename_from_uri(uri):
     return os.path.basename(urllib.parse.urlparse(uri).path)
 
 
-@backoff.on_exception(backoff.expo, urllib.error.URLError, max_tries=5)
-def urlopen_retry(uri):
-    """Retry urlopen on exception."""
-    kwargs = {}
+def split_sha256(uri):
+    """
+    Split a ``#sha256=<hex>`` checksum pin off a URI.
+
+    Returns:
+        :obj:`tuple`: The URI without the pin, and the lowercase sha256 hash
+        or ``None`` when the URI is not pinned.
+
+    """
+    match = _SHA256_PIN.match(uri)
+    if not match:
+        return uri, None
+    return match.group('url'), match.group('sha256').lower()
+
+
+class HashingReader(object):
+    """Wrap a file-like object, hashing the data read through it."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._digest = hashlib.sha256()
+
+    def read(self, amt=None):
+        """Read from the wrapped file object, hashing the data."""
+        data = self._fileobj.read() if amt is None else self._fileobj.read(amt)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self):
+        """Return the sha256 hexdigest of the data read so far."""
+        return self._digest.hexdigest()
+
+    def close(self):
+        """Close the wrapped file object."""
+        self._fileobj.close()
+
+
+def yaml_safe_load(stream):
+    """Parse a YAML document, like :func:`yaml.safe_load`."""
+    return yaml.load(stream, Loader=YAML_SAFE_LOADER)
+
+
+def yaml_safe_dump(data, stream=None, **kwargs):
+    """Serialize an object to YAML, like :func:`yaml.safe_dump`."""
+    return yaml.dump(data, stream, Dumper=YAML_SAFE_DUMPER, **kwargs)
+
+
+def entry_points(group):
+    """
+    Return the entry points registered for ``group``.
+
+    Returns:
+        :obj:`dict`: Map of entry point names to entry point objects, each
+        providing a ``load()`` method. Empty if distribution metadata cannot
+        be queried.
+
+    """
     try:
-        # trust the system's default CA certificates
-        # proper way for 2.7.9+ on Linux
-        if uri.startswith("https://"):
-            kwargs['context'] = ssl.create_default_context(
-                ssl.Purpose.CLIENT_AUTH
-            )
+        from importlib import metadata
+    except ImportError:
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            return {}
+
+    eps = metadata.entry_points()
+    try:
+        selected = eps.select(group=group)
     except AttributeError:
-        pass
+        # importlib.metadata < 3.10 returns a dict of group -> entry points
+        selected = eps.get(group, [])
+    return dict((ep.name, ep) for ep in selected)
+
+
+def load_object(path):
+    """Import and return the object referenced by ``'module:attribute'``."""
+    module_name, _, attr = path.partition(':')
+    obj = importlib.import_module(module_name)
+    for name in attr.split('.') if attr else []:
+        obj = getattr(obj, name)
+    return obj
+
+
+def makedirs(path):
+    """Create the directory ``path`` and its parents, unless it exists."""
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def replace(src, dst):
+    """Rename ``src`` to ``dst``, replacing ``dst`` if it is a file."""
+    # Python 2 has no os.replace, its os.rename replaces files on POSIX
+    getattr(os, 'replace', os.rename)(src, dst)
+
+
+def _is_not_modified(exc):
+    """Return ``True`` for a ``304 Not Modified`` response."""
+    return getattr(exc, 'code', None) == 304
+
+
+def urlopen(uri, headers=None, timeout=None):
+    """
+    Open a URI, without retries.
+
+    The URI is opened by the transport registered for its scheme, see
+    :func:`watchmaker.utils.urllib.register_transport`. ``http://`` and
+    ``https://`` URIs reuse pooled keep-alive connections.
+
+    Args:
+        uri: (:obj:`str`)
+            URI to open.
+
+        headers: (:obj:`dict`)
+            Extra request headers, e.g. for a conditional request.
+            (*Default*: ``None``)
+
+        timeout: (:obj:`float`)
+            Seconds to wait on the connection. When ``None``, the global
+            socket timeout is used.
+            (*Default*: ``None``)
+    """
+    scheme = urllib.parse.urlparse(uri).scheme
+    return urllib.get_transport(scheme).open(
+        uri, headers=headers, timeout=timeout
+    )
+
+
+@backoff.on_exception(
+    backoff.expo,
+    urllib.error.URLError,
+    max_tries=5,
+    giveup=_is_not_modified
+)
+def urlopen_retry(uri, headers=None, timeout=None):
+    """Retry urlopen on exception."""
+    return urlopen(uri, headers=headers, timeout=timeout)
+
+
+def _content_range(response):
+    """Return the offset of a response body and the total size, if known."""
+    info = response.info()
+    if response.getcode() == 206:
+        match = _CONTENT_RANGE.match(info.get('Content-Range') or '')
+        if not match:
+            return None, None
+        total = match.group('total')
+        return int(match.group('start')), None if total == '*' else int(total)
+    length = info.get('Content-Length')
+    if length is None or info.get('Content-Encoding'):
+        # The length of an encoded body is not the length of the file
+        return 0, None
+    return 0, int(length)
+
+
+def _range_validator(response):
+    """Return the ETag that ties a ranged request to this version."""
+    info = response.info()
+    etag = info.get('ETag')
+    if not etag or etag.startswith('W/') or info.get('Content-Encoding'):
+        return None
+    return etag
+
+
+def download(uri, fdst, headers=None, timeout=None,
+             max_tries=DOWNLOAD_MAX_TRIES):
+    """
+    Download a URI into a file object, resuming interrupted transfers.
+
+    When the transfer fails partway, it is resumed from the last byte written
+    with a ``Range`` request. The ``If-Range`` header ties the request to the
+    ``ETag`` of the first response, so a file that changed in the meantime is
+    downloaded again from the start. Retries, with an exponential backoff,
+    cover the whole transfer and not only the connection.
+
+    Args:
+        uri: (:obj:`str`)
+            URI to download.
+
+        fdst: (:obj:`file`)
+            Seekable binary file object that receives the content.
+
+        headers: (:obj:`dict`)
+            Extra request headers, e.g. for a conditional request.
+            (*Default*: ``None``)
+
+        timeout: (:obj:`float`)
+            Seconds to wait on the connection. When ``None``, the global
+            socket timeout is used.
+            (*Default*: ``None``)
+
+        max_tries: (:obj:`int`)
+            Maximum number of attempts.
+            (*Default*: ``5``)
+
+    Returns:
+        :obj:`tuple`: The last response and the sha256 hexdigest of the
+        content.
+
+    """
+    state = {'offset': 0, 'digest': hashlib.sha256(), 'validator': None}
+
+    def _restart():
+        fdst.seek(0)
+        fdst.truncate()
+        state['offset'] = 0
+        state['digest'] = hashlib.sha256()
+
+    def _copy_body(response):
+        start, total = _content_range(response)
+        if start != state['offset']:
+            _restart()
+            if start != 0:
+                # Do not trust the origin with a range again
+                state['validator'] = None
+                raise urllib.error.URLError(
+                    'unexpected range from {0}'.format(uri)
+                )
+            # Otherwise, the file changed or the origin ignored the range
+        state['validator'] = _range_validator(response)
+
+        while True:
+            buf = response.read(COPY_BUFSIZE)
+            if not buf:
+                break
+            state['digest'].update(buf)
+            fdst.write(buf)
+            state['offset'] += len(buf)
+
+        if total is not None and state['offset'] < total:
+            raise urllib.error.URLError(
+                'transfer of {0} stopped after {1} of {2} bytes'.format(
+                    uri, state['offset'], total)
+            )
+
+    @backoff.on_exception(
+        backoff.expo,
+        (urllib.error.URLError, socket.error, http_client.HTTPException),
+        max_tries=max_tries,
+        giveup=_is_not_modified
+    )
+    def _transfer():
+        request_headers = dict(headers or {})
+        if state['offset'] and state['validator']:
+            request_headers['Range'] = 'bytes={0}-'.format(state['offset'])
+            request_headers['If-Range'] = state['validator']
+
+        try:
+            response = urlopen(uri, headers=request_headers, timeout=timeout)
+        except urllib.error.HTTPError as exc:
+            if exc.code in (412, 416):
+                # The file changed, start over without a range
+                _restart()
+            raise
+
+        try:
+            _copy_body(response)
+        except Exception:
+            # Release the connection before retrying
+            response.close()
+            raise
+        return response
 
-    return urllib.request.urlopen(uri, **kwargs)
+    response = _transfer()
+    return response, state['digest'].hexdigest()
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Local caches for remote content."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import watchmaker.utils
+from watchmaker.exceptions import ChecksumMismatch
+from watchmaker.utils import urllib
+
+TEMP_PREFIX = '.tmp-'
+
+
+def atomic_write(path, data):
+    """
+    Write ``data`` to ``path`` atomically.
+
+    The data is written to a temporary file in the same directory, which is
+    then renamed over ``path``, so concurrent readers never see a partial
+    file.
+    """
+    dirname = os.path.dirname(path)
+    watchmaker.utils.makedirs(dirname)
+    fd_, tmp_path = tempfile.mkstemp(dir=dirname, prefix=TEMP_PREFIX)
+    try:
+        with io.open(fd_, 'wb') as fh_:
+            fh_.write(data)
+        watchmaker.utils.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class DownloadCache(object):
+    """
+    Persistent, content-addressable cache of downloaded files.
+
+    File contents are stored once per sha256 hash under ``blobs/``. Each URL
+    records the hash of its last download under ``urls/``, along with the
+    ``ETag`` and ``Last-Modified`` headers of that response. Every write goes
+    to a temporary file that is renamed into place, so concurrent watchmaker
+    runs can share one cache.
+
+    A URL pinned to a hash is served straight from the cache when a blob with
+    that hash exists. Any other cached URL is revalidated with
+    ``If-None-Match``/``If-Modified-Since`` (S3 ``IfNoneMatch`` for ``s3://``
+    URLs), so an unchanged file costs a ``304 Not Modified`` instead of a
+    full download. Downloads are hashed while they stream to disk and checked
+    against the pin.
+
+    When ``max_size`` is set, the least recently used blobs are evicted until
+    the cache fits.
+
+    Args:
+        cache_dir: (:obj:`str`)
+            Directory where cached files are kept.
+
+        max_size: (:obj:`int`)
+            Size cap of the cache, in bytes. ``None`` means no cap.
+            (*Default*: ``None``)
+    """
+
+    DEFAULT_MAX_STALE = 86400
+    DEFAULT_TIMEOUT = 10
+
+    def __init__(self, cache_dir, max_size=None):
+        self.log = logging.getLogger(
+            '{0}.{1}'.format(__name__, self.__class__.__name__)
+        )
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.url_dir = os.path.join(cache_dir, 'urls')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def _meta_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.url_dir, '{0}.json'.format(key))
+
+    def _load_meta(self, url):
+        try:
+            with io.open(self._meta_path(url), 'rb') as fh_:
+                meta = json.loads(fh_.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('url') != url or not meta.get('sha256'):
+            return None
+        if not os.path.isfile(self._blob_path(meta['sha256'])):
+            # The blob was evicted
+            return None
+        return meta
+
+    def _store_meta(self, url, meta):
+        meta['url'] = url
+        meta['validated'] = time.time()
+        atomic_write(self._meta_path(url), json.dumps(meta).encode('utf-8'))
+
+    def _hit(self, digest):
+        path = self._blob_path(digest)
+        try:
+            # Track recent use for eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    @staticmethod
+    def _conditional_headers(url, meta):
+        headers = {}
+        if not meta:
+            return headers
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified') and not url.startswith('s3://'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def _store(self, url, sha256, headers, timeout, max_tries):
+        watchmaker.utils.makedirs(self.blob_dir)
+        fd_, tmp_path = tempfile.mkstemp(
+            dir=self.blob_dir, prefix=TEMP_PREFIX
+        )
+        try:
+            with io.open(fd_, 'w+b') as fh_:
+                response, digest = watchmaker.utils.download(
+                    url, fh_, headers=headers, timeout=timeout,
+                    max_tries=max_tries
+                )
+            if sha256 and digest != sha256:
+                raise ChecksumMismatch(
+                    'Checksum mismatch for {0}: expected sha256={1}, '
+                    'got sha256={2}'.format(url, sha256, digest)
+                )
+            watchmaker.utils.replace(tmp_path, self._blob_path(digest))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return response, digest
+
+    def _evict(self, keep):
+        if self.max_size is None:
+            return
+        blobs = []
+        total = 0
+        for name in os.listdir(self.blob_dir):
+            if name.startswith(TEMP_PREFIX):
+                continue
+            try:
+                stat = os.stat(self._blob_path(name))
+            except OSError:
+                continue
+            total += stat.st_size
+            if name != keep:
+                blobs.append((stat.st_mtime, stat.st_size, name))
+
+        for _, size, name in sorted(blobs):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self._blob_path(name))
+            except OSError:
+                continue
+            total -= size
+            self.log.debug('Evicted cached blob %s', name)
+
+    def _log_fallback(self, url, meta, exc):
+        self.log.warning(
+            'Could not revalidate %s (%s), using the cached copy from %d '
+            'seconds ago.',
+            url, exc, time.time() - meta.get('validated', 0)
+        )
+
+    def open(self, url, sha256=None, max_stale=0, timeout=None):
+        """
+        Return the path to a cached copy of ``url``.
+
+        Args:
+            url: (:obj:`str`)
+                URL of the file.
+
+            sha256: (:obj:`str`)
+                Expected sha256 hash of the file. A cached blob with this
+                hash is used without contacting the origin.
+                (*Default*: ``None``)
+
+            max_stale: (:obj:`int`)
+                Maximum age, in seconds since the last successful validation,
+                of a cached copy that may be used when the origin cannot be
+                reached. ``None`` means no limit, and ``0`` disables the
+                fallback.
+                (*Default*: ``0``)
+
+            timeout: (:obj:`float`)
+                Seconds to wait on the origin. ``None`` uses the global
+                socket timeout.
+                (*Default*: ``None``)
+
+        Returns:
+            :obj:`str`: Path to the cached blob. The blob is shared, so
+            callers must not modify it.
+
+        """
+        if sha256 and os.path.isfile(self._blob_path(sha256)):
+            self.log.debug('Using pinned copy from the cache. url=%s', url)
+            return self._hit(sha256)
+
+        meta = self._load_meta(url)
+        if meta is not None and sha256 and meta['sha256'] != sha256:
+            meta = None
+        usable = meta is not None and (
+            max_stale is None or
+            time.time() - meta.get('validated', 0) <= max_stale
+        )
+
+        try:
+            response, digest = self._store(
+                url, sha256,
+                headers=self._conditional_headers(url, meta),
+                timeout=timeout,
+                # With a usable fallback, do not spend time retrying a slow
+                # origin
+                max_tries=1 if usable else watchmaker.utils.DOWNLOAD_MAX_TRIES
+            )
+        except urllib.error.HTTPError as exc:
+            if exc.code == 304 and meta is not None:
+                self.log.info('Cached copy is current. url=%s', url)
+                self._store_meta(url, meta)
+                return self._hit(meta['sha256'])
+            if not usable or exc.code < 500:
+                # A client error is an answer from the origin, not an outage
+                raise
+            self._log_fallback(url, meta, exc)
+            return self._hit(meta['sha256'])
+        except (
+            urllib.error.URLError, socket.timeout, IOError, OSError
+        ) as exc:
+            if not usable:
+                raise
+            self._log_fallback(url, meta, exc)
+            return self._hit(meta['sha256'])
+
+        headers = response.info()
+        self._store_meta(url, {
+            'sha256': digest,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        })
+        self.log.debug('Cached a new copy. url=%s, sha256=%s', url, digest)
+        self._evict(keep=digest)
+        return self._blob_path(digest)
+
+    def fetch(self, url, sha256=None, max_stale=DEFAULT_MAX_STALE,
+              timeout=DEFAULT_TIMEOUT):
+        """
+        Return the contents of ``url``, using the cached copy when current.
+
+        Meant for small files such as configs: the cached copy is also used
+        when the origin is slow or unreachable, as long as it was last
+        validated less than ``max_stale`` seconds ago. See :meth:`open` for
+        the arguments.
+
+        Returns:
+            :obj:`bytes`: Contents of the file.
+
+        """
+        path = self.open(
+            url, sha256=sha256, max_stale=max_stale, timeout=timeout
+        )
+        with io.open(path, 'rb') as fh_:
+            return fh_.read()
+
+    def retrieve(self, url, filename, sha256=None):
+        """
+        Save a copy of ``url`` to ``filename``, downloading it if needed.
+
+        See :meth:`open` for the arguments.
+        """
+        try:
+            path = self.open(url, sha256=sha256)
+            shutil.copyfile(path, filename)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            # The blob was evicted by a concurrent run, fetch it again
+            shutil.copyfile(self.open(url, sha256=sha256), filename)
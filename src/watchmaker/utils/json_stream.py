@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Incremental parsing of large JSON documents."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# A number may continue after these characters
+NUMBER_CHARS = '+-.0123456789Ee'
+
+# Drop the parsed part of the buffer once it is this large
+COMPACT_SIZE = 1024 * 1024
+
+
+class JSONStream(object):
+    """
+    Parse a JSON document from a stream of chunks, one member at a time.
+
+    Objects can be walked with :meth:`keys` without holding all of their
+    members in memory, and any value can be parsed whole with :meth:`value`.
+    Only the chunks needed for the current value are buffered.
+
+    Args:
+        chunks: (:obj:`iterable`)
+            Chunks of the UTF-8 encoded document, as :obj:`bytes`.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read one more chunk into the buffer, return ``False`` at EOF."""
+        if self._eof:
+            return False
+        if self._pos >= COMPACT_SIZE:
+            self._buf, self._pos = self._buf[self._pos:], 0
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            self._buf += self._decoder.decode(b'', final=True)
+            return True
+        self._buf += self._decoder.decode(chunk)
+        return True
+
+    def _grow(self):
+        """Read until the unparsed part of the buffer doubles, or to EOF."""
+        size = 2 * (len(self._buf) - self._pos)
+        if not self._fill():
+            return False
+        while len(self._buf) - self._pos < size and self._fill():
+            pass
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, ``''`` at EOF."""
+        while True:
+            self._pos = WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        """Consume the next character, which must be ``char``."""
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                'Expected {0!r} at offset {1}, found {2!r}'.format(
+                    char, self._pos, found))
+        self._pos += 1
+
+    def value(self):
+        """Parse and return the next value."""
+        self.peek()
+        while True:
+            # Each retry parses the value from its start, so the buffer
+            # doubles in between to keep a large value linear
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # The value may continue in the next chunk
+                if not self._grow():
+                    raise
+                continue
+            if not self._eof and self._buf[self._pos] in '-0123456789' and (
+                end == len(self._buf) or self._buf[end] in NUMBER_CHARS
+            ):
+                # A number may continue in the next chunk, e.g. "1." + "5"
+                self._grow()
+                continue
+            self._pos = end
+            return value
+
+    def keys(self):
+        """
+        Walk the members of the next value, which must be an object.
+
+        Yields each key once its ``:`` is consumed. The caller must consume
+        the member's value, with :meth:`value` or :meth:`keys`, before
+        asking for the next key.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self._pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(
+                    'Expected "," or "}}" at offset {0}, found {1!r}'.format(
+                        self._pos - 1, char))
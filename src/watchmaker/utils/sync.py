@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Incremental, manifest-driven directory sync."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+
+import watchmaker.utils
+from watchmaker.utils.cache import TEMP_PREFIX, atomic_write
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+log = logging.getLogger(__name__)
+
+
+def manifest_path(dst):
+    """Return the default manifest path of the sync target ``dst``."""
+    dst = os.path.normpath(dst)
+    return os.path.join(
+        os.path.dirname(dst),
+        '.{0}{1}'.format(os.path.basename(dst), MANIFEST_SUFFIX)
+    )
+
+
+def _stat_key(path):
+    """Return ``(size, mtime_ns)`` of ``path``, or ``None`` if not a file."""
+    try:
+        st_ = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st_.st_mode):
+        return None
+    mtime = getattr(st_, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st_.st_mtime * 1000000000)
+    return st_.st_size, mtime
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with io.open(path, 'rb') as fh_:
+        for chunk in iter(
+            lambda: fh_.read(watchmaker.utils.COPY_BUFSIZE), b''
+        ):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_manifest(path):
+    try:
+        with io.open(path, 'rb') as fh_:
+            manifest = json.loads(fh_.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return {}
+    return manifest.get('files', {}) if isinstance(manifest, dict) else {}
+
+
+def _walk(root, followlinks=True):
+    """
+    Return the directories and files under ``root``, relative to it.
+
+    When ``followlinks`` is false, links to directories are returned with the
+    files, so that they are removed rather than descended into.
+    """
+    dirs, files = set(), set()
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=followlinks):
+        reldir = os.path.relpath(dirpath, root)
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            relpath = os.path.normpath(
+                os.path.join(reldir, name)).replace(os.sep, '/')
+            if name in dirnames and (followlinks or not os.path.islink(path)):
+                dirs.add(relpath)
+            else:
+                files.add(relpath)
+    return dirs, files
+
+
+def remove_path(path):
+    """Remove the file, link or directory tree at ``path``, if any."""
+    if os.path.islink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Links to directories on Windows
+            os.rmdir(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _samefile(src, dst):
+    try:
+        return os.path.samefile(src, dst)
+    except (AttributeError, OSError):
+        return False
+
+
+def _link(src, dst):
+    """Hard link ``dst`` to ``src``, or copy it if the link fails."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _copy(src, dst, link=False):
+    """Copy ``src`` to ``dst``, preserving its metadata."""
+    copy = _link if link else shutil.copy2
+    if not os.path.lexists(dst):
+        copy(src, dst)
+        return
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    # Replace existing files atomically, so they are never seen half-written
+    fd_, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(dst), prefix=TEMP_PREFIX
+    )
+    os.close(fd_)
+    os.remove(tmp_path)
+    try:
+        copy(src, tmp_path)
+        watchmaker.utils.replace(tmp_path, dst)
+    except Exception:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def symlink_tree(src, dst):
+    """
+    Make ``dst`` a symbolic link to the directory ``src``.
+
+    Whatever is at ``dst`` is replaced by the link, unless links cannot be
+    created, e.g. on Windows without the privilege to create them.
+
+    Returns:
+        :obj:`bool`: ``True`` if ``dst`` links to ``src``, ``False`` if
+        links are not supported and ``dst`` was left as it was.
+
+    """
+    src = os.path.abspath(src)
+    if os.path.islink(dst) and os.readlink(dst) == src:
+        return True
+    kwargs = {'target_is_directory': True} if os.name == 'nt' else {}
+    tmp_path = os.path.join(
+        os.path.dirname(dst),
+        '{0}{1}'.format(TEMP_PREFIX, os.path.basename(dst))
+    )
+    remove_path(tmp_path)
+    try:
+        os.symlink(src, tmp_path, **kwargs)
+    except (AttributeError, NotImplementedError, OSError):
+        return False
+    remove_path(dst)
+    watchmaker.utils.replace(tmp_path, dst)
+    return True
+
+
+def sync_tree(src, dst, manifest=None, link=False):
+    """
+    Make the directory ``dst`` a copy of the directory ``src``.
+
+    Unlike removing ``dst`` and copying ``src`` over it, only files that
+    differ are written. The size, mtime and sha256 hash of each file are kept
+    in a manifest next to ``dst``. A file is copied when its source or its
+    copy no longer match the manifest and their contents differ, and files
+    that are not in ``src`` are removed from ``dst``. When ``dst`` is already
+    current, nothing is written.
+
+    Args:
+        src: (:obj:`str`)
+            Path to the source directory.
+
+        dst: (:obj:`str`)
+            Path to the target directory. It is created if it does not
+            exist.
+
+        manifest: (:obj:`str`)
+            Path to the manifest file. When ``None``, the manifest is
+            ``.<name>.manifest.json`` in the parent directory of ``dst``.
+            (*Default*: ``None``)
+
+        link: (:obj:`bool`)
+            Hard link the files of ``dst`` to the files of ``src`` instead
+            of copying them, so no bytes are duplicated. Files are copied
+            when ``src`` and ``dst`` are on different filesystems.
+            (*Default*: ``False``)
+
+    Returns:
+        :obj:`dict`: The number of files that were ``copied``, ``removed``
+        and ``unchanged``.
+
+    """
+    manifest = manifest or manifest_path(dst)
+    previous = _load_manifest(manifest)
+    current = {}
+    counts = {'copied': 0, 'removed': 0, 'unchanged': 0}
+
+    if os.path.islink(dst) or (
+        os.path.lexists(dst) and not os.path.isdir(dst)
+    ):
+        # Never write through a link into its target
+        remove_path(dst)
+    watchmaker.utils.makedirs(dst)
+    link = link and hasattr(os, 'link') and (
+        os.stat(src).st_dev == os.stat(dst).st_dev
+    )
+
+    src_dirs, src_files = _walk(src)
+    for relpath in sorted(src_dirs):
+        path = os.path.join(dst, relpath)
+        if os.path.islink(path) or (
+            os.path.lexists(path) and not os.path.isdir(path)
+        ):
+            os.remove(path)
+        watchmaker.utils.makedirs(path)
+
+    for relpath in sorted(src_files):
+        src_path = os.path.join(src, relpath)
+        dst_path = os.path.join(dst, relpath)
+        src_key = _stat_key(src_path)
+        if src_key is None:
+            continue
+        record = previous.get(relpath) or {}
+        recorded = (record.get('size'), record.get('mtime'))
+
+        if src_key == recorded and record.get('sha256'):
+            sha256 = record['sha256']
+        else:
+            sha256 = _sha256(src_path)
+
+        dst_key = _stat_key(dst_path)
+        if link:
+            if _samefile(src_path, dst_path):
+                counts['unchanged'] += 1
+            else:
+                _copy(src_path, dst_path, link=True)
+                counts['copied'] += 1
+        elif dst_key == src_key == recorded:
+            counts['unchanged'] += 1
+        elif dst_key is not None and dst_key[0] == src_key[0] and (
+            _sha256(dst_path) == sha256
+        ):
+            if dst_key != src_key:
+                # Same content, only the timestamps differ
+                shutil.copystat(src_path, dst_path)
+            counts['unchanged'] += 1
+        else:
+            _copy(src_path, dst_path)
+            counts['copied'] += 1
+
+        current[relpath] = {
+            'size': src_key[0], 'mtime': src_key[1], 'sha256': sha256
+        }
+
+    dst_dirs, dst_files = _walk(dst, followlinks=False)
+    for relpath in dst_files:
+        if relpath not in current:
+            remove_path(os.path.join(dst, relpath))
+            counts['removed'] += 1
+    for relpath in sorted(dst_dirs - src_dirs, reverse=True):
+        path = os.path.join(dst, relpath)
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+
+    if current != previous:
+        atomic_write(manifest, json.dumps(
+            {'files': current}, sort_keys=True
+        ).encode('utf-8'))
+    log.debug(
+        'Synced %s to %s. copied=%s, removed=%s, unchanged=%s',
+        src, dst, counts['copied'], counts['removed'], counts['unchanged']
+    )
+    return counts
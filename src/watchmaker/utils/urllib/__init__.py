@@ -3,10 +3,94 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
+import threading
+
 # pylint: disable=import-error
 from six.moves.urllib import error, parse, request  # noqa: F401
 
-from watchmaker.utils.urllib.request_handlers import HAS_BOTO3, S3Handler
+from watchmaker.utils.urllib.request_handlers import S3Handler, has_boto3
+from watchmaker.utils.urllib.transport import HTTPTransport
+
+_S3_OPENER = {}
+_S3_OPENER_LOCK = threading.Lock()
+
+
+def s3_opener():
+    """
+    Return an opener that supports ``s3://`` URLs.
+
+    The opener is built on first use, so boto3 is only imported when an S3
+    URL is actually requested. When boto3 is not installed, the default
+    opener is returned and ``s3://`` URLs fail with the usual
+    :obj:`urllib.error.URLError`.
+    """
+    with _S3_OPENER_LOCK:
+        if 'opener' not in _S3_OPENER:
+            handlers = [S3Handler] if has_boto3() else []
+            _S3_OPENER['opener'] = request.build_opener(*handlers)
+    return _S3_OPENER['opener']
+
+
+def urlopen(url, *args, **kwargs):
+    """Open a URL, routing ``s3://`` URLs through :func:`s3_opener`."""
+    try:
+        full_url = url.get_full_url()
+    except AttributeError:
+        full_url = url
+    if parse.urlparse(full_url).scheme == 's3':
+        return s3_opener().open(url, *args, **kwargs)
+    return request.urlopen(url, *args, **kwargs)
+
+
+class UrllibTransport(object):
+    """Open URLs with the urllib openers, including ``s3://`` URLs."""
+
+    def open(self, url, headers=None, timeout=None):
+        """
+        Open ``url``.
+
+        Args:
+            url: (:obj:`str`)
+                URL to open.
+
+            headers: (:obj:`dict`)
+                Extra request headers.
+                (*Default*: ``None``)
+
+            timeout: (:obj:`float`)
+                Seconds to wait on the connection. When ``None``, the global
+                socket timeout is used.
+                (*Default*: ``None``)
+        """
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if headers:
+            url = request.Request(url, headers=headers)
+        return urlopen(url, **kwargs)
+
+
+_DEFAULT_TRANSPORT = UrllibTransport()
+_HTTP_TRANSPORT = HTTPTransport()
+_TRANSPORTS = {
+    'http': _HTTP_TRANSPORT,
+    'https': _HTTP_TRANSPORT,
+}
+
+
+def register_transport(scheme, transport):
+    """
+    Register the transport that opens URLs of ``scheme``.
+
+    A transport is any object with an ``open(url, headers=None,
+    timeout=None)`` method that returns a file-like response with ``read()``
+    and ``info()``, and that raises :obj:`urllib.error.URLError` on failures.
+    ``http`` and ``https`` use :class:`HTTPTransport`, and every other scheme
+    defaults to :class:`UrllibTransport`.
+    """
+    _TRANSPORTS[scheme] = transport
+
 
-if HAS_BOTO3:
-    request.install_opener(request.build_opener(S3Handler))
+def get_transport(scheme):
+    """Return the transport that opens URLs of ``scheme``."""
+    return _TRANSPORTS.get(scheme, _DEFAULT_TRANSPORT)
@@ -3,32 +3,264 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
+import calendar
+import collections
+import concurrent.futures
 import io
+import re
+import threading
 from email import message_from_string
+from email.utils import formatdate
 
 from six.moves import urllib
 
-HAS_BOTO3 = False
-try:
-    import boto3
-    HAS_BOTO3 = True
-except ImportError:
-    pass
+S3_MAX_POOL_CONNECTIONS = 64
 
+_RANGE_START = re.compile(r'^bytes=(\d+)-$')
+_CONTENT_RANGE_TOTAL = re.compile(r'^bytes \d+-\d+/(\d+)$')
 
-class BufferedIOS3Key(io.BufferedIOBase):
-    """Add a read method to S3 key object."""
+_S3_CLIENT = {}
+_S3_CLIENT_LOCK = threading.Lock()
 
-    def __init__(self, key, *args, **kwargs):
-        super(BufferedIOS3Key, self).__init__(*args, **kwargs)
-        self.read = key.get()['Body'].read
+
+def has_boto3():
+    """Return ``True`` if boto3 can be imported."""
+    try:
+        import boto3  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class S3RangedReader(io.BufferedIOBase):
+    """
+    Read a byte range of an S3 object with concurrent ranged GETs.
+
+    The range is split into parts of ``part_size`` bytes, which are fetched
+    by a pool of ``max_concurrency`` threads. ``read()`` returns the parts in
+    order, and at most ``max_concurrency`` parts are fetched ahead of the
+    reader, so memory use stays bounded.
+
+    Args:
+        fetch: (:obj:`callable`)
+            Called with the first and last byte offsets of a part, returns
+            the bytes of the part.
+
+        start: (:obj:`int`)
+            Offset of the first byte to read.
+
+        size: (:obj:`int`)
+            Size of the object.
+
+        part_size: (:obj:`int`)
+            Size of each ranged GET, in bytes.
+
+        max_concurrency: (:obj:`int`)
+            Maximum number of concurrent ranged GETs.
+    """
+
+    def __init__(self, fetch, start, size, part_size, max_concurrency):
+        super(S3RangedReader, self).__init__()
+        self._fetch = fetch
+        self._ranges = collections.deque(
+            (first, min(first + part_size, size) - 1)
+            for first in range(start, size, part_size)
+        )
+        self._window = max_concurrency
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency
+        )
+        self._pending = collections.deque()
+        self._part = b''
+        self._offset = 0
+        self._fill()
+
+    def _fill(self):
+        while self._ranges and len(self._pending) < self._window:
+            first, last = self._ranges.popleft()
+            self._pending.append(
+                self._executor.submit(self._fetch, first, last)
+            )
+
+    def _next_part(self):
+        future = self._pending.popleft()
+        self._fill()
+        try:
+            return future.result()
+        except Exception as exc:
+            self.close()
+            raise urllib.error.URLError(exc)
+
+    def readable(self):
+        """Return ``True``, the reader supports ``read()``."""
+        return True
+
+    def read(self, amt=None):
+        """Read up to ``amt`` bytes, or to the end of the range."""
+        pieces = []
+        while amt is None or amt < 0 or amt > 0:
+            if self._offset >= len(self._part):
+                if not self._pending:
+                    break
+                self._part, self._offset = self._next_part(), 0
+                continue
+            end = len(self._part)
+            if amt is not None and amt >= 0:
+                end = min(end, self._offset + amt)
+                amt -= end - self._offset
+            pieces.append(self._part[self._offset:end])
+            self._offset = end
+        return b''.join(pieces)
+
+    def close(self):
+        """Cancel the outstanding ranged GETs."""
+        while self._pending:
+            self._pending.popleft().cancel()
+        self._ranges.clear()
+        self._executor.shutdown(wait=False)
+        super(S3RangedReader, self).close()
+
+
+def s3_client():
+    """
+    Return the boto3 S3 client shared by all threads.
+
+    boto3 clients, unlike resources, are thread-safe. The client is built on
+    first use, with a connection pool large enough for concurrent downloads
+    that each use ranged GETs.
+    """
+    with _S3_CLIENT_LOCK:
+        if 'client' not in _S3_CLIENT:
+            import boto3
+            import botocore.config
+
+            _S3_CLIENT['client'] = boto3.session.Session().client(
+                's3',
+                config=botocore.config.Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS
+                )
+            )
+    return _S3_CLIENT['client']
+
+
+def _http_date(value):
+    if value is None:
+        return None
+    return formatdate(calendar.timegm(value.utctimetuple()), usegmt=True)
+
+
+class S3ObjectReader(io.BufferedIOBase):
+    """
+    Read the body of an S3 object from a sequence of streams, in order.
+
+    Errors raised while streaming are raised as
+    :obj:`urllib.error.URLError`, so callers can retry or resume.
+    """
+
+    def __init__(self, streams):
+        super(S3ObjectReader, self).__init__()
+        self._streams = collections.deque(streams)
+
+    def readable(self):
+        """Return ``True``, the reader supports ``read()``."""
+        return True
+
+    def read(self, amt=None):
+        """Read up to ``amt`` bytes, or to the end of the object."""
+        import botocore.exceptions
+
+        pieces = []
+        while self._streams and (amt is None or amt < 0 or amt > 0):
+            try:
+                data = self._streams[0].read(amt)
+            except botocore.exceptions.BotoCoreError as exc:
+                raise urllib.error.URLError(exc)
+            if not data:
+                self._streams.popleft().close()
+                continue
+            pieces.append(data)
+            if amt is not None and amt >= 0:
+                amt -= len(data)
+        return b''.join(pieces)
+
+    def close(self):
+        """Close the remaining streams."""
+        while self._streams:
+            self._streams.popleft().close()
+        super(S3ObjectReader, self).close()
 
 
 class S3Handler(urllib.request.BaseHandler):
-    """Define urllib handler for S3 objects."""
+    """
+    Define urllib handler for S3 objects.
+
+    The first ``GetObject`` call asks for one part, and the size of the
+    object in its response decides how the rest is read: with one more call
+    below ``multipart_threshold`` bytes, and with concurrent ranged GETs
+    from there, see :class:`S3RangedReader`.
+
+    Args:
+        multipart_threshold: (:obj:`int`)
+            Size, in bytes, from which objects are downloaded in parts.
+            ``None`` disables ranged GETs.
+            (*Default*: ``64 MiB``)
+
+        part_size: (:obj:`int`)
+            Size of each part, in bytes.
+            (*Default*: ``8 MiB``)
+
+        max_concurrency: (:obj:`int`)
+            Maximum number of concurrent ranged GETs per object.
+            (*Default*: ``8``)
+    """
+
+    MULTIPART_THRESHOLD = 64 * 1024 * 1024
+    PART_SIZE = 8 * 1024 * 1024
+    MAX_CONCURRENCY = 8
+
+    # boto3 client to use instead of the shared one, see s3_client()
+    client = None
+
+    def __init__(self, multipart_threshold=MULTIPART_THRESHOLD,
+                 part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+
+    def _get_object(self, origurl, **kwargs):
+        """Call ``GetObject``, raising client errors as ``HTTPError``."""
+        import botocore.exceptions
+
+        client = self.client or s3_client()
+        try:
+            return client.get_object(**kwargs)
+        except botocore.exceptions.ClientError as exc:
+            error = exc.response.get('Error', {})
+            status = exc.response.get(
+                'ResponseMetadata', {}
+            ).get('HTTPStatusCode')
+            if error.get('Code') in ('304', 'NotModified'):
+                status = 304
+            if not status:
+                raise
+            raise urllib.error.HTTPError(
+                origurl, status, error.get('Message') or error.get('Code'),
+                message_from_string(''), None
+            )
+        except botocore.exceptions.BotoCoreError as exc:
+            raise urllib.error.URLError(exc)
 
     def s3_open(self, req):
-        """Open S3 objects."""
+        """
+        Open S3 objects.
+
+        The headers of the response are taken from the first
+        ``GetObject`` call. When ranged GETs are enabled, that call asks for
+        the first part, so objects up to one part cost a single call. Its
+        ``Content-Range`` gives the size of the object, which decides
+        whether the rest is fetched with one more call or with concurrent
+        ranged GETs. No more bytes are requested than are read.
+        """
         # Credit: <https://github.com/ActiveState/code/tree/master/recipes/Python/578957_Urllib_handler_AmazS3>  # noqa: E501, pylint: disable=line-too-long
 
         # The implementation was inspired mainly by the code behind
@@ -49,28 +281,64 @@ class S3Handler(urllib.request.BaseHandler):
                 'url must be in the format s3://<bucket>/<key>'
             )
 
-        try:
-            s3_conn = self.s3_conn
-        except AttributeError:
-            # pylint: disable=attribute-defined-outside-init
-            s3_conn = self.s3_conn = boto3.resource("s3")
-
-        key = s3_conn.Object(bucket_name=bucket_name, key=key_name)
-
         origurl = 's3://{0}/{1}'.format(bucket_name, key_name)
 
-        if key is None:
-            raise urllib.error.URLError(
-                'no such resource: {0}'.format(origurl)
+        # Support conditional and ranged requests. S3 has no If-Range, so
+        # a changed object fails the IfMatch condition with a 412 instead
+        get_kwargs = {'Bucket': bucket_name, 'Key': key_name}
+        if req.get_header('If-none-match'):
+            get_kwargs['IfNoneMatch'] = req.get_header('If-none-match')
+        if req.get_header('If-range'):
+            get_kwargs['IfMatch'] = req.get_header('If-range')
+
+        requested = req.get_header('Range')
+        match = _RANGE_START.match(requested or '')
+        ranged = self.multipart_threshold is not None and (
+            not requested or match
+        )
+        start = int(match.group(1)) if match else 0
+        if ranged:
+            get_kwargs['Range'] = 'bytes={0}-{1}'.format(
+                start, start + self.part_size - 1
             )
+        elif requested:
+            get_kwargs['Range'] = requested
+
+        try:
+            response = self._get_object(origurl, **get_kwargs)
+        except urllib.error.HTTPError as exc:
+            if not (ranged and not requested and exc.code == 416):
+                raise
+            # An empty object has no satisfiable range
+            get_kwargs.pop('Range')
+            ranged = False
+            response = self._get_object(origurl, **get_kwargs)
+
+        streams = [response['Body']]
+        length = response.get('ContentLength')
+        content_range = response.get('ContentRange')
+        match = _CONTENT_RANGE_TOTAL.match(content_range or '')
+        if ranged and match:
+            total = int(match.group(1))
+            offset = start + length
+            length = total - start
+            content_range = 'bytes {0}-{1}/{2}'.format(start, total - 1, total)
+            if offset < total:
+                streams.append(self._remainder(
+                    origurl, bucket_name, key_name, response['ETag'],
+                    offset, total
+                ))
+            if not requested:
+                content_range = None
 
         headers = [
-            ('Content-type', key.content_type),
-            ('Content-encoding', key.content_encoding),
-            ('Content-language', key.content_language),
-            ('Content-length', key.content_length),
-            ('Etag', key.e_tag),
-            ('Last-modified', key.last_modified),
+            ('Content-type', response.get('ContentType')),
+            ('Content-encoding', response.get('ContentEncoding')),
+            ('Content-language', response.get('ContentLanguage')),
+            ('Content-length', length),
+            ('Content-range', content_range),
+            ('Etag', response.get('ETag')),
+            ('Last-modified', _http_date(response.get('LastModified'))),
         ]
 
         headers = message_from_string(
@@ -81,5 +349,29 @@ class S3Handler(urllib.request.BaseHandler):
         )
 
         return urllib.response.addinfourl(
-            BufferedIOS3Key(key), headers, origurl
+            S3ObjectReader(streams), headers, origurl,
+            code=206 if content_range else 200
+        )
+
+    def _remainder(self, origurl, bucket_name, key_name, etag, offset, total):
+        """Return a stream of the object from ``offset`` to the end."""
+        # Every part must come from the same version of the object
+        get_kwargs = {
+            'Bucket': bucket_name, 'Key': key_name, 'IfMatch': etag
+        }
+        if total - offset < max(
+            self.multipart_threshold - self.part_size, 1
+        ):
+            # Below the threshold, fetch the rest with one more call
+            get_kwargs['Range'] = 'bytes={0}-'.format(offset)
+            return self._get_object(origurl, **get_kwargs)['Body']
+
+        def _fetch(first, last):
+            return self._get_object(
+                origurl, Range='bytes={0}-{1}'.format(first, last),
+                **get_kwargs
+            )['Body'].read()
+
+        return S3RangedReader(
+            _fetch, offset, total, self.part_size, self.max_concurrency
         )
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""Pooled, keep-alive HTTP(S) transport."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import base64
+import io
+import socket
+import ssl
+import sys
+import threading
+import zlib
+
+# pylint: disable=import-error
+from six.moves import http_client
+from six.moves.urllib import error, parse, request
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+MAX_IDLE_PER_HOST = 4
+CHUNK_SIZE = 64 * 1024
+
+# Artifacts that compress well and are requested with gzip. Archives and
+# installers are already compressed, so they are always transferred as-is.
+TEXT_EXTENSIONS = (
+    '.cfg', '.conf', '.json', '.repo', '.sls', '.txt', '.yaml', '.yml'
+)
+
+USER_AGENT = 'Python-urllib/{0}.{1}'.format(*sys.version_info[:2])
+
+_SSL_CONTEXT = {}
+_SSL_CONTEXT_LOCK = threading.Lock()
+
+
+def ssl_context():
+    """
+    Return the SSL context shared by all HTTPS connections.
+
+    The context is the one ``urlopen_retry`` always used: it loads the
+    system's default CA certificates, but its ``CLIENT_AUTH`` purpose does
+    not verify the server certificate or hostname, so mirrors with
+    self-signed certificates keep working. It is built once, because loading
+    the CA bundle is expensive.
+
+    Returns:
+        :obj:`ssl.SSLContext`: The context, or ``None`` on python versions
+        without SSL contexts (before 2.7.9).
+
+    """
+    with _SSL_CONTEXT_LOCK:
+        if 'context' not in _SSL_CONTEXT:
+            try:
+                _SSL_CONTEXT['context'] = ssl.create_default_context(
+                    ssl.Purpose.CLIENT_AUTH
+                )
+            except AttributeError:
+                _SSL_CONTEXT['context'] = None
+    return _SSL_CONTEXT['context']
+
+
+def is_text_artifact(url):
+    """Return ``True`` if ``url`` names a file that is worth compressing."""
+    return parse.urlparse(url).path.lower().endswith(TEXT_EXTENSIONS)
+
+
+def _basic_auth(parts):
+    if not parts.username:
+        return None
+    credentials = '{0}:{1}'.format(
+        parse.unquote(parts.username), parse.unquote(parts.password or '')
+    )
+    return 'Basic {0}'.format(
+        base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+    )
+
+
+class _GzipReader(object):
+    """Decompress a gzip stream as it is read."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = bytearray()
+        self._eof = False
+
+    def read(self, amt=None):
+        while not self._eof and (amt is None or len(self._buffer) < amt):
+            chunk = self._fileobj.read(CHUNK_SIZE)
+            if chunk:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._buffer += self._decompressor.flush()
+                self._eof = True
+        if amt is None:
+            amt = len(self._buffer)
+        data = bytes(self._buffer[:amt])
+        del self._buffer[:amt]
+        return data
+
+
+class PooledResponse(object):
+    """
+    File-like response of :class:`HTTPTransport`.
+
+    Provides the same interface as the responses of
+    :func:`urllib.request.urlopen`. The connection goes back to the pool once
+    the body has been read to the end, and is discarded if the response is
+    closed early or a read fails.
+    """
+
+    def __init__(self, transport, key, conn, response, url):
+        self._transport = transport
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._stream = response
+        self.url = url
+        self.code = self.status = response.status
+        self.reason = response.reason
+        self.headers = self.msg = response.msg
+        encoding = response.getheader('Content-Encoding', '') or ''
+        if encoding.lower() == 'gzip':
+            self._stream = _GzipReader(response)
+
+    def read(self, amt=None):
+        """Read up to ``amt`` bytes of the body, or all of it."""
+        if self._conn is None:
+            return b''
+        try:
+            data = (
+                self._stream.read() if amt is None else self._stream.read(amt)
+            )
+        except Exception:
+            # The connection is left midway through the body
+            self.close()
+            raise
+        if amt is None or not data:
+            self._release()
+        return data
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if self._response.isclosed() and not self._response.will_close:
+            self._transport.checkin(self._key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """Close the response, discarding any unread body."""
+        if self._conn is not None:
+            # Unread data would desync the connection, do not reuse it
+            self._response.close()
+            self._conn.close()
+            self._conn = None
+
+    def info(self):
+        """Return the response headers."""
+        return self.headers
+
+    def geturl(self):
+        """Return the final URL of the response, after redirects."""
+        return self.url
+
+    def getcode(self):
+        """Return the HTTP status code of the response."""
+        return self.code
+
+    def __enter__(self):
+        """Support use as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the response on leaving the context."""
+        self.close()
+
+
+class HTTPTransport(object):
+    """
+    Open ``http://`` and ``https://`` URLs over pooled keep-alive connections.
+
+    Idle connections are kept per host, so consecutive downloads from the
+    same host reuse the TCP connection and TLS session. Requests for text
+    artifacts (see :data:`TEXT_EXTENSIONS`) accept gzip, and the body is
+    decompressed while it is read. Proxies are taken from the environment,
+    like :mod:`urllib` does, with ``CONNECT`` tunnels for ``https://`` URLs.
+
+    Responses other than ``2xx`` raise :obj:`urllib.error.HTTPError`, and
+    connection failures raise :obj:`urllib.error.URLError`.
+
+    Args:
+        max_idle: (:obj:`int`)
+            Maximum number of idle connections kept per host.
+            (*Default*: ``4``)
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_PER_HOST):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _proxy(parts):
+        proxy = request.getproxies().get(parts.scheme)
+        if not proxy or request.proxy_bypass(parts.hostname):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://{0}'.format(proxy)
+        return parse.urlparse(proxy)
+
+    def _connect(self, key, proxy, timeout):
+        scheme, host, port = key[:3]
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if scheme == 'https':
+            context = ssl_context()
+            if context is not None:
+                kwargs['context'] = context
+            cls = http_client.HTTPSConnection
+        else:
+            cls = http_client.HTTPConnection
+
+        if proxy is None:
+            return cls(host, port, **kwargs)
+
+        conn = cls(proxy.hostname, proxy.port or 80, **kwargs)
+        if scheme == 'https':
+            auth = _basic_auth(proxy)
+            conn.set_tunnel(
+                host, port,
+                headers={'Proxy-Authorization': auth} if auth else None
+            )
+        return conn
+
+    def checkout(self, key, timeout):
+        """Return an idle connection to ``key``, or ``None``."""
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None and conn.sock is not None:
+            conn.sock.settimeout(
+                socket.getdefaulttimeout() if timeout is None else timeout
+            )
+        return conn
+
+    def checkin(self, key, conn):
+        """Return a connection to the pool, once its response is read."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request(self, url, headers, timeout):
+        parts = parse.urlparse(url)
+        if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+            raise error.URLError('unsupported url: {0}'.format(url))
+        proxy = self._proxy(parts)
+        key = (
+            parts.scheme,
+            parts.hostname,
+            parts.port or DEFAULT_PORTS[parts.scheme],
+            proxy.netloc if proxy else None,
+        )
+
+        path = parts.path or '/'
+        if parts.query:
+            path = '{0}?{1}'.format(path, parts.query)
+        headers = dict(headers)
+        if proxy is not None and parts.scheme == 'http':
+            # Plain requests go to the proxy with the absolute url
+            path = parse.urlunparse(parts._replace(fragment=''))
+            auth = _basic_auth(proxy)
+            if auth:
+                headers['Proxy-Authorization'] = auth
+
+        conn = self.checkout(key, timeout)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(key, proxy, timeout)
+            try:
+                conn.request('GET', path, headers=headers)
+                return key, conn, conn.getresponse()
+            except (http_client.HTTPException, socket.error) as exc:
+                conn.close()
+                conn = None
+                if reused and not isinstance(exc, socket.timeout):
+                    # The server closed the idle connection, start over
+                    reused = False
+                    continue
+                raise error.URLError(exc)
+
+    def open(self, url, headers=None, timeout=None):
+        """
+        Open ``url``, following redirects.
+
+        Args:
+            url: (:obj:`str`)
+                URL to open.
+
+            headers: (:obj:`dict`)
+                Extra request headers.
+                (*Default*: ``None``)
+
+            timeout: (:obj:`float`)
+                Seconds to wait on the connection. When ``None``, the global
+                socket timeout is used.
+                (*Default*: ``None``)
+
+        Returns:
+            :obj:`PooledResponse`: The response.
+
+        """
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', USER_AGENT)
+        if is_text_artifact(url):
+            headers.setdefault('Accept-Encoding', 'gzip')
+
+        for _ in range(MAX_REDIRECTS + 1):
+            key, conn, response = self._request(url, headers, timeout)
+            pooled = PooledResponse(self, key, conn, response, url)
+            location = response.getheader('Location')
+            if response.status in REDIRECT_CODES and location:
+                pooled.read()
+                url = parse.urljoin(url, location)
+                continue
+            if response.status >= 300:
+                body = pooled.read()
+                raise error.HTTPError(
+                    url, response.status, response.reason, response.msg,
+                    io.BytesIO(body)
+                )
+            return pooled
+
+        raise error.HTTPError(
+            url, response.status, 'Too many redirects', response.msg, None
+        )
@@ -3,18 +3,167 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
-import ast
 import codecs
+import collections
+import concurrent.futures
 import json
 import os
+import shlex
 import shutil
-
-import yaml
+import subprocess
+import tempfile
+import threading
+import time
 
 import watchmaker.utils
 from watchmaker import static
-from watchmaker.exceptions import WatchmakerException
-from watchmaker.managers.base import LinuxManager, ManagerBase, WindowsManager
+from watchmaker.exceptions import SaltCallerUnavailable, WatchmakerException
+from watchmaker.managers.base import (OUTPUT_SPOOL_SIZE, CommandOutput,
+                                      LinuxManager, ManagerBase,
+                                      WindowsManager)
+from watchmaker.utils.json_stream import JSONStream
+from watchmaker.utils.sync import remove_path, symlink_tree, sync_tree
+
+
+class SaltCaller(object):
+    """
+    Client of a long-lived process that runs salt-call commands.
+
+    The process runs ``watchmaker/static/salt_caller.py`` with the python
+    interpreter of salt, and imports salt once for all commands. Requests
+    and responses are JSON lines on its stdin and stdout, see that script.
+    The output of each command is written to temporary files.
+
+    Args:
+        cmd: (:obj:`list`)
+            Command that starts the helper process.
+
+        stderr: (:obj:`file`)
+            Where the helper process writes output that does not belong to a
+            command.
+            (*Default*: ``None``)
+
+        tmpdir: (:obj:`str`)
+            Directory of the temporary output files. When ``None``, the
+            default temporary directory is used.
+            (*Default*: ``None``)
+    """
+
+    def __init__(self, cmd, stderr=None, tmpdir=None):
+        self.tmpdir = tmpdir
+        self._lock = threading.Lock()
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr
+        )
+        ready = self._read()
+        if not ready.get('ready'):
+            self.close()
+            raise WatchmakerException(
+                'The salt caller failed to start: {0}'.format(
+                    ready.get('error'))
+            )
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise WatchmakerException(
+                'The salt caller exited. retcode={0}'.format(
+                    self.process.wait())
+            )
+        return json.loads(line.decode('utf-8'))
+
+    def _send(self, request):
+        if self.process.poll() is not None:
+            raise SaltCallerUnavailable(
+                'The salt caller exited. retcode={0}'.format(
+                    self.process.returncode)
+            )
+        try:
+            self.process.stdin.write(
+                json.dumps(request).encode('utf-8') + b'\n'
+            )
+            self.process.stdin.flush()
+        except (IOError, OSError, ValueError) as exc:
+            raise SaltCallerUnavailable(
+                'The salt caller exited: {0}'.format(exc)
+            )
+
+    def call(self, args, lazy_output=False, spool_size=OUTPUT_SPOOL_SIZE):
+        """
+        Run ``salt-call`` with ``args`` in the helper process.
+
+        Raises :obj:`SaltCallerUnavailable` if the helper cannot take the
+        command, which then did not run. If the helper exits while it runs
+        the command, :obj:`WatchmakerException` is raised: the command may
+        have been partly applied, so it must not be run again.
+
+        Args:
+            args: (:obj:`list`)
+                Arguments of ``salt-call``.
+
+            lazy_output: (:obj:`bool`)
+                Return the output as :obj:`CommandOutput` handles, like
+                :meth:`ManagerBase.call_process` does.
+                (*Default*: ``False``)
+
+            spool_size: (:obj:`int`)
+                With ``lazy_output``, number of bytes of each output kept in
+                memory before spilling to disk.
+                (*Default*: ``8 MiB``)
+
+        Returns:
+            :obj:`dict`:
+                Dictionary containing three keys: ``retcode`` (:obj:`int`),
+                ``stdout`` (:obj:`bytes`), and ``stderr`` (:obj:`bytes`).
+                With ``lazy_output``, ``stdout`` and ``stderr`` are
+                :obj:`CommandOutput` handles.
+
+        """
+        paths = {}
+        try:
+            for name in ('stdout', 'stderr'):
+                fd_, paths[name] = tempfile.mkstemp(
+                    prefix='salt-caller-{0}-'.format(name), dir=self.tmpdir
+                )
+                os.close(fd_)
+            with self._lock:
+                self._send(dict(paths, args=list(args)))
+                try:
+                    response = self._read()
+                except ValueError as exc:
+                    raise WatchmakerException(
+                        'Invalid response from the salt caller: {0}'.format(
+                            exc)
+                    )
+            ret = {'retcode': response['retcode']}
+            for name, path in paths.items():
+                with open(path, 'rb') as fh_:
+                    if not lazy_output:
+                        ret[name] = fh_.read()
+                        continue
+                    # Copy the output in chunks, it may be large
+                    ret[name] = CommandOutput(spool_size)
+                    for chunk in iter(
+                        lambda: fh_.read(watchmaker.utils.COPY_BUFSIZE), b''
+                    ):
+                        ret[name].write(chunk)
+            return ret
+        finally:
+            for path in paths.values():
+                remove_path(path)
+
+    def close(self):
+        """Stop the helper process once it finishes the current command."""
+        with self._lock:
+            try:
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+            self.process.wait()
+            self.process.stdout.close()
 
 
 class SaltBase(ManagerBase):
@@ -58,6 +207,36 @@ class SaltBase(ManagerBase):
             submodule name.
             (*Default*: ``{}``)
 
+        salt_caller: (:obj:`bool`)
+            Run salt commands in one long-lived salt process instead of
+            starting ``salt-call`` for each command, so salt is loaded once.
+            The process starts once salt is installed, and commands that set
+            their own ``--log-file``, such as the state run, use
+            ``salt-call``. Falls back to ``salt-call`` when the process
+            cannot be started, or exits between commands. A command that is
+            running when the process exits fails, and is not run again.
+            (*Default*: ``False``)
+
+        formula_workers: (:obj:`int`)
+            Maximum number of user formulas that are retrieved and extracted
+            concurrently.
+            (*Default*: ``4``)
+
+        bundled_formulas: (:obj:`str`)
+            How the salt formulas bundled with Watchmaker are added to the
+            salt file roots. User formulas with the same name take precedence
+            in every mode.
+            (*Default*: ``copy``)
+
+            - ``copy``: Copy the formulas to the salt formula root. Only
+              files that changed since the last run are copied.
+            - ``package``: Add the formula directories of the installed
+              Watchmaker package to the file roots, without copying them.
+            - ``symlink``: Link each formula directory into the salt formula
+              root. Falls back to ``copy`` where links are not supported.
+            - ``hardlink``: Hard link the formula files into the salt formula
+              root. Falls back to ``copy`` across filesystems.
+
         admin_groups: (:obj:`str`)
             Sets a salt grain that specifies the domain groups that should have
             root privileges on Linux or admin privileges on Windows. Value must
@@ -82,6 +261,9 @@ class SaltBase(ManagerBase):
             (*Default*: ``''``)
     """
 
+    BUNDLED_FORMULAS_MODES = ('copy', 'package', 'symlink', 'hardlink')
+    FORMULA_WORKERS = 4
+
     def __init__(self, *args, **kwargs):
         # Init inherited classes
         super(SaltBase, self).__init__(*args, **kwargs)
@@ -97,6 +279,27 @@ class SaltBase(ManagerBase):
         self.admin_users = kwargs.pop('admin_users', None) or ''
         self.salt_states = kwargs.pop('salt_states', None) or ''
         self.exclude_states = kwargs.pop('exclude_states', None) or ''
+        self.salt_caller = str(
+            kwargs.pop('salt_caller', None)
+        ).lower() == 'true'
+        formula_workers = kwargs.pop('formula_workers', None)
+        self.formula_workers = max(1, int(
+            formula_workers if formula_workers not in (None, 'None')
+            else self.FORMULA_WORKERS
+        ))
+        self.bundled_formulas = (
+            kwargs.pop('bundled_formulas', None) or 'copy'
+        ).lower()
+        if self.bundled_formulas == 'none':
+            self.bundled_formulas = 'copy'
+        if self.bundled_formulas not in self.BUNDLED_FORMULAS_MODES:
+            raise WatchmakerException(
+                'Invalid value for `bundled_formulas`: {0}. Must be one of: '
+                '{1}'.format(
+                    self.bundled_formulas,
+                    ', '.join(self.BUNDLED_FORMULAS_MODES)
+                )
+            )
 
         # Init attributes used by SaltBase, overridden by inheriting classes
         self.salt_working_dir = None
@@ -110,6 +313,17 @@ class SaltBase(ManagerBase):
         self.salt_file_roots = None
         self.salt_state_args = None
         self.salt_debug_logfile = None
+        self._salt_caller = None
+        self._salt_caller_log = None
+        self._salt_caller_lock = threading.RLock()
+        self._salt_installed = False
+
+    @classmethod
+    def artifact_urls(cls, config):
+        """Return the URLs of the salt content and the user formulas."""
+        urls = [config.get('salt_content')]
+        urls += list((config.get('user_formulas') or {}).values())
+        return [url for url in urls if cls._is_artifact_url(url)]
 
     @staticmethod
     def _get_salt_dirs(srv):
@@ -140,8 +354,7 @@ class SaltBase(ManagerBase):
             '--log-file', self.salt_debug_logfile,
             '--log-file-level', 'debug',
             '--log-level', 'error',
-            '--out', 'quiet',
-            '--return', 'local'
+            '--out', 'json'
         ]
 
         for salt_dir in [
@@ -162,112 +375,186 @@ class SaltBase(ManagerBase):
             'w',
             encoding="utf-8"
         ) as fh_:
-            yaml.safe_dump(self.salt_conf, fh_, default_flow_style=False)
+            watchmaker.utils.yaml_safe_dump(
+                self.salt_conf, fh_, default_flow_style=False)
 
     def _get_formulas_conf(self):
 
         # Append Salt formulas bundled with Watchmaker package.
         formulas_path = os.sep.join((static.__path__[0], 'salt', 'formulas'))
+        package_roots = []
         for formula in os.listdir(formulas_path):
-            formula_path = os.path.join(self.salt_formula_root, '', formula)
-            if os.path.exists(formula_path):
-                shutil.rmtree(formula_path)
-            shutil.copytree(
-                os.sep.join((formulas_path, formula)),
-                formula_path)
+            if formula in self.user_formulas:
+                # Replaced by the user formula below
+                continue
+            formula_src = os.sep.join((formulas_path, formula))
+            formula_path = os.path.join(self.salt_formula_root, formula)
+            if self.bundled_formulas == 'package':
+                # Serve the formula from the package, drop any old copy
+                remove_path(formula_path)
+                package_roots.append(formula_src)
+                continue
+            if self.bundled_formulas == 'symlink':
+                if symlink_tree(formula_src, formula_path):
+                    continue
+                self.log.warning(
+                    'Unable to create symlinks, copying the bundled formula '
+                    'instead. formula=%s', formula
+                )
+            # Only files that changed since the last run are copied.
+            sync_tree(
+                formula_src, formula_path,
+                link=self.bundled_formulas == 'hardlink')
 
         # Obtain & extract any Salt formulas specified in user_formulas.
-        for formula_name, formula_url in self.user_formulas.items():
-            filename = os.path.basename(formula_url)
-            file_loc = os.sep.join((self.working_dir, filename))
-
-            # Download the formula
-            self.retrieve_file(formula_url, file_loc)
-
-            # Extract the formula
-            formula_working_dir = self.create_working_dir(
-                self.working_dir,
-                '{0}-'.format(filename)
-            )
-            self.extract_contents(
-                filepath=file_loc,
-                to_directory=formula_working_dir
-            )
-
-            # Get the first directory within the extracted directory
-            formula_inner_dir = os.path.join(
-                formula_working_dir,
-                next(os.walk(formula_working_dir))[1][0]
-            )
-
-            # Move the formula to the formula root
-            formula_loc = os.sep.join((self.salt_formula_root, formula_name))
-            self.log.debug(
-                'Placing user formula in salt file roots. formula_url=%s, '
-                'formula_loc=%s',
-                formula_url, formula_loc
+        # Formulas are retrieved concurrently and placed in config order, and
+        # a formula that fails does not stop the others.
+        failed = []
+        if self.user_formulas:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self.formula_workers, len(self.user_formulas))
+            ) as executor:
+                futures = [
+                    (name, url, executor.submit(self._retrieve_formula, url))
+                    for name, url in self.user_formulas.items()
+                ]
+                for formula_name, formula_url, future in futures:
+                    try:
+                        self._place_formula(
+                            formula_name, formula_url, *future.result()
+                        )
+                    except Exception as exc:  # pylint: disable=broad-except
+                        self.log.error(
+                            'Failed to retrieve user formula. formula=%s, '
+                            'formula_url=%s, error=%s',
+                            formula_name, formula_url, exc
+                        )
+                        failed.append(formula_name)
+        if failed:
+            raise WatchmakerException(
+                'Failed to retrieve user formulas: {0}'.format(
+                    ', '.join(failed))
             )
-            if os.path.exists(formula_loc):
-                shutil.rmtree(formula_loc)
-            shutil.move(formula_inner_dir, formula_loc)
 
         return [
             os.path.join(self.salt_formula_root, x) for x in next(os.walk(
                 self.salt_formula_root))[1]
-        ]
+        ] + package_roots
+
+    def _retrieve_formula(self, formula_url):
+        """Download and extract a user formula, return its directory."""
+        filename = watchmaker.utils.basename_from_uri(formula_url)
+        timings = collections.OrderedDict()
+
+        # Download and extract the formula
+        started = time.time()
+        formula_working_dir = self.create_working_dir(
+            self.working_dir,
+            '{0}-'.format(filename)
+        )
+        self.retrieve_and_extract(formula_url, formula_working_dir)
+        timings['retrieve'] = time.time() - started
+
+        # Get the first directory within the extracted directory
+        started = time.time()
+        formula_inner_dir = os.path.join(
+            formula_working_dir,
+            next(os.walk(formula_working_dir))[1][0]
+        )
+        timings['locate'] = time.time() - started
+        return formula_inner_dir, timings
+
+    def _place_formula(self, formula_name, formula_url, formula_inner_dir,
+                       timings):
+        # Move the formula to the formula root
+        started = time.time()
+        formula_loc = os.sep.join((self.salt_formula_root, formula_name))
+        self.log.debug(
+            'Placing user formula in salt file roots. formula_url=%s, '
+            'formula_loc=%s',
+            formula_url, formula_loc
+        )
+        remove_path(formula_loc)
+        shutil.move(formula_inner_dir, formula_loc)
+        timings['place'] = time.time() - started
+
+        self.log.info(
+            'Placed user formula. formula=%s, %s',
+            formula_name,
+            ', '.join(
+                '{0}={1:.2f}s'.format(stage, elapsed)
+                for stage, elapsed in timings.items()
+            )
+        )
 
     def _build_salt_formula(self, extract_dir):
         if self.salt_content:
-            salt_content_filename = watchmaker.utils.basename_from_uri(
-                self.salt_content
-            )
-            salt_content_file = os.sep.join((
-                self.working_dir,
-                salt_content_filename
-            ))
-            self.retrieve_file(self.salt_content, salt_content_file)
-            self.extract_contents(
-                filepath=salt_content_file,
-                to_directory=extract_dir
-            )
+            self.retrieve_and_extract(self.salt_content, extract_dir)
 
         with codecs.open(
             os.path.join(self.salt_conf_path, 'minion'),
             'r+',
             encoding="utf-8"
         ) as fh_:
-            salt_conf = yaml.safe_load(fh_)
+            salt_conf = watchmaker.utils.yaml_safe_load(fh_)
             salt_conf.update(self.salt_file_roots)
             fh_.seek(0)
-            yaml.safe_dump(salt_conf, fh_, default_flow_style=False)
-
-    def _set_grain(self, grain, value):
+            watchmaker.utils.yaml_safe_dump(
+                salt_conf, fh_, default_flow_style=False)
+
+    def _set_grains(self, grains):
+        # Set all grains with one salt-call, each call costs seconds
+        self.log.info(
+            'Setting grains %s ...',
+            ', '.join('`{0}`'.format(grain) for grain in grains)
+        )
         cmd = [
-            'grains.setval',
-            grain,
-            str(json.dumps(value))
+            'grains.setvals',
+            str(json.dumps(grains))
         ]
         self.run_salt(cmd)
 
-    def _get_failed_states(self, state_ret):
+    def _get_failed_states(self, chunks):
+        """
+        Parse the JSON return of a state run, one state at a time.
+
+        Returns:
+            :obj:`tuple`: The failed states, and a :obj:`dict` counting the
+            states that ran: ``total``, ``succeeded``, ``failed`` and
+            ``changed``. The failed states are ``None`` if the return cannot
+            be parsed.
+
+        """
         failed_states = {}
+        summary = dict.fromkeys(
+            ('total', 'succeeded', 'failed', 'changed'), 0)
+        salt_id_delim = '_|-'
+        salt_id_pos = 1
+        stream = JSONStream(chunks)
         try:
-            # parse state return
-            salt_id_delim = '_|-'
-            salt_id_pos = 1
-            for state, data in state_ret['return'].items():
-                if data['result'] is False:
-                    state_id = state.split(salt_id_delim)[salt_id_pos]
-                    failed_states[state_id] = data
-        except AttributeError:
-            # some error other than a failed state, msg is in the 'return' key
-            self.log.debug('Salt return (AttributeError): %s', state_ret)
-            failed_states = state_ret['return']
-        except KeyError:
-            # not sure what failed, just return everything
-            self.log.debug('Salt return (KeyError): %s', state_ret)
-            failed_states = state_ret
-        return failed_states
+            for _ in stream.keys():
+                if stream.peek() != '{':
+                    # some error other than a failed state, msg is the value
+                    failed_states = stream.value()
+                    self.log.debug('Salt return (error): %s', failed_states)
+                    continue
+                # parse state return
+                for state in stream.keys():
+                    data = stream.value()
+                    summary['total'] += 1
+                    if data.get('changes'):
+                        summary['changed'] += 1
+                    if data['result'] is False:
+                        summary['failed'] += 1
+                        state_id = state.split(salt_id_delim)[salt_id_pos]
+                        failed_states[state_id] = data
+                    elif data['result']:
+                        summary['succeeded'] += 1
+        except (AttributeError, IndexError, KeyError, ValueError) as exc:
+            # not sure what failed, the caller reports the whole return
+            self.log.debug('Salt return (%s): %s', type(exc).__name__, exc)
+            failed_states = None
+        return failed_states, summary
 
     def run_salt(self, command, **kwargs):
         """
@@ -280,6 +567,144 @@ class SaltBase(ManagerBase):
                 ``--local``, ``--retcode-passthrough``, and ``--no-color``, so
                 do not specify those options in the command.
         """
+        cmd = self._salt_cmd(command)
+        # Salt sets up its log file once per process, so a command with its
+        # own log file runs in a process of its own
+        caller = None if '--log-file' in cmd else self._get_salt_caller()
+        if caller is None:
+            return self.call_process(cmd, **kwargs)
+
+        self.log.debug('Command (salt caller): %s', ' '.join(cmd))
+        lazy_output = kwargs.get('lazy_output', False)
+        try:
+            ret = caller.call(
+                cmd[1:], lazy_output=lazy_output,
+                spool_size=kwargs.get('spool_size', OUTPUT_SPOOL_SIZE)
+            )
+        except SaltCallerUnavailable as exc:
+            self.log.warning(
+                'The salt caller failed, falling back to salt-call: %s', exc
+            )
+            self._close_salt_caller()
+            self.salt_caller = False
+            return self.call_process(cmd, **kwargs)
+        except WatchmakerException as exc:
+            # The command may be partly applied, do not run it again
+            self._close_salt_caller()
+            self.salt_caller = False
+            msg = 'Command failed! {0}, cmd={1}'.format(exc, ' '.join(cmd))
+            self.log.critical(msg)
+            raise WatchmakerException(msg)
+
+        # Log the output like call_process does, a lazy output line by line
+        log_pipe = kwargs.get('log_pipe', 'all')
+        for name, logger in (
+            ('stdout', self.log.debug), ('stderr', self.log.error)
+        ):
+            if log_pipe not in [name, 'all']:
+                continue
+            lines = ret[name] if lazy_output else ret[name].splitlines()
+            for line in lines:
+                logger('%s%s', 'Command {0}: '.format(name), line.rstrip())
+        self.log.debug('Command retcode: %s', ret['retcode'])
+
+        if kwargs.get('raise_error', True) and ret['retcode'] != 0:
+            if lazy_output:
+                ret['stdout'].close()
+                ret['stderr'].close()
+            msg = 'Command failed! Exit code={0}, cmd={1}'.format(
+                ret['retcode'], ' '.join(cmd))
+            self.log.critical(msg)
+            raise WatchmakerException(msg)
+        return ret
+
+    def run_salt_async(self, command, **kwargs):
+        """
+        Start executing a salt command in the background.
+
+        Commands run on the pool of :meth:`call_process_async`. When the salt
+        caller is enabled, they run in the salt caller, one at a time.
+
+        Args:
+            command: (:obj:`str` or :obj:`list`)
+                Salt command, see :meth:`run_salt`.
+
+            kwargs:
+                Arguments of :meth:`run_salt`.
+
+        Returns:
+            :obj:`concurrent.futures.Future`:
+                Future of the dictionary returned by :meth:`run_salt`.
+
+        """
+        return self._get_process_executor().submit(
+            self.run_salt, command, **kwargs
+        )
+
+    def _salt_python(self):
+        """Return the command that runs salt's python interpreter."""
+        try:
+            with open(self.salt_call, 'rb') as fh_:
+                shebang = fh_.readline().decode('utf-8', 'replace')
+        except (IOError, OSError, TypeError):
+            return None
+        if not shebang.startswith('#!'):
+            # salt-call is a binary, e.g. a onedir install
+            return None
+        return shlex.split(shebang[2:].strip())
+
+    def _get_salt_caller(self):
+        with self._salt_caller_lock:
+            return self._start_salt_caller()
+
+    def _start_salt_caller(self):
+        if not self.salt_caller or self._salt_caller is not None:
+            return self._salt_caller
+        if not self._salt_installed:
+            # The process would keep the modules of a salt that is replaced
+            return None
+        python = self._salt_python()
+        if not python:
+            self.log.warning(
+                'Unable to find the python interpreter of salt, running '
+                'salt commands with salt-call'
+            )
+            self.salt_caller = False
+            return None
+
+        helper = os.path.join(static.__path__[0], 'salt_caller.py')
+        self._salt_caller_log = open(
+            os.path.join(self.salt_log_dir, 'salt_caller.log'), 'ab'
+        )
+        try:
+            self._salt_caller = SaltCaller(
+                python + [helper], stderr=self._salt_caller_log,
+                tmpdir=self.working_dir
+            )
+        except (OSError, WatchmakerException) as exc:
+            self.log.warning(
+                'Unable to start the salt caller, running salt commands '
+                'with salt-call: %s', exc
+            )
+            self._close_salt_caller()
+            self.salt_caller = False
+        return self._salt_caller
+
+    def _close_salt_caller(self):
+        with self._salt_caller_lock:
+            caller, self._salt_caller = self._salt_caller, None
+            if caller is not None:
+                caller.close()
+            if self._salt_caller_log is not None:
+                self._salt_caller_log.close()
+                self._salt_caller_log = None
+
+    def cleanup(self):
+        """Stop the salt caller and delete the working directory."""
+        self._close_salt_caller()
+        super(SaltBase, self).cleanup()
+
+    def _salt_cmd(self, command):
         cmd = [
             self.salt_call,
             '--local',
@@ -292,8 +717,7 @@ class SaltBase(ManagerBase):
             cmd.extend(command)
         else:
             cmd.append(command)
-
-        return self.call_process(cmd, **kwargs)
+        return cmd
 
     def service_status(self, service):
         """
@@ -318,9 +742,13 @@ class SaltBase(ManagerBase):
             'service.enabled', service,
             '--out', 'newline_values_only'
         ]
-        return (
-            self.run_salt(cmd_status)['stdout'].strip().lower() == b'true',
-            self.run_salt(cmd_enabled)['stdout'].strip().lower() == b'true'
+        # The queries are independent, run them concurrently
+        futures = [
+            self.run_salt_async(cmd) for cmd in (cmd_status, cmd_enabled)
+        ]
+        return tuple(
+            future.result()['stdout'].strip().lower() == b'true'
+            for future in futures
         )
 
     def service_stop(self, service):
@@ -403,11 +831,49 @@ class SaltBase(ManagerBase):
         ]
         return self.run_salt(cmd)['stdout'].strip().lower() == b'true'
 
-    def process_grains(self):
-        """Set salt grains."""
+    def service_restore(self, service, running, enabled):
+        """
+        Set whether a service is enabled, and start it, with one salt-call.
+
+        Replaces calling :meth:`service_enable` or :meth:`service_disable`
+        and then :meth:`service_start`, which take one salt-call each.
+
+        Args:
+            service: (:obj:`str`)
+                Name of the service.
+
+            running: (:obj:`bool`)
+                Whether to start the service. When ``False``, the service is
+                left as it is.
+
+            enabled: (:obj:`bool`)
+                Whether the service is enabled.
+
+        Returns:
+            :obj:`bool`:
+                ``True`` if the service was set up. ``False`` if it could not
+                be.
+
+        """
+        if running:
+            cmd = [
+                'state.single', 'service.running', 'name={0}'.format(service),
+                'enable={0}'.format(enabled)
+            ]
+        else:
+            cmd = [
+                'state.single',
+                'service.enabled' if enabled else 'service.disabled',
+                'name={0}'.format(service)
+            ]
+        cmd.extend(['--out', 'quiet'])
+        return self.run_salt(cmd, raise_error=False)['retcode'] == 0
+
+    def _get_grains(self):
+        grains = collections.OrderedDict()
         ent_env = {'enterprise_environment': str(self.ent_env)}
-        self._set_grain('systemprep', ent_env)
-        self._set_grain('watchmaker', ent_env)
+        grains['systemprep'] = ent_env
+        grains['watchmaker'] = ent_env
 
         grain = {}
         if self.ou_path and self.ou_path != 'None':
@@ -417,11 +883,16 @@ class SaltBase(ManagerBase):
         if self.admin_users and self.admin_users != 'None':
             grain['admin_users'] = self.admin_users.split(':')
         if grain:
-            self._set_grain('join-domain', grain)
+            grains['join-domain'] = grain
 
         if self.computer_name and self.computer_name != 'None':
             name = {'computername': str(self.computer_name)}
-            self._set_grain('name-computer', name)
+            grains['name-computer'] = name
+        return grains
+
+    def process_grains(self):
+        """Set salt grains."""
+        self._set_grains(self._get_grains())
 
         self.log.info('Syncing custom salt modules...')
         self.run_salt('saltutil.sync_all')
@@ -447,7 +918,7 @@ class SaltBase(ManagerBase):
                 'No States were specified. Will not apply any salt states.'
             )
         else:
-            cmd = self.salt_state_args
+            cmd = list(self.salt_state_args)
 
             if states.lower() == 'highstate':
                 self.log.info(
@@ -465,14 +936,36 @@ class SaltBase(ManagerBase):
             if exclude:
                 cmd.extend(['exclude={0}'.format(exclude)])
 
-            ret = self.run_salt(cmd, log_pipe='stderr', raise_error=False)
+            # Spill a large state return to disk, and parse it as it is read
+            ret = self.run_salt(
+                cmd, log_pipe='stderr', raise_error=False, lazy_output=True
+            )
+            stdout = ret['stdout']
+            lazy = hasattr(stdout, 'stream')
+            try:
+                failed_states, summary = self._get_failed_states(
+                    stdout.stream() if lazy else [stdout]
+                )
+                if failed_states is None:
+                    # not sure what failed, just return everything
+                    failed_states = (
+                        stdout.read() if lazy else stdout
+                    ).decode('utf-8', 'replace')
+            finally:
+                for output in (ret['stdout'], ret['stderr']):
+                    if hasattr(output, 'close'):
+                        output.close()
+            self.log.info(
+                'Salt states summary: total=%s, succeeded=%s, failed=%s, '
+                'changed=%s',
+                summary['total'], summary['succeeded'], summary['failed'],
+                summary['changed']
+            )
 
             if ret['retcode'] != 0:
-                failed_states = self._get_failed_states(
-                    ast.literal_eval(ret['stdout'].decode('utf-8')))
                 if failed_states:
                     raise WatchmakerException(
-                        yaml.safe_dump(
+                        watchmaker.utils.yaml_safe_dump(
                             {
                                 'Salt state execution failed':
                                 failed_states
@@ -556,6 +1049,19 @@ class SaltLinux(SaltBase, LinuxManager):
             'conf_dir': self.salt_conf_path
         }
 
+    @classmethod
+    def artifact_urls(cls, config):
+        """Also return the URL of the salt bootstrap, for git installs."""
+        urls = super(SaltLinux, cls).artifact_urls(config)
+        install_method = config.get('install_method') or 'yum'
+        bootstrap_source = config.get('bootstrap_source')
+        if (
+            install_method.lower() == 'git' and
+            cls._is_artifact_url(bootstrap_source)
+        ):
+            urls.append(bootstrap_source)
+        return urls
+
     def _configuration_validation(self):
         if self.install_method.lower() == 'git':
             if not self.bootstrap_source:
@@ -601,10 +1107,6 @@ class SaltLinux(SaltBase, LinuxManager):
 
         super(SaltLinux, self)._build_salt_formula(extract_dir)
 
-    def _set_grain(self, grain, value):
-        self.log.info('Setting grain `%s` ...', grain)
-        super(SaltLinux, self)._set_grain(grain, value)
-
     def _selinux_status(self):
         selinux_getenforce = self.call_process(['getenforce'])
         return selinux_getenforce['stdout'].strip().lower() == b'enforcing'
@@ -623,17 +1125,16 @@ class SaltLinux(SaltBase, LinuxManager):
         if os.path.exists(self.salt_call):
             salt_running, salt_enabled = self.service_status(salt_svc)
         self._install_package()
+        self._salt_installed = True
         salt_stopped = self.service_stop(salt_svc)
         self._build_salt_formula(self.salt_srv)
-        if salt_enabled:
-            if not self.service_enable(salt_svc):
-                self.log.error('Failed to enable %s service', salt_svc)
-        else:
-            if not self.service_disable(salt_svc):
-                self.log.error('Failed to disable %s service', salt_svc)
-        if salt_running and salt_stopped:
-            if not self.service_start(salt_svc):
-                self.log.error('Failed to restart %s service', salt_svc)
+        if not self.service_restore(
+            salt_svc, salt_running and salt_stopped, salt_enabled
+        ):
+            self.log.error(
+                'Failed to restore %s service. running=%s, enabled=%s',
+                salt_svc, salt_running, salt_enabled
+            )
 
         self.process_grains()
 
@@ -709,6 +1210,14 @@ class SaltWindows(SaltBase, WindowsManager):
             'winrepo_dir': os.sep.join((self.salt_win_repo, 'winrepo'))
         }
 
+    @classmethod
+    def artifact_urls(cls, config):
+        """Also return the URL of the salt installer."""
+        urls = super(SaltWindows, cls).artifact_urls(config)
+        if cls._is_artifact_url(config.get('installer_url')):
+            urls.append(config['installer_url'])
+        return urls
+
     def _install_package(self):
         installer_name = os.sep.join((
             self.working_dir,
@@ -737,9 +1246,17 @@ class SaltWindows(SaltBase, WindowsManager):
 
         super(SaltWindows, self)._build_salt_formula(extract_dir)
 
-    def _set_grain(self, grain, value):
-        self.log.info('Setting grain `%s` ...', grain)
-        super(SaltWindows, self)._set_grain(grain, value)
+    def _salt_python(self):
+        python = os.sep.join((self.salt_root, 'bin', 'python.exe'))
+        return [python] if os.path.isfile(python) else None
+
+    def _get_grains(self):
+        grains = collections.OrderedDict()
+        if self.ash_role and self.ash_role != 'None':
+            role = {'lookup': {'role': str(self.ash_role)}}
+            grains['ash-windows'] = role
+        grains.update(super(SaltWindows, self)._get_grains())
+        return grains
 
     def install(self):
         """Install salt and execute salt states."""
@@ -751,21 +1268,16 @@ class SaltWindows(SaltBase, WindowsManager):
         if os.path.exists(self.salt_call):
             salt_running, salt_enabled = self.service_status(salt_svc)
         self._install_package()
+        self._salt_installed = True
         salt_stopped = self.service_stop(salt_svc)
         self._build_salt_formula(self.salt_srv)
-        if salt_enabled:
-            if not self.service_enable(salt_svc):
-                self.log.error('Failed to enable %s service', salt_svc)
-        else:
-            if not self.service_disable(salt_svc):
-                self.log.error('Failed to disable %s service', salt_svc)
-        if salt_running and salt_stopped:
-            if not self.service_start(salt_svc):
-                self.log.error('Failed to restart %s service', salt_svc)
-
-        if self.ash_role and self.ash_role != 'None':
-            role = {'lookup': {'role': str(self.ash_role)}}
-            self._set_grain('ash-windows', role)
+        if not self.service_restore(
+            salt_svc, salt_running and salt_stopped, salt_enabled
+        ):
+            self.log.error(
+                'Failed to restore %s service. running=%s, enabled=%s',
+                salt_svc, salt_running, salt_enabled
+            )
 
         self.process_grains()
 
@@ -43,6 +43,24 @@ class Yum(LinuxManager):
         super(Yum, self).__init__(*args, **kwargs)
         self.dist_info = self.get_dist_info()
 
+    @classmethod
+    def artifact_urls(cls, config):
+        """Return the URLs of the repo files that apply to this system."""
+        repo_map = config.get('repo_map') or []
+        if not isinstance(repo_map, list):
+            return []
+        try:
+            yum = cls(system_params={}, repo_map=repo_map)
+        except (EnvironmentError, WatchmakerException):
+            # Unsupported system, the worker reports it when it runs
+            return []
+        return [
+            repo['url'] for repo in repo_map
+            if isinstance(repo, dict) and 'dist' in repo and
+            cls._is_artifact_url(repo.get('url')) and
+            yum._validate_repo(repo)
+        ]
+
     def _get_amazon_el_version(self, version):
         # All amzn linux distros currently available use el6-based packages.
         # When/if amzn linux switches a distro to el7, rethink this.
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Shared pytest fixtures."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import gzip
+import hashlib
+import io
+import re
+import socket
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer, socketserver
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the files registered on the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):  # noqa: D102
+        pass
+
+    def setup(self):  # noqa: D102
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections.append(self.request)
+
+    def do_GET(self):  # noqa: D102,N802
+        server = self.server
+        server.requests.append((self.path, dict(self.headers.items())))
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        data = server.files[self.path]
+        etag = '"{0}"'.format(hashlib.sha256(data).hexdigest())
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        status, start = 200, 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            status, start = 206, int(match.group(1))
+
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, len(data) - 1, len(data)))
+            data = data[start:]
+        elif 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fh_:
+                fh_.write(data)
+            data = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+        with server.lock:
+            cutoff = server.truncate.pop(self.path, None)
+        if cutoff is not None:
+            # Drop the connection partway through the body
+            data = data[:cutoff]
+            self.close_connection = True
+        with server.lock:
+            server.sent += len(data)
+        self.wfile.write(data)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP/1.1 server that drops keep-alive connections on close."""
+
+    daemon_threads = True
+
+    def server_close(self):  # noqa: D102
+        BaseHTTPServer.HTTPServer.server_close(self)
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+@pytest.fixture
+def http_server():
+    """
+    Run a local HTTP server in a thread.
+
+    Register content with ``server.files['/path'] = b'data'`` and build URLs
+    with ``server.url('/path')``. Each request is recorded in
+    ``server.requests`` as a ``(path, headers)`` tuple, and each accepted
+    connection in ``server.connections``. Responses are gzipped when the
+    client accepts it, and ``Range`` requests are supported.
+
+    To simulate a flaky origin, ``server.truncate['/path'] = n`` drops the
+    connection after ``n`` bytes of the next response body for that path.
+    ``server.sent`` counts the body bytes sent.
+    """
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.lock = threading.Lock()
+    server.connections = []
+    server.files = {}
+    server.requests = []
+    server.truncate = {}
+    server.sent = 0
+    server.url = lambda path: 'http://127.0.0.1:{0}{1}'.format(
+        server.server_address[1], path)
+
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
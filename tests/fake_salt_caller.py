@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Fake salt caller, speaks the protocol of ``static/salt_caller.py``.
+
+Commands are not run. Each command writes its arguments as JSON to stdout
+and logs ``warning <last argument>`` to stderr, and returns ``3`` if its
+arguments include ``fail``. Like salt, the log handler is bound to the
+``sys.stderr`` of the first command. A command with the argument ``crash``
+kills the process.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'src', 'watchmaker', 'static'
+))
+
+import salt_caller  # noqa: E402
+
+LOG = logging.getLogger('fake_salt_caller')
+
+
+def _run(args):
+    if 'crash' in args:
+        os._exit(1)
+    if not LOG.handlers:
+        LOG.addHandler(logging.StreamHandler(sys.stderr))
+    sys.stdout.write(json.dumps({'args': args, 'pid': os.getpid()}))
+    sys.stdout.write('\n')
+    LOG.warning('warning %s', args[-1])
+    return 3 if 'fail' in args else 0
+
+
+if __name__ == '__main__':
+    sys.exit(salt_caller.main(run=_run, prepare=lambda: None))
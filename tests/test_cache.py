@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker cache test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import hashlib
+import os
+
+import pytest
+
+from watchmaker.exceptions import ChecksumMismatch
+from watchmaker.utils import urllib
+from watchmaker.utils.cache import DownloadCache
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_download_cache_revalidates(http_server, tmpdir):
+    """An unchanged file is revalidated with If-None-Match."""
+    http_server.files['/config.yaml'] = b'all: []'
+    url = http_server.url('/config.yaml')
+    cache = DownloadCache(str(tmpdir))
+
+    assert cache.fetch(url) == b'all: []'
+    assert cache.fetch(url) == b'all: []'
+
+    first, second = [headers for _, headers in http_server.requests]
+    assert 'If-None-Match' not in first
+    assert second['If-None-Match'].startswith('"')
+
+
+def test_download_cache_updates(http_server, tmpdir):
+    """A changed file replaces the cached copy."""
+    http_server.files['/config.yaml'] = b'all: []'
+    url = http_server.url('/config.yaml')
+    cache = DownloadCache(str(tmpdir))
+    cache.fetch(url)
+
+    http_server.files['/config.yaml'] = b'linux: []'
+
+    assert cache.fetch(url) == b'linux: []'
+
+
+def test_download_cache_fallback(http_server, mocker, tmpdir):
+    """The cached copy is used when the origin is unreachable."""
+    # Do not wait on retries for the copy that is too stale to use
+    mocker.patch('time.sleep')
+    http_server.files['/config.yaml'] = b'all: []'
+    url = http_server.url('/config.yaml')
+    cache = DownloadCache(str(tmpdir))
+    cache.fetch(url)
+    http_server.shutdown()
+    http_server.server_close()
+
+    assert cache.fetch(url, timeout=1) == b'all: []'
+
+    with pytest.raises(urllib.error.URLError):
+        cache.fetch(url, max_stale=-1, timeout=1)
+
+
+def test_download_cache_client_error(http_server, tmpdir):
+    """A 404 from the origin is not masked by the cached copy."""
+    http_server.files['/config.yaml'] = b'all: []'
+    url = http_server.url('/config.yaml')
+    cache = DownloadCache(str(tmpdir))
+    cache.fetch(url)
+    del http_server.files['/config.yaml']
+
+    with pytest.raises(urllib.error.HTTPError):
+        cache.fetch(url)
+
+
+def test_download_cache_pinned(http_server, tmpdir):
+    """A pinned file in the cache is used without contacting the origin."""
+    http_server.files['/foo.zip'] = b'foo'
+    url = http_server.url('/foo.zip')
+    cache = DownloadCache(str(tmpdir.join('cache')))
+
+    cache.retrieve(url, str(tmpdir.join('first')), sha256=_sha256(b'foo'))
+    cache.retrieve(url, str(tmpdir.join('second')), sha256=_sha256(b'foo'))
+
+    assert len(http_server.requests) == 1
+    assert tmpdir.join('second').read_binary() == b'foo'
+
+
+def test_download_cache_checksum_mismatch(http_server, tmpdir):
+    """A download that does not match its pin is rejected and not kept."""
+    http_server.files['/foo.zip'] = b'foo'
+    url = http_server.url('/foo.zip')
+    cache = DownloadCache(str(tmpdir))
+
+    with pytest.raises(ChecksumMismatch):
+        cache.fetch(url, sha256=_sha256(b'bar'))
+
+    assert not tmpdir.join('blobs').listdir()
+    assert cache.fetch(url, sha256=_sha256(b'foo')) == b'foo'
+
+
+def test_download_cache_evicts_lru(http_server, tmpdir):
+    """The least recently used files are evicted past the size cap."""
+    cache = DownloadCache(str(tmpdir), max_size=8)
+    for index, name in enumerate(('a', 'b', 'c')):
+        http_server.files['/' + name] = name.encode('ascii') * 4
+        cache.fetch(http_server.url('/' + name))
+        path = tmpdir.join('blobs', _sha256(name.encode('ascii') * 4))
+        # Order the blobs by use, regardless of the timer resolution
+        if path.exists():
+            os.utime(str(path), (index, index))
+
+    blobs = set(path.basename for path in tmpdir.join('blobs').listdir())
+    assert blobs == set((_sha256(b'bbbb'), _sha256(b'cccc')))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker config test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import watchmaker.config
+from watchmaker.cli import main
+from watchmaker.exceptions import WatchmakerException
+
+CONFIG = b'''
+all:
+  - salt:
+      salt_states: Highstate
+      environment: dev
+linux:
+  - yum:
+      repo_map: []
+  - salt:
+      environment: test
+      install_method: yum
+'''
+
+
+def test_load_merges_all_into_system():
+    """The `all` node overrides the system node, in listed worker order."""
+    config = watchmaker.config.load(CONFIG, 'linux')
+
+    assert list(config) == ['yum', 'salt']
+    assert config['salt']['config'] == {
+        'salt_states': 'Highstate',
+        'environment': 'dev',
+        'install_method': 'yum',
+    }
+
+
+def test_compiled_snapshot_matches_config():
+    """A compiled snapshot loads to the same worker configs."""
+    snapshot = json.dumps(watchmaker.config.compile_config(
+        watchmaker.config.parse(CONFIG), 'linux'))
+
+    compiled = watchmaker.config.load(snapshot.encode('utf-8'), 'linux')
+
+    assert compiled == watchmaker.config.load(CONFIG, 'linux')
+
+
+def test_compiled_snapshot_rejects_tampering():
+    """A snapshot whose workers do not match the content hash is rejected."""
+    snapshot = watchmaker.config.compile_config(
+        watchmaker.config.parse(CONFIG), 'linux')
+    snapshot['workers'][0][1]['repo_map'] = ['https://example.com/x.repo']
+
+    with pytest.raises(WatchmakerException):
+        watchmaker.config.load_compiled(snapshot, 'linux')
+
+    with pytest.raises(WatchmakerException):
+        watchmaker.config.load_compiled(snapshot, 'windows')
+
+
+def test_cli_config_compile(tmpdir):
+    """`watchmaker config compile` writes a loadable snapshot."""
+    config = tmpdir.join('config.yaml')
+    config.write_binary(CONFIG)
+    output = tmpdir.join('config.json')
+
+    result = CliRunner().invoke(main, [
+        'config', 'compile', '-c', str(config), '--system', 'linux',
+        '-o', str(output)
+    ])
+
+    assert result.exit_code == 0, result.output
+    assert watchmaker.config.load(output.read_binary(), 'linux') == \
+        watchmaker.config.load(CONFIG, 'linux')
+
+
+def test_cli_config_compile_dates(tmpdir):
+    """YAML dates are compiled as strings."""
+    config = tmpdir.join('config.yaml')
+    config.write_binary(CONFIG + b'  - foo:\n      since: 2020-01-02\n')
+    output = tmpdir.join('config.json')
+
+    result = CliRunner().invoke(main, [
+        'config', 'compile', '-c', str(config), '--system', 'linux',
+        '-o', str(output)
+    ])
+
+    assert result.exit_code == 0, result.output
+    compiled = watchmaker.config.load(output.read_binary(), 'linux')
+    assert compiled['foo']['config'] == {'since': '2020-01-02'}
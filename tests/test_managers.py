@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker managers test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import collections
+import concurrent.futures
+import hashlib
+import io
+import os
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+import watchmaker.utils
+from watchmaker.exceptions import ChecksumMismatch, WatchmakerException
+from watchmaker.managers.base import ManagerBase
+from watchmaker.managers.workers import LinuxWorkersManager
+from watchmaker.utils import urllib
+
+
+class FakeWorker(object):
+    """Worker that records its installs."""
+
+    installed = []
+
+    def __init__(self, system_params, **kwargs):
+        self.kwargs = kwargs
+
+    def install(self):
+        """Record the install."""
+        self.installed.append(self.kwargs)
+
+
+class FakeEntryPoint(object):
+    """Minimal stand-in for an entry point."""
+
+    name = 'fake'
+
+    def load(self):
+        """Return the fake worker."""
+        return FakeWorker
+
+
+def _workers(*names):
+    return collections.OrderedDict(
+        (name, {'config': {'name': name}}) for name in names)
+
+
+def test_get_worker_builtin():
+    """Built-in workers are resolved by name."""
+    from watchmaker.workers.yum import Yum
+
+    manager = LinuxWorkersManager({}, _workers())
+
+    assert manager.get_worker('yum') is Yum
+    assert manager.get_worker('not-a-worker') is None
+
+
+def test_get_worker_skips_entry_points_for_builtins(mocker):
+    """Entry points are only scanned for names that are not built in."""
+    entry_points = mocker.patch.object(
+        watchmaker.utils, 'entry_points', return_value={})
+
+    manager = LinuxWorkersManager({}, _workers())
+    manager.get_worker('salt')
+
+    assert not entry_points.called
+
+
+def test_worker_cadence_entry_point(mocker):
+    """Workers registered as entry points run in config order."""
+    mocker.patch.object(
+        watchmaker.utils, 'entry_points',
+        return_value={'fake': FakeEntryPoint()})
+    FakeWorker.installed = []
+
+    manager = LinuxWorkersManager({}, _workers('fake', 'unknown'))
+    manager.worker_cadence()
+
+    assert FakeWorker.installed == [{'name': 'fake'}]
+
+
+def test_artifact_urls(mocker):
+    """The manifest lists the files of all workers, without duplicates."""
+    mocker.patch(
+        'watchmaker.workers.yum.Yum.get_dist_info',
+        return_value={'dist': 'centos', 'el_version': '7'}
+    )
+    workers = collections.OrderedDict((
+        ('yum', {'config': {'repo_map': [
+            {'dist': 'all', 'el_version': 7, 'url': 'https://x/a.repo'},
+            {'dist': 'all', 'el_version': 6, 'url': 'https://x/b.repo'},
+            {'dist': 'centos', 'el_version': 7, 'url': 'https://x/c.repo'},
+            {'dist': 'amazon', 'el_version': 7, 'url': 'https://x/d.repo'},
+            {'dist': 'all', 'el_version': 7, 'url': '/local/e.repo'},
+            {'dist': 'all', 'el_version': 7, 'url': 'file:///local/f.repo'},
+        ]}}),
+        ('salt', {'config': {
+            'salt_content': 'https://x/content.zip',
+            'user_formulas': {'foo': 'https://x/a.repo'},
+            'install_method': 'git',
+            'bootstrap_source': 'None',
+        }}),
+    ))
+
+    manager = LinuxWorkersManager({}, workers)
+
+    assert manager.artifact_urls() == [
+        'https://x/a.repo', 'https://x/c.repo', 'https://x/content.zip'
+    ]
+
+
+def test_artifact_urls_unsupported_dist(mocker):
+    """No repo files are listed when the distro cannot be determined."""
+    mocker.patch(
+        'watchmaker.workers.yum.Yum.get_dist_info',
+        side_effect=WatchmakerException('Unsupported OS distribution.')
+    )
+    manager = LinuxWorkersManager({}, collections.OrderedDict((
+        ('yum', {'config': {'repo_map': [
+            {'dist': 'all', 'el_version': 7, 'url': 'https://x/a.repo'},
+        ]}}),
+    )))
+
+    assert manager.artifact_urls() == []
+
+
+def test_prefetch_and_retrieve(http_server, mocker, tmpdir):
+    """Prefetched files are reused instead of being retrieved again."""
+    # Do not wait on retries for the missing file
+    mocker.patch('time.sleep')
+    mocker.patch(
+        'watchmaker.workers.yum.Yum.get_dist_info',
+        return_value={'dist': 'centos', 'el_version': '7'}
+    )
+    http_server.files['/a.repo'] = b'a'
+    http_server.files['/content.zip'] = b'content'
+    workers = collections.OrderedDict((
+        ('yum', {'config': {'repo_map': [
+            {'dist': 'all', 'el_version': 7,
+             'url': http_server.url('/a.repo')},
+            {'dist': 'all', 'el_version': 7,
+             'url': http_server.url('/missing.repo')},
+        ]}}),
+        ('salt', {'config': {
+            'salt_content': http_server.url('/content.zip'),
+            # Extracted as it downloads, so not prefetched
+            'user_formulas': {'f': http_server.url('/formula.tar.gz')},
+        }}),
+    ))
+    system_params = {'workingdir': str(tmpdir)}
+
+    manager = LinuxWorkersManager(system_params, workers)
+    manager.prefetch(max_workers=2)
+
+    assert sorted(system_params['prefetched']) == sorted([
+        http_server.url('/a.repo'), http_server.url('/content.zip')
+    ])
+    requests = len(http_server.requests)
+
+    target = tmpdir.join('content.zip')
+    ManagerBase(system_params).retrieve_file(
+        http_server.url('/content.zip'), str(target))
+
+    assert target.read_binary() == b'content'
+    assert len(http_server.requests) == requests
+
+    # The copy is independent of the prefetched file
+    target.write_binary(b'changed')
+    assert ManagerBase(system_params)._use_prefetched(
+        http_server.url('/content.zip'), str(tmpdir.join('again.zip')))
+    assert tmpdir.join('again.zip').read_binary() == b'content'
+
+
+def test_retrieve_file_checksum_pin(http_server, tmpdir):
+    """A pinned file is verified, with or without the download cache."""
+    http_server.files['/foo.zip'] = b'foo'
+    url = http_server.url('/foo.zip')
+    good = '{0}#sha256={1}'.format(url, hashlib.sha256(b'foo').hexdigest())
+    bad = '{0}#sha256={1}'.format(url, hashlib.sha256(b'bar').hexdigest())
+    target = tmpdir.join('foo.zip')
+
+    for system_params in (
+        {},
+        {'downloadcache': str(tmpdir.join('cache'))},
+    ):
+        manager = ManagerBase(system_params)
+
+        with pytest.raises(ChecksumMismatch):
+            manager.retrieve_file(bad, str(target))
+        assert not target.exists()
+
+        manager.retrieve_file(good, str(target))
+        assert target.read_binary() == b'foo'
+        target.remove()
+
+
+def _tar_gz(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def test_retrieve_and_extract_streams(http_server, tmpdir):
+    """A pinned tar archive is extracted as it downloads, and verified."""
+    data = _tar_gz([('formula/init.sls', b'foo'), ('formula/map.jinja', b'')])
+    http_server.files['/formula.tar.gz'] = data
+    url = '{0}#sha256={1}'.format(
+        http_server.url('/formula.tar.gz'), hashlib.sha256(data).hexdigest())
+    working_dir = tmpdir.mkdir('working')
+    manager = ManagerBase({})
+    manager.working_dir = str(working_dir)
+
+    manager.retrieve_and_extract(url, str(tmpdir.join('target')))
+
+    assert tmpdir.join('target', 'formula', 'init.sls').read() == 'foo'
+    assert tmpdir.join('target').listdir() == [
+        tmpdir.join('target', 'formula')]
+    assert not working_dir.listdir()
+
+    with pytest.raises(ChecksumMismatch):
+        manager.retrieve_and_extract(
+            url.replace(url[-8:], '0' * 8), str(tmpdir.join('bad')))
+    assert not tmpdir.join('bad').listdir()
+
+
+def test_retrieve_and_extract_falls_back(http_server, mocker, tmpdir):
+    """A stream that fails partway is retrieved and extracted instead."""
+    mocker.patch('time.sleep')
+    data = _tar_gz([('formula/init.sls', os.urandom(64 * 1024))])
+    http_server.files['/formula.tgz'] = data
+    http_server.truncate['/formula.tgz'] = len(data) // 2
+    manager = ManagerBase({})
+    manager.working_dir = str(tmpdir.mkdir('working'))
+
+    manager.retrieve_and_extract(
+        http_server.url('/formula.tgz'), str(tmpdir.join('target')))
+
+    assert tmpdir.join('target', 'formula', 'init.sls').size() == 64 * 1024
+
+
+def test_retrieve_and_extract_http_error(http_server, mocker, tmpdir):
+    """An HTTP error is raised, without retrieving the archive again."""
+    mocker.patch('time.sleep')
+    manager = ManagerBase({})
+    manager.working_dir = str(tmpdir.mkdir('working'))
+
+    with pytest.raises(urllib.error.HTTPError):
+        manager.retrieve_and_extract(
+            http_server.url('/missing.tgz'), str(tmpdir.join('target')))
+
+    assert len(http_server.requests) == 5
+
+
+def _read_only_dir_tar_gz():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        info = tarfile.TarInfo('formula')
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o555
+        info.mtime = 1000000000
+        tar.addfile(info)
+        info = tarfile.TarInfo('formula/init.sls')
+        info.size = 3
+        tar.addfile(info, io.BytesIO(b'foo'))
+    return buf.getvalue()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX modes only.')
+@pytest.mark.parametrize('stream', [False, True])
+def test_extract_read_only_dir(stream, http_server, tmpdir):
+    """Directory attributes are set after their contents are extracted."""
+    data = _read_only_dir_tar_gz()
+    target = tmpdir.join('target')
+    manager = ManagerBase({})
+    manager.working_dir = str(tmpdir.mkdir('working'))
+    if stream:
+        http_server.files['/formula.tgz'] = data
+        manager.retrieve_and_extract(
+            http_server.url('/formula.tgz'), str(target))
+    else:
+        archive = tmpdir.join('formula.tgz')
+        archive.write_binary(data)
+        manager.extract_contents(str(archive), str(target))
+
+    formula = target.join('formula')
+    try:
+        assert formula.join('init.sls').read() == 'foo'
+        assert formula.stat().mode & 0o777 == 0o555
+        assert formula.stat().mtime == 1000000000
+    finally:
+        formula.chmod(0o755)
+
+
+def test_extract_contents_unsafe_path(tmpdir):
+    """Members that would be written outside the target are refused."""
+    archive = tmpdir.join('evil.tar.gz')
+    archive.write_binary(_tar_gz([('../evil.txt', b'evil')]))
+
+    with pytest.raises(WatchmakerException):
+        ManagerBase({}).extract_contents(
+            str(archive), str(tmpdir.join('target')))
+    assert not tmpdir.join('evil.txt').exists()
+
+
+def test_extract_contents_concurrent(tmpdir):
+    """Archives extract correctly from many threads at once."""
+    members = [
+        ('formula-{0}/file-{1}.sls'.format(i, j), os.urandom(256))
+        for i in range(4) for j in range(25)
+    ]
+    tar_path = tmpdir.join('formula.tar.gz')
+    tar_path.write_binary(_tar_gz(members))
+    zip_path = tmpdir.join('formula.zip')
+    with zipfile.ZipFile(str(zip_path), 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    cwd = os.getcwd()
+    umask = os.umask(0o022)
+    os.umask(umask)
+    manager = ManagerBase({})
+
+    def _extract(index):
+        target = manager.create_working_dir(str(tmpdir), 'extract-')
+        archive = tar_path if index % 2 else zip_path
+        manager.extract_contents(str(archive), target)
+        return target
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        targets = list(executor.map(_extract, range(64)))
+
+    assert os.getcwd() == cwd
+    assert os.umask(umask) == umask
+    for target in targets:
+        if os.name != 'nt':
+            assert os.stat(target).st_mode & 0o777 == 0o700
+        for name, data in members:
+            with open(os.path.join(target, name), 'rb') as fh_:
+                assert fh_.read() == data
+
+
+@pytest.mark.parametrize('suffix', ['.tar.xz', '.tar.zst'])
+def test_extract_contents_codecs(suffix, tmpdir):
+    """Tar archives compressed with xz or zstd are extracted."""
+    members = [('formula/init.sls', b'foo'), ('formula/map.jinja', b'bar')]
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    if suffix == '.tar.zst':
+        zstandard = pytest.importorskip('zstandard')
+        data = zstandard.ZstdCompressor().compress(tar_data.getvalue())
+    else:
+        lzma = pytest.importorskip('lzma')
+        data = lzma.compress(tar_data.getvalue())
+    archive = tmpdir.join('formula' + suffix)
+    archive.write_binary(data)
+
+    ManagerBase({}).extract_contents(str(archive), str(tmpdir.join('out')))
+
+    for name, data in members:
+        assert tmpdir.join('out', name).read_binary() == data
+
+
+def test_extract_contents_parallel_zip(tmpdir):
+    """Zip members are split across threads, each with its own ZipFile."""
+    archive = tmpdir.join('formula.zip')
+    with zipfile.ZipFile(str(archive), 'w', zipfile.ZIP_DEFLATED) as zip_:
+        zip_.writestr('formula/', b'')
+        for index in range(200):
+            zip_.writestr(
+                'formula/states/{0}/{1}.sls'.format(index % 7, index),
+                b'x' * index)
+            zip_.writestr('formula/files/{0}.txt'.format(index), b'y' * index)
+
+    ManagerBase({}).extract_contents(
+        str(archive), str(tmpdir.join('out')), max_workers=4)
+
+    assert len(tmpdir.join('out', 'formula', 'files').listdir()) == 200
+    assert tmpdir.join('out', 'formula', 'files', '42.txt').size() == 42
+
+
+# Prints 2000 numbered lines on stdout and one line on stderr
+OUTPUT_CMD = [
+    sys.executable, '-c',
+    'import sys\n'
+    'for i in range(2000):\n'
+    '    sys.stdout.write("line {0}\\n".format(i))\n'
+    'sys.stderr.write("done\\n")\n'
+]
+
+
+def test_call_process_output():
+    """The output of a command is returned as bytes."""
+    ret = ManagerBase({}).call_process(OUTPUT_CMD)
+
+    assert ret['retcode'] == 0
+    assert ret['stdout'].splitlines()[-1] == b'line 1999'
+    assert ret['stderr'] == b'done\n'
+
+
+def test_call_process_lazy_output():
+    """Lazy output spills to disk past the cap and can be streamed."""
+    expected = b''.join(
+        'line {0}\n'.format(i).encode('ascii') for i in range(2000)
+    )
+
+    ret = ManagerBase({}).call_process(
+        OUTPUT_CMD, lazy_output=True, spool_size=1024)
+
+    with ret['stdout'] as stdout, ret['stderr'] as stderr:
+        assert stdout.spilled
+        assert not stderr.spilled
+        assert len(stdout) == len(expected)
+        assert stdout.read() == expected
+        assert b''.join(stdout.stream(chunk_size=100)) == expected
+        assert next(iter(stdout)) == b'line 0\n'
+        assert stderr.read() == b'done\n'
+
+
+@pytest.mark.parametrize('use_selectors', [True, False])
+def test_call_process_logging(mocker, use_selectors):
+    """Each line is logged, whether pipes are selected on or threaded."""
+    if not use_selectors:
+        mocker.patch('watchmaker.managers.base.selectors', None)
+    manager = ManagerBase({})
+    debug = mocker.patch.object(manager.log, 'debug')
+    error = mocker.patch.object(manager.log, 'error')
+    cmd = [
+        sys.executable, '-c',
+        'import sys\n'
+        'sys.stdout.write("a\\n\\nb  \\nno newline")\n'
+        'sys.stderr.write("oops\\n")\n'
+    ]
+
+    ret = manager.call_process(cmd)
+
+    assert ret['stdout'] == b'a\n\nb  \nno newline'
+    assert [
+        call[0][2] for call in debug.call_args_list
+        if call[0][0] == '%s%s'
+    ] == [b'a', b'', b'b', b'no newline']
+    assert error.call_args_list == [
+        mocker.call('%s%s', 'Command stderr: ', b'oops')
+    ]
+
+
+def _sleep_cmd(seconds, retcode=0):
+    return [
+        sys.executable, '-c',
+        'import sys, time\n'
+        'time.sleep({0})\n'
+        'sys.stdout.write("{0}")\n'
+        'sys.exit({1})\n'.format(seconds, retcode)
+    ]
+
+
+def test_call_process_async():
+    """A background command resolves to the result of call_process."""
+    future = ManagerBase({}).call_process_async(_sleep_cmd(0))
+
+    assert future.result() == {'retcode': 0, 'stdout': b'0', 'stderr': b''}
+
+
+def test_gather_processes():
+    """Commands run concurrently, and results keep the order of commands."""
+    manager = ManagerBase({})
+    delays = [0.6, 0.3, 0.3]
+
+    started = time.time()
+    rets = manager.gather_processes([_sleep_cmd(delay) for delay in delays])
+
+    assert time.time() - started < sum(delays)
+    assert [ret['stdout'] for ret in rets] == [b'0.6', b'0.3', b'0.3']
+
+
+def test_gather_processes_shared_pool(mocker):
+    """Commands run on the shared pool, at most max_concurrency at once."""
+    manager = ManagerBase({})
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def _call_process(cmd, **kwargs):
+        with lock:
+            running.append(cmd)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(cmd)
+        return {'cmd': cmd}
+    mocker.patch.object(manager, 'call_process', side_effect=_call_process)
+    submit = mocker.spy(ManagerBase._get_process_executor(), 'submit')
+
+    rets = manager.gather_processes([['a'], ['b'], ['c']], max_concurrency=2)
+
+    assert [ret['cmd'] for ret in rets] == [['a'], ['b'], ['c']]
+    assert max(peak) <= 2
+    assert submit.call_count == 3
+
+    ManagerBase.shutdown_process_executor()
+    assert ManagerBase._process_executor is None
+
+
+def test_gather_processes_error():
+    """The first failure is raised once all commands have finished."""
+    manager = ManagerBase({})
+
+    with pytest.raises(WatchmakerException, match='Exit code=3'):
+        manager.gather_processes(
+            [_sleep_cmd(0, retcode=3), _sleep_cmd(0.1, retcode=4)],
+            max_concurrency=1
+        )
+    assert manager.gather_processes([]) == []
@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker salt worker test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import collections
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import watchmaker.utils
+import watchmaker.workers.salt
+from watchmaker import static
+from watchmaker.exceptions import WatchmakerException
+from watchmaker.managers.base import CommandOutput
+from watchmaker.workers.salt import SaltBase, SaltCaller, SaltWindows
+
+
+@pytest.fixture
+def salt(mocker, tmpdir):
+    """Return a salt worker with two bundled formulas."""
+    package = tmpdir.join('package')
+    for formula in ('ash-linux-formula', 'scap-formula'):
+        path = package.join('salt', 'formulas', formula, 'init.sls')
+        path.ensure()
+        path.write('bundled')
+    mocker.patch.object(static, '__path__', [str(package)])
+
+    def _salt(**kwargs):
+        worker = SaltBase({}, **kwargs)
+        worker.working_dir = str(tmpdir.ensure('working', dir=True))
+        worker.salt_formula_root = str(tmpdir.ensure('formulas', dir=True))
+        return worker
+    return _salt
+
+
+def _roots(worker):
+    return sorted(
+        os.path.relpath(root, os.path.dirname(worker.salt_formula_root))
+        for root in worker._get_formulas_conf()
+    )
+
+
+def test_bundled_formulas_copy(salt):
+    """Bundled formulas are copied to the formula root by default."""
+    worker = salt()
+
+    assert _roots(worker) == [
+        os.path.join('formulas', 'ash-linux-formula'),
+        os.path.join('formulas', 'scap-formula'),
+    ]
+
+
+def test_bundled_formulas_package(salt):
+    """Bundled formulas are served from the package, replacing old copies."""
+    salt()._get_formulas_conf()
+    worker = salt(bundled_formulas='package')
+
+    assert _roots(worker) == [
+        os.path.join('package', 'salt', 'formulas', 'ash-linux-formula'),
+        os.path.join('package', 'salt', 'formulas', 'scap-formula'),
+    ]
+    assert not any(
+        os.path.isdir(os.path.join(worker.salt_formula_root, name))
+        for name in os.listdir(worker.salt_formula_root)
+    )
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='no symlinks')
+def test_bundled_formulas_symlink(salt):
+    """Bundled formulas are linked into the formula root."""
+    worker = salt(bundled_formulas='symlink')
+    roots = worker._get_formulas_conf()
+
+    assert len(roots) == 2
+    assert all(os.path.islink(root) for root in roots)
+
+
+def test_bundled_formulas_user_override(salt, mocker):
+    """A user formula replaces the bundled formula of the same name."""
+    worker = salt(
+        bundled_formulas='package',
+        user_formulas={'scap-formula': 'https://x/scap-formula.zip'}
+    )
+
+    def _extract(url, to_directory):
+        formula = os.path.join(to_directory, 'scap-formula-master')
+        os.makedirs(formula)
+        with io.open(os.path.join(formula, 'init.sls'), 'w') as fh_:
+            fh_.write('user')
+    mocker.patch.object(worker, 'retrieve_and_extract', side_effect=_extract)
+
+    assert _roots(worker) == [
+        os.path.join('formulas', 'scap-formula'),
+        os.path.join('package', 'salt', 'formulas', 'ash-linux-formula'),
+    ]
+
+
+def test_bundled_formulas_invalid():
+    """An unknown mode is rejected."""
+    with pytest.raises(WatchmakerException):
+        SaltBase({}, bundled_formulas='rsync')
+
+
+def _fake_extract(delays):
+    def _extract(url, to_directory):
+        name = os.path.basename(url).split('.')[0]
+        time.sleep(delays.get(name, 0))
+        if name == 'broken':
+            raise WatchmakerException('broken archive')
+        formula = os.path.join(to_directory, '{0}-master'.format(name))
+        os.makedirs(formula)
+        with io.open(os.path.join(formula, 'init.sls'), 'w') as fh_:
+            fh_.write(name)
+    return _extract
+
+
+def test_user_formulas_concurrent(salt, mocker):
+    """User formulas are retrieved concurrently and placed in order."""
+    names = ['a', 'b', 'c', 'd']
+    worker = salt(
+        bundled_formulas='package',
+        formula_workers=4,
+        user_formulas=collections.OrderedDict(
+            (name, 'https://x/{0}.zip'.format(name)) for name in names
+        )
+    )
+    lock = threading.Lock()
+    started, finished = [], []
+    all_started, others_finished = threading.Event(), threading.Event()
+    extract = _fake_extract({})
+
+    def _extract(url, to_directory):
+        name = os.path.basename(url).split('.')[0]
+        with lock:
+            started.append(name)
+            if len(started) == len(names):
+                all_started.set()
+        # No retrieval finishes before all of them are running, and the
+        # first formula finishes last
+        all_started.wait(10)
+        if name == 'a':
+            others_finished.wait(10)
+        extract(url, to_directory)
+        with lock:
+            finished.append(name)
+            if len(finished) == len(names) - 1:
+                others_finished.set()
+    mocker.patch.object(worker, 'retrieve_and_extract', side_effect=_extract)
+    place = mocker.spy(worker, '_place_formula')
+
+    worker._get_formulas_conf()
+
+    assert all_started.is_set()
+    assert finished[-1] == 'a'
+    assert [call[0][0] for call in place.call_args_list] == names
+    assert [
+        list(call[0][3]) for call in place.call_args_list
+    ] == [['retrieve', 'locate', 'place']] * len(names)
+
+
+def test_user_formulas_failure(salt, mocker):
+    """A failed formula is reported after the others are placed."""
+    worker = salt(
+        bundled_formulas='package',
+        user_formulas=collections.OrderedDict((
+            ('broken', 'https://x/broken.zip'),
+            ('good', 'https://x/good.zip'),
+        ))
+    )
+    mocker.patch.object(
+        worker, 'retrieve_and_extract', side_effect=_fake_extract({})
+    )
+
+    with pytest.raises(WatchmakerException, match='broken'):
+        worker._get_formulas_conf()
+
+    assert os.path.isfile(
+        os.path.join(worker.salt_formula_root, 'good', 'init.sls')
+    )
+
+
+def test_service_status(mocker):
+    """The running and enabled queries are both issued."""
+    worker = SaltBase({})
+    worker.salt_call = 'salt-call'
+    worker.salt_conf_path = 'conf'
+
+    def _call_process(cmd, **kwargs):
+        return {'stdout': b'True\n' if 'service.status' in cmd else b'False'}
+    mocker.patch.object(worker, 'call_process', side_effect=_call_process)
+
+    assert worker.service_status('salt-minion') == (True, False)
+
+
+def _grains_calls(worker, mocker):
+    run_salt = mocker.patch.object(worker, 'run_salt')
+    worker.process_grains()
+    return [call[0][0] for call in run_salt.call_args_list]
+
+
+def test_process_grains(mocker):
+    """All grains are set with a single salt-call."""
+    worker = SaltBase(
+        {}, environment='dev', ou_path='OU=x', admin_groups='a:b',
+        admin_users='None', computer_name='host'
+    )
+
+    calls = _grains_calls(worker, mocker)
+
+    assert len(calls) == 2
+    assert calls[0][0] == 'grains.setvals'
+    grains = json.loads(calls[0][1], object_pairs_hook=collections.OrderedDict)
+    assert grains == {
+        'systemprep': {'enterprise_environment': 'dev'},
+        'watchmaker': {'enterprise_environment': 'dev'},
+        'join-domain': {'oupath': 'OU=x', 'admin_groups': ['a', 'b']},
+        'name-computer': {'computername': 'host'},
+    }
+    assert list(grains) == [
+        'systemprep', 'watchmaker', 'join-domain', 'name-computer'
+    ]
+    assert calls[1] == 'saltutil.sync_all'
+
+
+def test_process_grains_windows(mocker, tmpdir):
+    """The ash-windows role grain is set along with the others."""
+    mocker.patch.dict(os.environ, {'systemdrive': 'C:'})
+    worker = SaltWindows(
+        {'prepdir': str(tmpdir), 'logdir': str(tmpdir),
+         'workingdir': str(tmpdir)},
+        ash_role='mss'
+    )
+
+    calls = _grains_calls(worker, mocker)
+
+    grains = json.loads(calls[0][1], object_pairs_hook=collections.OrderedDict)
+    assert list(grains) == ['ash-windows', 'systemprep', 'watchmaker']
+    assert grains['ash-windows'] == {'lookup': {'role': 'mss'}}
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('running,enabled,expected', [
+    (True, True, ['service.running', 'name=salt-minion', 'enable=True']),
+    (True, False, ['service.running', 'name=salt-minion', 'enable=False']),
+    (False, True, ['service.enabled', 'name=salt-minion']),
+    (False, False, ['service.disabled', 'name=salt-minion']),
+])
+def test_service_restore(mocker, running, enabled, expected):
+    """The service is enabled or disabled, and started, with one call."""
+    worker = SaltBase({})
+    run_salt = mocker.patch.object(
+        worker, 'run_salt', return_value={'retcode': 0})
+
+    assert worker.service_restore('salt-minion', running, enabled)
+    assert run_salt.call_args_list == [mocker.call(
+        ['state.single'] + expected + ['--out', 'quiet'], raise_error=False
+    )]
+
+
+FAKE_SALT_CALLER = [
+    sys.executable,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'fake_salt_caller.py')
+]
+
+
+def test_salt_caller(tmpdir):
+    """Commands run in one helper process, with the salt-call return."""
+    caller = SaltCaller(FAKE_SALT_CALLER, tmpdir=str(tmpdir))
+    try:
+        first = caller.call(['--local', 'test.ping'])
+        second = caller.call(['--local', 'fail'])
+    finally:
+        caller.close()
+
+    assert first['retcode'] == 0
+    # The log handler set up by the first command writes to the output of
+    # each command
+    assert first['stderr'] == b'warning test.ping\n'
+    assert second['stderr'] == b'warning fail\n'
+    assert not tmpdir.listdir()
+    assert json.loads(first['stdout'].decode('utf-8'))['args'] == [
+        '--local', 'test.ping'
+    ]
+    assert second['retcode'] == 3
+    assert json.loads(second['stdout'].decode('utf-8'))['pid'] == (
+        json.loads(first['stdout'].decode('utf-8'))['pid']
+    )
+
+
+def _caller_worker(mocker, tmpdir, python):
+    worker = SaltBase({}, salt_caller=True)
+    worker.salt_call = 'salt-call'
+    worker.salt_conf_path = 'conf'
+    worker.salt_log_dir = str(tmpdir)
+    mocker.patch.object(worker, '_salt_python', return_value=python)
+    worker._salt_installed = True
+    return worker
+
+
+def test_run_salt_caller(mocker, tmpdir):
+    """run_salt uses the helper, and logs and raises like call_process."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    call_process = mocker.patch.object(worker, 'call_process')
+    error = mocker.patch.object(worker.log, 'error')
+    try:
+        ret = worker.run_salt('test.ping')
+        with pytest.raises(WatchmakerException, match='Exit code=3'):
+            worker.run_salt('fail', log_pipe='stdout')
+    finally:
+        worker._close_salt_caller()
+
+    assert not call_process.called
+    assert json.loads(ret['stdout'].decode('utf-8'))['args'][-1] == (
+        'test.ping'
+    )
+    assert error.call_args_list == [
+        mocker.call('%s%s', 'Command stderr: ', b'warning test.ping')
+    ]
+
+
+def test_run_salt_caller_crash(mocker, tmpdir):
+    """A command that crashes the helper is not run again."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    call_process = mocker.patch.object(
+        worker, 'call_process', return_value={'retcode': 0})
+
+    with pytest.raises(WatchmakerException, match='salt caller exited'):
+        worker.run_salt('crash', raise_error=False)
+    assert not call_process.called
+
+    assert worker.run_salt('test.ping') == {'retcode': 0}
+    assert call_process.call_count == 1
+    assert not worker.salt_caller
+
+
+def test_run_salt_caller_exited(mocker, tmpdir):
+    """A helper that exited between commands falls back to salt-call."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    call_process = mocker.patch.object(
+        worker, 'call_process', return_value={'retcode': 0})
+    worker.run_salt('test.ping')
+    worker._salt_caller.process.kill()
+    worker._salt_caller.process.wait()
+
+    assert worker.run_salt('test.ping') == {'retcode': 0}
+    assert call_process.call_count == 1
+    assert not worker.salt_caller
+
+
+def test_run_salt_caller_no_salt(mocker, tmpdir):
+    """Without salt, the real helper fails to start and salt-call is used."""
+    worker = _caller_worker(mocker, tmpdir, [sys.executable, '-S'])
+    call_process = mocker.patch.object(
+        worker, 'call_process', return_value={'retcode': 0})
+
+    assert worker.run_salt('test.ping') == {'retcode': 0}
+    assert call_process.called
+    assert worker._salt_caller is None
+
+
+def test_run_salt_caller_not_installed(mocker, tmpdir):
+    """Until salt is installed, commands use salt-call."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    worker._salt_installed = False
+    call_process = mocker.patch.object(
+        worker, 'call_process', return_value={'retcode': 0})
+
+    assert worker.run_salt('test.ping') == {'retcode': 0}
+    assert call_process.called
+    assert worker._salt_caller is None
+    assert worker.salt_caller
+    assert not worker._salt_python.called
+
+
+def test_run_salt_caller_log_file(mocker, tmpdir):
+    """A command that sets its own log file uses salt-call."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    call_process = mocker.patch.object(
+        worker, 'call_process', return_value={'retcode': 0})
+    try:
+        worker.run_salt('test.ping')
+        assert not call_process.called
+
+        worker.run_salt(['--log-file', 'later.log', 'state.highstate'])
+    finally:
+        worker._close_salt_caller()
+
+    assert call_process.call_args[0][0][-3:] == [
+        '--log-file', 'later.log', 'state.highstate'
+    ]
+
+
+def test_run_salt_caller_lazy_output(mocker, tmpdir):
+    """A lazy output from the helper is streamed, not held in memory."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    try:
+        ret = worker.run_salt('test.ping', lazy_output=True, spool_size=16)
+    finally:
+        worker._close_salt_caller()
+
+    with ret['stdout'], ret['stderr']:
+        assert isinstance(ret['stdout'], CommandOutput)
+        assert ret['stdout'].spilled
+        assert json.loads(ret['stdout'].read().decode('utf-8'))['args'][
+            -1] == 'test.ping'
+        assert ret['stderr'].read() == b'warning test.ping\n'
+
+
+def test_service_status_salt_caller(mocker, tmpdir):
+    """Service queries run in the salt caller, started once."""
+    worker = _caller_worker(mocker, tmpdir, FAKE_SALT_CALLER)
+    call_process = mocker.patch.object(worker, 'call_process')
+    caller = mocker.spy(watchmaker.workers.salt, 'SaltCaller')
+    try:
+        assert worker.service_status('salt-minion') == (False, False)
+    finally:
+        worker._close_salt_caller()
+
+    assert not call_process.called
+    assert caller.call_count == 1
+
+
+def _state_return(results):
+    return collections.OrderedDict(
+        ('pkg_|-{0}_|-{0}_|-installed'.format(name), {
+            'result': result,
+            'comment': 'comment {0}'.format(name),
+            'changes': {'new': '1.0'} if result else {},
+        })
+        for name, result in results
+    )
+
+
+def _process_states(mocker, stdout, retcode):
+    worker = SaltBase({})
+    worker.salt_state_args = ['--out', 'json']
+    output = CommandOutput(max_size=64)
+    output.write(stdout)
+    run_salt = mocker.patch.object(worker, 'run_salt', return_value={
+        'retcode': retcode, 'stdout': output, 'stderr': CommandOutput()
+    })
+    info = mocker.patch.object(worker.log, 'info')
+    try:
+        worker.process_states('highstate', '')
+    finally:
+        assert run_salt.call_args[0][0] == [
+            '--out', 'json', 'state.highstate'
+        ]
+        assert worker.salt_state_args == ['--out', 'json']
+    return info
+
+
+def test_process_states_failed(mocker):
+    """Failed states are reported as before, from the JSON return."""
+    ret = _state_return([('vim', True), ('emacs', False), ('nano', None)])
+    stdout = json.dumps({'local': ret}, indent=4).encode('utf-8')
+
+    with pytest.raises(WatchmakerException) as exc:
+        _process_states(mocker, stdout, 2)
+
+    assert watchmaker.utils.yaml_safe_load(str(exc.value)) == {
+        'Salt state execution failed': {
+            'emacs': ret['pkg_|-emacs_|-emacs_|-installed']
+        }
+    }
+
+
+def test_process_states_summary(mocker):
+    """The states that ran are counted."""
+    ret = _state_return([('vim', True), ('nano', None)])
+    stdout = json.dumps({'local': ret}).encode('utf-8')
+
+    info = _process_states(mocker, stdout, 0)
+
+    assert mocker.call(
+        'Salt states summary: total=%s, succeeded=%s, failed=%s, '
+        'changed=%s', 2, 1, 0, 1
+    ) in info.call_args_list
+
+
+def test_process_states_error(mocker):
+    """Errors other than failed states are reported as they are."""
+    stdout = json.dumps({'local': ['Rendering SLS failed']}).encode('utf-8')
+
+    with pytest.raises(WatchmakerException) as exc:
+        _process_states(mocker, stdout, 1)
+
+    assert watchmaker.utils.yaml_safe_load(str(exc.value)) == {
+        'Salt state execution failed': ['Rendering SLS failed']
+    }
+
+
+def test_process_states_unreadable(mocker):
+    """A return that cannot be parsed is reported whole."""
+    stdout = b'Traceback (most recent call last):\n  salt crashed\n'
+
+    with pytest.raises(WatchmakerException) as exc:
+        _process_states(mocker, stdout, 1)
+
+    assert watchmaker.utils.yaml_safe_load(str(exc.value)) == {
+        'Salt state execution failed': stdout.decode('utf-8')
+    }
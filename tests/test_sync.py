@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker sync test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import io
+import os
+import shutil
+
+import pytest
+
+from watchmaker.utils.sync import manifest_path, symlink_tree, sync_tree
+
+
+def _write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with io.open(path, 'wb') as fh_:
+        fh_.write(data)
+
+
+def _read(path):
+    with io.open(path, 'rb') as fh_:
+        return fh_.read()
+
+
+def _formula(tmpdir):
+    src = str(tmpdir.join('src', 'ash-linux-formula'))
+    _write(os.path.join(src, 'ash-linux', 'init.sls'), b'include: []')
+    _write(os.path.join(src, 'ash-linux', 'map.jinja'), b'{% set x = 1 %}')
+    _write(os.path.join(src, 'README.md'), b'ash-linux')
+    os.makedirs(os.path.join(src, 'empty'))
+    return src, str(tmpdir.join('dst', 'ash-linux-formula'))
+
+
+def test_sync_tree_copies(tmpdir):
+    """The first sync copies the whole tree and writes the manifest."""
+    src, dst = _formula(tmpdir)
+
+    counts = sync_tree(src, dst)
+
+    assert counts == {'copied': 3, 'removed': 0, 'unchanged': 0}
+    assert _read(os.path.join(dst, 'ash-linux', 'init.sls')) == b'include: []'
+    assert os.path.isdir(os.path.join(dst, 'empty'))
+    assert os.path.isfile(manifest_path(dst))
+
+
+def test_sync_tree_noop(tmpdir, mocker):
+    """A current tree is left alone, without hashing or writing files."""
+    src, dst = _formula(tmpdir)
+    sync_tree(src, dst)
+    manifest_mtime = os.stat(manifest_path(dst)).st_mtime
+    copy = mocker.patch('watchmaker.utils.sync._copy')
+    sha256 = mocker.patch('watchmaker.utils.sync._sha256')
+
+    counts = sync_tree(src, dst)
+
+    assert counts == {'copied': 0, 'removed': 0, 'unchanged': 3}
+    assert not copy.called
+    assert not sha256.called
+    assert os.stat(manifest_path(dst)).st_mtime == manifest_mtime
+
+
+def test_sync_tree_changes(tmpdir):
+    """Only changed files are copied, and stale files are removed."""
+    src, dst = _formula(tmpdir)
+    sync_tree(src, dst)
+
+    _write(os.path.join(src, 'ash-linux', 'init.sls'), b'include: [foo]')
+    os.remove(os.path.join(src, 'README.md'))
+    shutil.rmtree(os.path.join(src, 'empty'))
+    _write(os.path.join(dst, 'ash-linux', 'extra.sls'), b'extra')
+
+    counts = sync_tree(src, dst)
+
+    assert counts == {'copied': 1, 'removed': 2, 'unchanged': 1}
+    assert _read(os.path.join(dst, 'ash-linux', 'init.sls')) == (
+        b'include: [foo]'
+    )
+    assert sorted(os.listdir(dst)) == ['ash-linux']
+    assert sorted(os.listdir(os.path.join(dst, 'ash-linux'))) == [
+        'init.sls', 'map.jinja'
+    ]
+
+
+def test_sync_tree_drift(tmpdir):
+    """Files modified in the target are restored from the source."""
+    src, dst = _formula(tmpdir)
+    sync_tree(src, dst)
+
+    _write(os.path.join(dst, 'ash-linux', 'map.jinja'), b'{% set x = 2 %}')
+
+    counts = sync_tree(src, dst)
+
+    assert counts == {'copied': 1, 'removed': 0, 'unchanged': 2}
+    assert _read(os.path.join(dst, 'ash-linux', 'map.jinja')) == (
+        b'{% set x = 1 %}'
+    )
+
+
+def test_sync_tree_touched(tmpdir):
+    """A source that is only touched is not copied again."""
+    src, dst = _formula(tmpdir)
+    sync_tree(src, dst)
+    path = os.path.join(src, 'README.md')
+    os.utime(path, (0, 0))
+
+    counts = sync_tree(src, dst)
+
+    assert counts == {'copied': 0, 'removed': 0, 'unchanged': 3}
+    assert os.stat(os.path.join(dst, 'README.md')).st_mtime == 0
+
+
+def test_sync_tree_hardlink(tmpdir):
+    """Hard linked files share the bytes of the source."""
+    src, dst = _formula(tmpdir)
+    sync_tree(src, dst)
+
+    counts = sync_tree(src, dst, link=True)
+
+    assert counts == {'copied': 3, 'removed': 0, 'unchanged': 0}
+    assert os.path.samefile(
+        os.path.join(src, 'README.md'), os.path.join(dst, 'README.md')
+    )
+    assert sync_tree(src, dst, link=True)['unchanged'] == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='no symlinks')
+def test_symlink_tree(tmpdir):
+    """The target is replaced by a link, and syncing replaces the link."""
+    src, dst = _formula(tmpdir)
+    sync_tree(src, dst)
+
+    assert symlink_tree(src, dst)
+    assert os.path.islink(dst)
+    assert symlink_tree(src, dst)
+
+    counts = sync_tree(src, dst)
+
+    assert counts['copied'] == 3
+    assert not os.path.islink(dst)
+    assert sorted(os.listdir(src)) == ['README.md', 'ash-linux', 'empty']
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker transport test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import errno
+import gzip
+import io
+import ssl
+
+import pytest
+from six.moves import http_client
+
+import watchmaker.utils
+from watchmaker.utils import urllib
+from watchmaker.utils.urllib import transport
+from watchmaker.utils.urllib.transport import HTTPTransport, PooledResponse
+
+
+def test_urlopen_reuses_connections(http_server):
+    """Consecutive requests to one host share a keep-alive connection."""
+    http_server.files['/a.zip'] = b'a' * 1024
+    http_server.files['/b.zip'] = b'b'
+
+    for _ in range(3):
+        assert watchmaker.utils.urlopen(
+            http_server.url('/a.zip')).read() == b'a' * 1024
+        assert watchmaker.utils.urlopen(
+            http_server.url('/b.zip')).read() == b'b'
+
+    assert len(http_server.requests) == 6
+    assert len(http_server.connections) == 1
+
+
+def test_urlopen_gzip_text_artifacts(http_server):
+    """Text artifacts are gzipped in transit, archives are not."""
+    http_server.files['/config.yaml'] = b'all: []\n' * 100
+    http_server.files['/foo.zip'] = b'foo'
+
+    response = watchmaker.utils.urlopen(http_server.url('/config.yaml'))
+    assert response.info().get('Content-Encoding') == 'gzip'
+    assert response.read(10) + response.read() == b'all: []\n' * 100
+    assert watchmaker.utils.urlopen(http_server.url('/foo.zip')).read() == (
+        b'foo')
+
+    accepted = [
+        headers.get('Accept-Encoding') for _, headers in http_server.requests
+    ]
+    assert accepted == ['gzip', 'identity']
+
+
+def test_urlopen_http_error(http_server):
+    """Error responses raise HTTPError and leave the connection usable."""
+    http_server.files['/foo.zip'] = b'foo'
+    transport = HTTPTransport()
+
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        transport.open(http_server.url('/missing.zip'))
+    assert exc.value.code == 404
+
+    response = transport.open(http_server.url('/foo.zip'))
+    etag = response.info().get('ETag')
+    assert response.read() == b'foo'
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        transport.open(
+            http_server.url('/foo.zip'), headers={'If-None-Match': etag})
+    assert exc.value.code == 304
+    assert transport.open(http_server.url('/foo.zip')).read() == b'foo'
+
+    # The 404 closes its connection, the others share one
+    assert len(http_server.connections) == 2
+
+
+def test_urlopen_proxy(http_server, monkeypatch):
+    """Plain requests go to the proxy from the environment."""
+    monkeypatch.setenv('http_proxy', http_server.url(''))
+    monkeypatch.delenv('no_proxy', raising=False)
+    monkeypatch.delenv('NO_PROXY', raising=False)
+    http_server.files['http://watchmaker.invalid/foo.zip'] = b'foo'
+
+    response = HTTPTransport().open('http://watchmaker.invalid/foo.zip')
+
+    assert response.read() == b'foo'
+    assert http_server.requests[0][1]['Host'] == 'watchmaker.invalid'
+
+
+def test_urlopen_failed_read(http_server):
+    """A read that fails partway discards the connection."""
+    http_server.files['/foo.zip'] = b'f' * 1024
+    http_server.truncate['/foo.zip'] = 100
+    transport = HTTPTransport()
+
+    response = transport.open(http_server.url('/foo.zip'))
+    with pytest.raises(http_client.IncompleteRead):
+        response.read()
+
+    assert response.read() == b''
+    assert not transport._idle
+
+
+def test_download_closes_response(http_server, mocker):
+    """A download that fails partway closes its response."""
+    http_server.files['/foo.zip'] = b'f' * 1024
+    close = mocker.spy(PooledResponse, 'close')
+
+    class _FullDisk(io.BytesIO):
+        def write(self, data):
+            raise IOError(errno.ENOSPC, 'No space left on device')
+
+    with pytest.raises(IOError):
+        watchmaker.utils.download(
+            http_server.url('/foo.zip'), _FullDisk(), max_tries=1)
+
+    assert close.called
+
+
+def test_ssl_context(mocker):
+    """The context loads the system CAs without verifying the server."""
+    mocker.patch.dict(transport._SSL_CONTEXT, clear=True)
+
+    context = transport.ssl_context()
+
+    assert context is transport.ssl_context()
+    assert context.verify_mode == ssl.CERT_NONE
+    assert not context.check_hostname
+
+
+def test_ssl_context_unsupported(mocker):
+    """Without SSL contexts, https connections are made without one."""
+    mocker.patch.dict(transport._SSL_CONTEXT, clear=True)
+    mocker.patch('ssl.create_default_context', side_effect=AttributeError)
+    connection = mocker.patch.object(transport.http_client, 'HTTPSConnection')
+
+    HTTPTransport()._connect(('https', 'example.com', 443, None), None, None)
+
+    connection.assert_called_once_with('example.com', 443)
+
+
+def test_gzip_reader_large_body():
+    """A large gzipped body is decompressed in order, in any read size."""
+    data = b''.join(
+        '{0:08d}\n'.format(index).encode('ascii') for index in range(200000)
+    )
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fh_:
+        fh_.write(data)
+    buf.seek(0)
+    reader = transport._GzipReader(buf)
+
+    chunks = [reader.read(1000), reader.read(70000)]
+    chunks.append(reader.read())
+
+    assert b''.join(chunks) == data
+    assert reader.read(10) == b''
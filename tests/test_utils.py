@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Watchmaker utils test module."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals, with_statement)
+
+import datetime
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import watchmaker.utils
+from watchmaker.utils import urllib
+from watchmaker.utils.json_stream import JSONStream
+from watchmaker.utils.urllib import request_handlers
+from watchmaker.utils.urllib.request_handlers import (S3Handler,
+                                                      S3RangedReader)
+
+
+@pytest.fixture
+def reset_s3_opener():
+    """Discard any S3 opener built by a previous test."""
+    urllib._S3_OPENER.clear()
+    yield
+    urllib._S3_OPENER.clear()
+
+
+def test_urlopen_file_uri(tmpdir):
+    """Local files are opened without building the S3 opener."""
+    path = tmpdir.join('foo.txt')
+    path.write('foo')
+
+    uri = watchmaker.utils.uri_from_filepath(str(path))
+    assert watchmaker.utils.urlopen_retry(uri).read() == b'foo'
+    assert 'opener' not in urllib._S3_OPENER
+
+
+def test_s3_opener_built_once(mocker, reset_s3_opener):
+    """The S3 opener is built on first use and then reused."""
+    mocker.patch.object(urllib, 'has_boto3', return_value=True)
+
+    opener = urllib.s3_opener()
+
+    assert any(isinstance(h, S3Handler) for h in opener.handlers)
+    assert urllib.s3_opener() is opener
+
+
+def test_s3_opener_without_boto3(mocker, reset_s3_opener):
+    """Without boto3, s3 urls fail the same way as an unknown scheme."""
+    mocker.patch.object(urllib, 'has_boto3', return_value=False)
+
+    with pytest.raises(urllib.error.URLError):
+        urllib.urlopen('s3://bucket/key')
+
+
+def test_yaml_safe_roundtrip():
+    """The YAML helpers round-trip data like yaml.safe_load/safe_dump."""
+    import yaml
+
+    data = {'all': [{'salt': {'user_formulas': {'foo': 'https://x/y.zip'}}}]}
+    dumped = watchmaker.utils.yaml_safe_dump(data, default_flow_style=False)
+
+    assert dumped == yaml.safe_dump(data, default_flow_style=False)
+    assert watchmaker.utils.yaml_safe_load(dumped) == data
+
+
+def test_yaml_safe_load_rejects_python_tags():
+    """The YAML loader stays a safe loader."""
+    import yaml
+
+    with pytest.raises(yaml.YAMLError):
+        watchmaker.utils.yaml_safe_load('!!python/object/apply:os.getcwd []')
+
+
+def test_makedirs_and_replace(tmpdir):
+    """Existing directories are kept, and replaced files are overwritten."""
+    path = str(tmpdir.join('a', 'b'))
+    watchmaker.utils.makedirs(path)
+    watchmaker.utils.makedirs(path)
+    tmpdir.join('a', 'src').write('new')
+    tmpdir.join('a', 'b', 'dst').write('old')
+
+    watchmaker.utils.replace(
+        str(tmpdir.join('a', 'src')), str(tmpdir.join('a', 'b', 'dst')))
+
+    assert tmpdir.join('a', 'b', 'dst').read() == 'new'
+    assert not tmpdir.join('a', 'src').exists()
+
+
+def test_download_resumes(http_server, mocker, tmpdir):
+    """A dropped transfer resumes where it stopped."""
+    mocker.patch('time.sleep')
+    data = os.urandom(256 * 1024)
+    http_server.files['/installer.exe'] = data
+    http_server.truncate['/installer.exe'] = 100000
+    target = tmpdir.join('installer.exe')
+
+    with target.open('w+b') as fh_:
+        _, digest = watchmaker.utils.download(
+            http_server.url('/installer.exe'), fh_)
+
+    assert target.read_binary() == data
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert http_server.sent == len(data)
+    headers = http_server.requests[-1][1]
+    assert headers['Range'] == 'bytes=100000-'
+    assert headers['If-Range'] == '"{0}"'.format(digest)
+
+
+def test_download_restarts_changed_file(http_server, mocker, tmpdir):
+    """A file that changed before the transfer resumed is fetched again."""
+    http_server.files['/installer.exe'] = b'a' * 1024
+    http_server.truncate['/installer.exe'] = 100
+
+    def _change(*args):
+        http_server.files['/installer.exe'] = b'b' * 2048
+    mocker.patch('time.sleep', side_effect=_change)
+    target = tmpdir.join('installer.exe')
+
+    with target.open('w+b') as fh_:
+        watchmaker.utils.download(http_server.url('/installer.exe'), fh_)
+
+    assert target.read_binary() == b'b' * 2048
+
+
+def test_s3_ranged_reader_order():
+    """Parts fetched concurrently are read back in order."""
+    data = os.urandom(1000)
+    fetched = []
+
+    def _fetch(first, last):
+        # Finish the parts out of order
+        time.sleep(0.01 * (last % 3))
+        fetched.append(first)
+        return data[first:last + 1]
+
+    reader = S3RangedReader(
+        _fetch, start=10, size=len(data), part_size=64, max_concurrency=4)
+
+    assert reader.read(5) + reader.read(300) + reader.read() == data[10:]
+    assert sorted(fetched) == list(range(10, len(data), 64))
+    assert reader.read(10) == b''
+
+
+@pytest.fixture
+def s3_stub():
+    """Return an S3 client and its botocore stubber."""
+    boto3 = pytest.importorskip('boto3')
+    stub = pytest.importorskip('botocore.stub')
+    client = boto3.client(
+        's3', region_name='us-east-1',
+        aws_access_key_id='test', aws_secret_access_key='test'
+    )
+    with stub.Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def _get_object_response(data, first, total):
+    from botocore.response import StreamingBody
+    return {
+        'Body': StreamingBody(io.BytesIO(data), len(data)),
+        'ContentLength': len(data),
+        'ContentRange': 'bytes {0}-{1}/{2}'.format(
+            first, first + len(data) - 1, total),
+        'ContentType': 'application/zip',
+        'ETag': '"abc"',
+        'LastModified': datetime.datetime(2020, 1, 2, 3, 4, 5),
+    }
+
+
+def test_s3_open_single_round_trip(s3_stub):
+    """A small object costs one GetObject, and no HeadObject."""
+    client, stubber = s3_stub
+    stubber.add_response(
+        'get_object', _get_object_response(b'foo', 0, 3),
+        {'Bucket': 'bucket', 'Key': 'foo.zip', 'Range': 'bytes=0-8388607'}
+    )
+    handler = S3Handler()
+    handler.client = client
+
+    response = urllib.request.build_opener(handler).open(
+        's3://bucket/foo.zip')
+
+    assert response.read() == b'foo'
+    assert response.getcode() == 200
+    assert response.info()['Content-Length'] == '3'
+    assert response.info()['Last-Modified'] == (
+        'Thu, 02 Jan 2020 03:04:05 GMT')
+
+
+def test_s3_open_below_threshold(s3_stub):
+    """Below the threshold, the rest of the object costs one more call."""
+    client, stubber = s3_stub
+    part_size = S3Handler.PART_SIZE
+    data = b'x' * (part_size + 1024 * 1024)
+    stubber.add_response(
+        'get_object', _get_object_response(data[:part_size], 0, len(data)),
+        {
+            'Bucket': 'bucket', 'Key': 'foo.zip',
+            'Range': 'bytes=0-{0}'.format(part_size - 1),
+        }
+    )
+    stubber.add_response(
+        'get_object',
+        _get_object_response(data[part_size:], part_size, len(data)),
+        {
+            'Bucket': 'bucket', 'Key': 'foo.zip', 'IfMatch': '"abc"',
+            'Range': 'bytes={0}-'.format(part_size),
+        }
+    )
+    handler = S3Handler()
+    handler.client = client
+
+    response = urllib.request.build_opener(handler).open(
+        's3://bucket/foo.zip')
+
+    assert response.read() == data
+    assert response.info()['Content-Length'] == str(len(data))
+
+
+def test_s3_open_ranged_round_trips(s3_stub):
+    """A large object costs one GetObject per part."""
+    client, stubber = s3_stub
+    data = b'0123456789abcdef'
+    stubber.add_response(
+        'get_object', _get_object_response(data[:4], 0, len(data)),
+        {'Bucket': 'bucket', 'Key': 'foo.zip', 'Range': 'bytes=0-3'}
+    )
+    for first in range(4, len(data), 4):
+        stubber.add_response(
+            'get_object',
+            _get_object_response(data[first:first + 4], first, len(data)),
+            {
+                'Bucket': 'bucket', 'Key': 'foo.zip', 'IfMatch': '"abc"',
+                'Range': 'bytes={0}-{1}'.format(first, first + 3),
+            }
+        )
+    handler = S3Handler(
+        multipart_threshold=8, part_size=4, max_concurrency=1)
+    handler.client = client
+
+    response = urllib.request.build_opener(handler).open(
+        's3://bucket/foo.zip')
+
+    assert response.read() == data
+    assert response.info()['Content-Length'] == str(len(data))
+
+
+def test_s3_open_not_modified(s3_stub):
+    """A 304 from S3 is raised as an HTTPError."""
+    client, stubber = s3_stub
+    stubber.add_client_error(
+        'get_object', service_error_code='304', http_status_code=304)
+    handler = S3Handler()
+    handler.client = client
+
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        urllib.request.build_opener(handler).open(urllib.request.Request(
+            's3://bucket/foo.zip', headers={'If-None-Match': '"abc"'}))
+    assert exc.value.code == 304
+
+
+def test_s3_client_shared(mocker):
+    """One client is built and shared by all threads."""
+    pytest.importorskip('boto3')
+    mocker.patch.dict(request_handlers._S3_CLIENT, clear=True)
+    clients = []
+
+    threads = [
+        threading.Thread(
+            target=lambda: clients.append(request_handlers.s3_client()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(clients) == 4
+    assert all(client is clients[0] for client in clients)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64])
+def test_json_stream(chunk_size):
+    """Objects are walked member by member across chunk boundaries."""
+    doc = {
+        'local': {
+            'a_|-b': {'result': False, 'n': 123456, 'x': [1, 2.5e10]},
+            'c_|-d': {'result': True, 'comment': 'été'},
+        },
+        'retcode': -12,
+    }
+    data = json.dumps(doc, indent=4).encode('utf-8')
+    stream = JSONStream(
+        data[i:i + chunk_size] for i in range(0, len(data), chunk_size)
+    )
+
+    parsed = {}
+    for key in stream.keys():
+        if stream.peek() == '{':
+            parsed[key] = dict((inner, stream.value())
+                               for inner in stream.keys())
+        else:
+            parsed[key] = stream.value()
+
+    assert parsed == doc
+    assert stream.peek() == ''
+
+
+@pytest.mark.parametrize('chunks,expected', [
+    ([b'{"a":12', b'3}'], {'a': 123}),
+    ([b'{"a":1.', b'25}'], {'a': 1.25}),
+    ([b'{"a":-1.5e', b'3}'], {'a': -1500.0}),
+    ([b'{"a":2e', b'+', b'2}'], {'a': 200.0}),
+    ([b'{"a":-', b'1}'], {'a': -1}),
+])
+def test_json_stream_split_number(chunks, expected):
+    """A number split across chunks is parsed whole."""
+    stream = JSONStream(chunks)
+
+    assert dict((key, stream.value()) for key in stream.keys()) == expected
+
+
+def test_json_stream_large_value(mocker):
+    """A value split across many chunks is not parsed once per chunk."""
+    data = json.dumps(['x' * 4096]).encode('utf-8')
+    stream = JSONStream(data[i:i + 1] for i in range(len(data)))
+    raw_decode = mocker.spy(stream._json, 'raw_decode')
+
+    assert stream.value() == ['x' * 4096]
+    assert raw_decode.call_count < 20
+
+
+def test_json_stream_invalid():
+    """Malformed documents raise ValueError."""
+    stream = JSONStream([b'{"a": 1 "b": 2}'])
+
+    with pytest.raises(ValueError):
+        for _ in stream.keys():
+            stream.value()
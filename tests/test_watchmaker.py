@@ -3,10 +3,41 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
 
+import errno
+import json
+import os
+import subprocess
+import sys
+
 import pytest
 
 import watchmaker
 
+# Maximum seconds `import watchmaker.cli` may take in a fresh interpreter
+IMPORT_BUDGET = float(os.environ.get('WATCHMAKER_IMPORT_BUDGET', '1.0'))
+
+IMPORT_PROBE = '''
+import json, sys, time
+start = time.time()
+import watchmaker.cli
+elapsed = time.time() - start
+print(json.dumps({
+    'elapsed': elapsed,
+    'modules': [m for m in ('boto3', 'pkg_resources', 'setuptools')
+                if m in sys.modules],
+}))
+'''
+
+
+def _probe_import():
+    env = dict(os.environ)
+    src_dir = os.path.dirname(os.path.dirname(watchmaker.__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        x for x in (src_dir, env.get('PYTHONPATH')) if x)
+    out = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_PROBE], env=env)
+    return json.loads(out.decode('utf-8'))
+
 
 @pytest.fixture
 def setup_object():
@@ -17,3 +48,55 @@ def setup_object():
 def test_main():
     """Placeholder for tests."""
     assert watchmaker.__version__ == watchmaker.__version__
+
+
+def test_version_info():
+    """VERSION_INFO is resolved lazily and embeds the version."""
+    assert watchmaker.VERSION_INFO.startswith(
+        'Watchmaker/{0} '.format(watchmaker.__version__))
+
+
+def test_import_budget():
+    """Importing the cli stays fast and skips heavy optional imports."""
+    results = [_probe_import() for _ in range(3)]
+
+    assert not any(result['modules'] for result in results)
+    assert min(result['elapsed'] for result in results) < IMPORT_BUDGET
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason="Uses the Linux system params.")
+def test_client_caches_remote_config(http_server, tmpdir):
+    """A remote config is kept in the download cache."""
+    http_server.files['/config.yaml'] = b'linux:\n  - yum:\n      foo: bar\n'
+
+    watchmaker.Client(watchmaker.Arguments(
+        config_path=http_server.url('/config.yaml'),
+        cache_dir=str(tmpdir)
+    ))
+    client = watchmaker.Client(watchmaker.Arguments(
+        config_path=http_server.url('/config.yaml'),
+        cache_dir=str(tmpdir)
+    ))
+
+    assert client.config['yum']['config']['foo'] == 'bar'
+    assert 'If-None-Match' in http_server.requests[-1][1]
+    assert tmpdir.join('downloads', 'blobs').listdir()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason="Uses the Linux system params.")
+def test_client_reads_config_without_cache(http_server, tmpdir, mocker):
+    """A config is read directly when the download cache is unwritable."""
+    http_server.files['/config.yaml'] = b'linux:\n  - yum:\n      foo: bar\n'
+    mocker.patch(
+        'watchmaker.utils.cache.DownloadCache.fetch',
+        side_effect=OSError(errno.EROFS, 'Read-only file system')
+    )
+
+    client = watchmaker.Client(watchmaker.Arguments(
+        config_path=http_server.url('/config.yaml'),
+        cache_dir=str(tmpdir)
+    ))
+
+    assert client.config['yum']['config']['foo'] == 'bar'